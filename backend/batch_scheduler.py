@@ -0,0 +1,507 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from generation_utils import sample_next_tokens
+from inference_backends import TorchBackend
+from kv_cache import KVCache, slice_kv
+
+
+class QueueFullError(Exception):
+    """Raised when a scheduler already has max_queue_size requests waiting"""
+
+
+class GenerationRequest:
+    """A prompt submitted to a BatchScheduler and the tokens generated for it so far"""
+
+    def __init__(self, prompt: str, tokenizer, max_new_tokens: int = 150,
+                 temperature: float = 0.7, top_p: float = 0.9, adapter_name: Optional[str] = None,
+                 system_prompt: Optional[str] = None, context_ids: Optional[List[int]] = None,
+                 session_id: Optional[str] = None, seed: Optional[int] = None):
+        self.prompt = prompt
+        self.seed = seed
+        # Created on the scheduler's device when the request is admitted
+        self.generator: Optional[torch.Generator] = None
+        self.system_prompt = system_prompt
+        self.context_ids = list(context_ids or [])
+        self.session_id = session_id
+        self.input_ids: List[int] = []
+        # Leading tokens of input_ids worth sharing through the prefix cache (the system prompt)
+        self.prefix_length = 0
+        # Prompt tokens whose keys/values were reused instead of prefilled
+        self.cached_tokens = 0
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.adapter_name = adapter_name
+        self.generated: List[int] = []
+        self.last_token: Optional[int] = None
+        self.finished = False
+        self.cancelled = False
+        # "stop" (end-of-sequence token) or "length" (max_new_tokens or the context window)
+        self.finish_reason: Optional[str] = None
+        # Prompt tokens dropped from the front to fit the context window
+        self.truncated_tokens = 0
+        self.submitted_at = time.time()
+        self.timings: Dict[str, float] = {
+            "queue": 0.0, "tokenize": 0.0, "prefill": 0.0, "decode": 0.0, "detokenize": 0.0
+        }
+        self._prefilled_at: Optional[float] = None
+        # Streaming decodes generated[_prefix_offset:], a few tokens of context before the
+        # unemitted ones at _read_offset, so each step costs the same however long the reply is
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+        # Events are produced on the scheduler thread; async callers get them
+        # through their own event loop, everyone else through a blocking queue
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._events = asyncio.Queue()
+        except RuntimeError:
+            self._loop = None
+            self._events = queue.Queue()
+
+    def _emit(self, event: Dict[str, Any]):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+        else:
+            self._events.put(event)
+
+    def _push(self, token_id: int):
+        """Record a sampled token and emit any newly decoded text"""
+        self.last_token = token_id
+        if token_id == self.tokenizer.eos_token_id:
+            self._finish("stop")
+            return
+
+        self.generated.append(token_id)
+        # Multi-byte characters split across tokens are only emitted once they are complete
+        piece = self._decode_new_text()
+        if piece and not piece.endswith("�"):
+            self._prefix_offset, self._read_offset = self._read_offset, len(self.generated)
+            self._emit({"token": piece, "token_id": token_id, "time": time.time()})
+
+        if len(self.generated) >= self.max_new_tokens:
+            self._finish("length")
+
+    def _decode_new_text(self) -> str:
+        """Text of the tokens generated since the last emitted piece
+
+        The preceding tokens are decoded with them so that spacing which depends
+        on the previous token comes out as it would in the full decode.
+        """
+        start = time.perf_counter()
+        prefix = self.tokenizer.decode(self.generated[self._prefix_offset:self._read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(self.generated[self._prefix_offset:], skip_special_tokens=True)
+        self.timings["detokenize"] += time.perf_counter() - start
+        return text[len(prefix):] if len(text) > len(prefix) else ""
+
+    def _finish(self, reason: str):
+        self.finished = True
+        self.finish_reason = reason
+        # Flush a trailing partial character, then decode the full reply once
+        piece = self._decode_new_text()
+        if piece:
+            self._emit({"token": piece, "token_id": self.last_token, "time": time.time()})
+        start = time.perf_counter()
+        text = self.tokenizer.decode(self.generated, skip_special_tokens=True)
+        self.timings["detokenize"] += time.perf_counter() - start
+        if self._prefilled_at is not None:
+            # Decode time excludes the detokenization done between steps
+            self.timings["decode"] = max(
+                time.perf_counter() - self._prefilled_at - self.timings["detokenize"], 0.0
+            )
+        self._emit({
+            "done": True,
+            "text": text,
+            "input_tokens": len(self.input_ids),
+            "output_tokens": len(self.generated),
+            "cached_tokens": self.cached_tokens,
+            "truncated_tokens": self.truncated_tokens,
+            "finish_reason": self.finish_reason,
+            "timings_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.timings.items()}
+        })
+
+    def _fail(self, error: Exception):
+        self.finished = True
+        self._emit({"error": str(error)})
+
+    def cancel(self):
+        """Ask the scheduler to stop generating for this request (e.g. the client went away)"""
+        self.cancelled = True
+
+    async def stream(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield token events until the request completes or fails"""
+        while True:
+            event = await self._events.get()
+            yield event
+            if event.get("done") or "error" in event:
+                return
+
+    def events(self) -> Iterator[Dict[str, Any]]:
+        """Blocking variant of stream() for callers outside an event loop"""
+        while True:
+            event = self._events.get()
+            yield event
+            if event.get("done") or "error" in event:
+                return
+
+    async def result(self) -> Dict[str, Any]:
+        """Wait for the request to finish and return its final event"""
+        async for event in self.stream():
+            if "error" in event:
+                raise RuntimeError(event["error"])
+        return event
+
+
+class BatchScheduler:
+    """Continuous-batching decoder for a single model.
+
+    Requests join the running batch as soon as they are prefilled and leave it
+    as soon as they finish, so concurrent chats share every forward pass instead
+    of queueing behind each other. Each sequence keeps its own sampling settings.
+
+    When the model is a peft model carrying several LoRA adapters, each request
+    names the adapter it runs with and one batch can mix adapters.
+
+    `model` is either a PyTorch model or an inference backend (see
+    inference_backends) that runs the forward steps, e.g. on onnxruntime.
+
+    With a KVCache, finished session requests leave their keys/values behind
+    so the session's next turn only prefills the new message, and system
+    prompts are cached once and shared by every request that starts with them.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_queue_delay_ms: float = 10,
+                 max_queue_size: int = 64, kv_cache: Optional[KVCache] = None):
+        self.backend = model if hasattr(model, "step") else TorchBackend(model)
+        self.kv_cache = kv_cache
+        self._kv_namespace = f"scheduler-{id(self)}:"
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay_ms / 1000
+        self.device = self.backend.device
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        config = self.backend.config
+        self.max_positions = getattr(config, "n_positions", None) or getattr(
+            config, "max_position_embeddings", 1024
+        )
+        # Held around every forward pass; take it to swap the backend or its adapters safely
+        self.model_lock = threading.Lock()
+
+        # Bounded so callers get backpressure instead of an ever-growing backlog
+        self._pending: "queue.Queue[GenerationRequest]" = queue.Queue(maxsize=max_queue_size)
+        self._active: List[GenerationRequest] = []
+        self._past = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, max_new_tokens: int = 150, temperature: float = 0.7,
+               top_p: float = 0.9, adapter_name: Optional[str] = None, system_prompt: Optional[str] = None,
+               context_ids: Optional[List[int]] = None, session_id: Optional[str] = None,
+               seed: Optional[int] = None) -> GenerationRequest:
+        """Queue a prompt for generation, raising QueueFullError if the backlog is full
+
+        The model sees system_prompt + context_ids + prompt, where context_ids are
+        the tokens of earlier turns (a previous request's input_ids + generated).
+        Requests sharing a session_id reuse each other's KV cache across turns.
+        A seed makes sampling reproducible for this request.
+        """
+        max_new_tokens = max(1, min(max_new_tokens, self.max_positions - 1))
+        request = GenerationRequest(
+            prompt, self.tokenizer, max_new_tokens, temperature, top_p, adapter_name,
+            system_prompt, context_ids, session_id, seed
+        )
+        try:
+            self._pending.put_nowait(request)
+        except queue.Full:
+            raise QueueFullError("Too many requests queued for this model")
+        return request
+
+    @property
+    def queue_size(self) -> int:
+        return self._pending.qsize()
+
+    def stop(self):
+        """Stop the decode loop and fail anything still queued or running"""
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        error = RuntimeError("Model unloaded")
+        for request in self._active:
+            request._fail(error)
+        while not self._pending.empty():
+            self._pending.get_nowait()._fail(error)
+        self._reset()
+        if self.kv_cache is not None:
+            self.kv_cache.drop_namespace(self._kv_namespace)
+
+    def end_session(self, session_id: str):
+        """Forget a chat session's cached keys/values"""
+        if self.kv_cache is not None:
+            self.kv_cache.pop(self._session_key(session_id))
+
+    def _session_key(self, session_id: str) -> str:
+        return f"{self._kv_namespace}session:{session_id}"
+
+    @property
+    def batch_size(self) -> int:
+        return len(self._active)
+
+    def has_requests_for(self, adapter_name: str) -> bool:
+        """Whether any queued or running request uses the given adapter"""
+        with self._pending.mutex:
+            pending = list(self._pending.queue)
+        return any(r.adapter_name == adapter_name and not r.finished for r in list(self._active) + pending)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            admitted = []
+            try:
+                self._drop_cancelled()
+                admitted = self._admit()
+                with torch.no_grad(), self.model_lock:
+                    if admitted:
+                        self._prefill(admitted)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                print(f"Generation error: {e}")
+                for request in set(self._active + admitted):
+                    if not request.finished:
+                        request._fail(e)
+                self._reset()
+
+    def _admit(self) -> List[GenerationRequest]:
+        """Pull queued requests into the batch, waiting briefly to group arrivals when idle"""
+        admitted = []
+        if not self._active:
+            try:
+                admitted.append(self._pending.get(timeout=0.1))
+            except queue.Empty:
+                return admitted
+            deadline = time.time() + self.max_queue_delay
+            while len(admitted) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    admitted.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            while len(self._active) + len(admitted) < self.max_batch_size:
+                try:
+                    admitted.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+        return [r for r in admitted if self._prepare(r)]
+
+    def _prepare(self, request: GenerationRequest) -> bool:
+        """Tokenize a newly admitted prompt on the scheduler thread, off the event loop"""
+        if request.cancelled:
+            request._fail(RuntimeError("Cancelled"))
+            return False
+        request.timings["queue"] = time.time() - request.submitted_at
+        start = time.perf_counter()
+        try:
+            prefix_ids = self.tokenizer.encode(request.system_prompt) if request.system_prompt else []
+            input_ids = prefix_ids + request.context_ids + self.tokenizer.encode(request.prompt)
+        except Exception as e:
+            request._fail(e)
+            return False
+        request.timings["tokenize"] = time.perf_counter() - start
+        # Keep the most recent part of the prompt, reserving room for generation but never
+        # more than half the context window, so a large max_new_tokens cannot crowd out the prompt
+        keep = self.max_positions - min(request.max_new_tokens, self.max_positions // 2)
+        request.input_ids = input_ids[-keep:] or [self.tokenizer.eos_token_id]
+        request.truncated_tokens = max(len(input_ids) - keep, 0)
+        if len(input_ids) <= keep:
+            request.prefix_length = len(prefix_ids)
+        # Generation stops at the context window, whatever was asked for
+        request.max_new_tokens = min(request.max_new_tokens, self.max_positions - len(request.input_ids))
+        if request.seed is not None:
+            request.generator = torch.Generator(device=self.device).manual_seed(request.seed)
+        return True
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        """Run the prompts of newly admitted requests and merge them into the batch"""
+        fresh = []
+        for request in requests:
+            cached = self._lookup_kv(request)
+            if cached is None:
+                fresh.append(request)
+            else:
+                self._prefill_cached(request, *cached)
+        if fresh:
+            self._prefill_batch(fresh)
+
+    def _lookup_kv(self, request: GenerationRequest):
+        if self.kv_cache is None:
+            return None
+        keys = [self._session_key(request.session_id)] if request.session_id else []
+        return self.kv_cache.lookup(
+            keys, f"{self._kv_namespace}prefix:", request.input_ids, request.adapter_name
+        )
+
+    def _prefill_cached(self, request: GenerationRequest, cached_length: int, past):
+        """Prefill only the part of a prompt that follows its cached prefix"""
+        request.cached_tokens = cached_length
+        input_ids = torch.tensor([request.input_ids[cached_length:]], device=self.device)
+        attention_mask = torch.ones((1, len(request.input_ids)), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(cached_length, len(request.input_ids), device=self.device).unsqueeze(0)
+
+        start = time.perf_counter()
+        logits, past = self.backend.step(input_ids, attention_mask, position_ids, past, [request.adapter_name])
+        self._mark_prefilled([request], start)
+        self._merge([request], past, attention_mask)
+        self._sample([request], logits)
+
+    def _prefill_batch(self, requests: List[GenerationRequest]):
+        """Prefill uncached prompts together, left-padded to a common length"""
+        max_len = max(len(r.input_ids) for r in requests)
+        input_ids = torch.full((len(requests), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), max_len), dtype=torch.long)
+        for i, request in enumerate(requests):
+            # Left-pad so every prompt ends at the same position
+            input_ids[i, max_len - len(request.input_ids):] = torch.tensor(request.input_ids)
+            attention_mask[i, max_len - len(request.input_ids):] = 1
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        start = time.perf_counter()
+        logits, past = self.backend.step(
+            input_ids, attention_mask, position_ids, None, [r.adapter_name for r in requests]
+        )
+        self._mark_prefilled(requests, start)
+        self._store_prefixes(requests, past, max_len)
+        self._merge(requests, past, attention_mask)
+        self._sample(requests, logits)
+
+    def _mark_prefilled(self, requests: List[GenerationRequest], start: float):
+        """Record prefill time; requests prefilled together share the forward pass's time"""
+        now = time.perf_counter()
+        for request in requests:
+            request.timings["prefill"] = now - start
+            request._prefilled_at = now
+
+    def _store_prefixes(self, requests: List[GenerationRequest], past, max_len: int):
+        """Cache the system prompt part of freshly prefilled prompts for other requests to share"""
+        if self.kv_cache is None:
+            return
+        for i, request in enumerate(requests):
+            if request.prefix_length == 0:
+                continue
+            prefix = request.input_ids[:request.prefix_length]
+            key = f"{self._kv_namespace}prefix:{request.adapter_name}:{hash(tuple(prefix))}"
+            if key not in self.kv_cache:
+                start = max_len - len(request.input_ids)
+                self.kv_cache.store(key, prefix, slice_kv(past, i, start, start + len(prefix)), request.adapter_name)
+
+    def _store_sessions(self):
+        """Keep the cache of session requests that just completed for the session's next turn"""
+        if self.kv_cache is None:
+            return
+        for i, request in enumerate(self._active):
+            if not (request.finished and request.session_id and not request.cancelled):
+                continue
+            start = int(self._attention_mask[i].nonzero()[0])
+            # The cache holds every token fed so far: the prompt and all but the last sampled token
+            tokens = (request.input_ids + request.generated)[:self._attention_mask.shape[1] - start]
+            self.kv_cache.store(
+                self._session_key(request.session_id), tokens,
+                slice_kv(self._past, i, start), request.adapter_name
+            )
+
+    def _decode_step(self):
+        """Advance every active sequence by one token"""
+        input_ids = torch.tensor([[r.last_token] for r in self._active], device=self.device)
+        position_ids = self._attention_mask.sum(-1, keepdim=True)
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones_like(self._attention_mask[:, :1])], dim=-1
+        )
+
+        logits, self._past = self.backend.step(
+            input_ids, attention_mask, position_ids, self._past, [r.adapter_name for r in self._active]
+        )
+        self._attention_mask = attention_mask
+        self._sample(list(self._active), logits)
+
+    def _sample(self, requests: List[GenerationRequest], logits: torch.Tensor):
+        """Sample the next token for each request and drop sequences that finished"""
+        next_tokens = sample_next_tokens(
+            logits,
+            [r.temperature for r in requests],
+            [r.top_p for r in requests],
+            [r.generator for r in requests]
+        ).tolist()
+        for request, token_id in zip(requests, next_tokens):
+            request._push(token_id)
+            if len(request.input_ids) + len(request.generated) >= self.max_positions and not request.finished:
+                request._finish("length")
+        self._drop_finished()
+
+    def _merge(self, requests: List[GenerationRequest], past, attention_mask: torch.Tensor):
+        """Append prefilled sequences to the running batch, left-padding the shorter cache"""
+        if not self._active:
+            self._past, self._attention_mask = past, attention_mask
+        else:
+            target = max(self._attention_mask.shape[1], attention_mask.shape[1])
+            self._past = tuple(
+                (
+                    torch.cat([_left_pad(old_k, target), _left_pad(new_k, target)], dim=0),
+                    torch.cat([_left_pad(old_v, target), _left_pad(new_v, target)], dim=0)
+                )
+                for (old_k, old_v), (new_k, new_v) in zip(self._past, past)
+            )
+            self._attention_mask = torch.cat(
+                [_left_pad(self._attention_mask, target), _left_pad(attention_mask, target)], dim=0
+            )
+        self._active.extend(requests)
+
+    def _drop_cancelled(self):
+        cancelled = [r for r in self._active if r.cancelled and not r.finished]
+        for request in cancelled:
+            request._fail(RuntimeError("Cancelled"))
+        if cancelled:
+            self._drop_finished()
+
+    def _drop_finished(self):
+        self._store_sessions()
+        keep = [i for i, r in enumerate(self._active) if not r.finished]
+        if not keep:
+            self._reset()
+            return
+        if len(keep) == len(self._active):
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        self._active = [self._active[i] for i in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        # Trim columns that are padding for every remaining sequence
+        start = int(self._attention_mask.any(dim=0).nonzero()[0])
+        self._attention_mask = self._attention_mask[:, start:]
+        self._past = tuple(
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in self._past
+        )
+
+    def _reset(self):
+        self._active = []
+        self._past = None
+        self._attention_mask = None
+
+
+def _left_pad(tensor: torch.Tensor, target: int) -> torch.Tensor:
+    """Zero-pad the sequence dimension of a mask [B, L] or cache tensor [B, H, L, D] on the left"""
+    if tensor.dim() == 2:
+        return F.pad(tensor, (target - tensor.shape[1], 0))
+    return F.pad(tensor, (0, 0, target - tensor.shape[2], 0))
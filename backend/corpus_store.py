@@ -0,0 +1,144 @@
+import hashlib
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+
+class CorpusStore:
+    """Append-only corpus of text documents backed by memory-mapped files.
+
+    Documents are stored back to back as UTF-8 in `corpus.bin`, and `corpus.idx`
+    holds the little-endian uint64 end offset of each one. Opening a store only
+    maps the two files, so it costs the same whatever the corpus size, and any
+    document can be read without touching the rest.
+    """
+
+    DATA_FILE = "corpus.bin"
+    INDEX_FILE = "corpus.idx"
+    LEGACY_FILE = "corpus.json"
+
+    def __init__(self, project_dir: Path):
+        self.project_dir = Path(project_dir)
+        self.data_path = self.project_dir / self.DATA_FILE
+        self.index_path = self.project_dir / self.INDEX_FILE
+        self._data = None
+        self._offsets = np.zeros(0, dtype="<u8")
+
+        if not self.index_path.exists() and (self.project_dir / self.LEGACY_FILE).exists():
+            self._migrate_json()
+        self._open()
+
+    def _open(self):
+        """Map the data and index files for reading"""
+        self.close()
+        if not self.index_path.exists():
+            return
+
+        index_bytes = self.index_path.stat().st_size // 8 * 8
+        if index_bytes:
+            self._offsets = np.memmap(self.index_path, dtype="<u8", mode="r", shape=(index_bytes // 8,))
+        if self.data_path.exists() and self.data_path.stat().st_size:
+            with open(self.data_path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+        self._data = None
+        self._offsets = np.zeros(0, dtype="<u8")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _span(self, index: int) -> Tuple[int, int]:
+        start = int(self._offsets[index - 1]) if index > 0 else 0
+        return start, int(self._offsets[index])
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("corpus index out of range")
+        start, end = self._span(index)
+        return self._data[start:end].decode("utf-8") if end > start else ""
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def total_bytes(self) -> int:
+        return int(self._offsets[-1]) if len(self) else 0
+
+    def fingerprint(self, num_docs: int) -> str:
+        """Identity of the first `num_docs` documents, for caches built from the corpus
+
+        Combines the document count and byte length with a hash of the first
+        and last of those documents, so it costs the same at any corpus size.
+        Appending documents keeps the fingerprint of the earlier ones, while a
+        cleared or replaced corpus almost certainly changes it.
+        """
+        if num_docs > len(self):
+            return ""
+        end = int(self._offsets[num_docs - 1]) if num_docs else 0
+        hasher = hashlib.sha256(f"{num_docs}:{end}".encode("ascii"))
+        for index in sorted({0, num_docs - 1}) if num_docs else ():
+            start, stop = self._span(index)
+            hasher.update(self._data[start:stop] if stop > start else b"")
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    def append(self, texts: Iterable[str]) -> Tuple[int, int]:
+        """Append documents to the corpus, returning how many texts and characters were added"""
+        self.project_dir.mkdir(parents=True, exist_ok=True)
+        offset = self.total_bytes
+        self.close()
+
+        count = 0
+        total_chars = 0
+        pending_offsets = []
+        with open(self.data_path, "ab") as data_file, open(self.index_path, "ab") as index_file:
+            # Drop anything written after the last indexed document by an interrupted append
+            data_file.truncate(offset)
+            index_file.truncate(index_file.tell() // 8 * 8)
+            for text in texts:
+                encoded = text.encode("utf-8")
+                data_file.write(encoded)
+                offset += len(encoded)
+                pending_offsets.append(offset)
+                count += 1
+                total_chars += len(text)
+                if len(pending_offsets) >= 4096:
+                    self._flush_offsets(data_file, index_file, pending_offsets)
+            self._flush_offsets(data_file, index_file, pending_offsets)
+
+        self._open()
+        return count, total_chars
+
+    @staticmethod
+    def _flush_offsets(data_file, index_file, offsets):
+        # The index is only written once the bytes it points at are on disk
+        data_file.flush()
+        index_file.write(np.asarray(offsets, dtype="<u8").tobytes())
+        index_file.flush()
+        offsets.clear()
+
+    def clear(self):
+        """Remove every document from the corpus"""
+        self.close()
+        for path in (self.data_path, self.index_path):
+            if path.exists():
+                path.unlink()
+
+    def _migrate_json(self):
+        """One-time conversion of a legacy corpus.json into the binary format"""
+        legacy_path = self.project_dir / self.LEGACY_FILE
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            texts = json.load(f).get("texts", [])
+        self.append(texts)
+        os.replace(legacy_path, legacy_path.with_suffix(".json.migrated"))
+        print(f"Migrated {len(texts)} texts from {legacy_path} to {self.data_path}")
@@ -1,12 +1,17 @@
 import os
 import json
-import pandas as pd
-import pdfplumber
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
-from transformers import AutoTokenizer
-from datasets import Dataset
-import torch
+from typing import Callable, List, Dict, Any, Iterable, Iterator, Optional, Tuple, TYPE_CHECKING
+
+from corpus_store import CorpusStore
+
+# Format parsers (pandas, pdfplumber) and the tokenization stack (torch,
+# transformers) are imported on first use, so the training API starts quickly
+if TYPE_CHECKING:
+    from torch.utils.data import Dataset as TorchDataset
+    from dedup import Deduplicator
 
 class DataProcessor:
     def __init__(self, workspace_dir: str = None):
@@ -16,80 +21,192 @@ class DataProcessor:
         else:
             self.workspace_dir = Path(workspace_dir)
         self.workspace_dir.mkdir(parents=True, exist_ok=True)
+        self._project_locks: Dict[str, threading.RLock] = {}
+        self._project_locks_guard = threading.Lock()
+    
+    # Plain text is split into documents of roughly this many characters, on paragraph
+    # boundaries where possible, so a large file never has to be held in memory at once
+    TXT_CHUNK_CHARS = 64_000
+    CSV_CHUNK_ROWS = 10_000
+    
+    # PDFs with at least PDF_PARALLEL_MIN_PAGES pages (in total, for a batch) are extracted
+    # by a pool of PDF_WORKERS processes, PDF_PAGES_PER_TASK pages at a time; a task that
+    # takes over PDF_PAGE_TIMEOUT seconds per page is skipped
+    PDF_WORKERS = int(os.environ.get("LLM_PDF_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+    PDF_PARALLEL_MIN_PAGES = 16
+    PDF_PAGES_PER_TASK = 4
+    PDF_PAGE_TIMEOUT = float(os.environ.get("LLM_PDF_PAGE_TIMEOUT", "60"))
     
     def process_upload(self, file_path: str, file_type: str) -> List[str]:
         """Process uploaded file and extract text content"""
-        texts = []
+        return list(self.iter_upload(file_path, file_type))
+    
+    def iter_upload(self, file_path: str, file_type: str,
+                    on_progress: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """Stream text documents out of an uploaded file without loading it whole
         
+        `on_progress` is called with (pages done, total pages) while a PDF is extracted.
+        """
         if file_type == "txt":
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                texts = [content]
+            yield from self._iter_txt(file_path)
         
         elif file_type == "jsonl":
             with open(file_path, 'r', encoding='utf-8') as f:
                 for line in f:
+                    if not line.strip():
+                        continue
                     data = json.loads(line)
                     if 'text' in data:
-                        texts.append(data['text'])
+                        yield data['text']
                     elif 'content' in data:
-                        texts.append(data['content'])
+                        yield data['content']
         
         elif file_type == "csv":
-            df = pd.read_csv(file_path)
+            import pandas as pd
+            
             text_columns = ['text', 'content', 'story', 'message']
-            for col in text_columns:
-                if col in df.columns:
-                    texts.extend(df[col].dropna().tolist())
-                    break
+            column = None
+            with pd.read_csv(file_path, chunksize=self.CSV_CHUNK_ROWS) as reader:
+                for chunk in reader:
+                    if column is None:
+                        column = next((col for col in text_columns if col in chunk.columns), None)
+                        if column is None:
+                            return
+                    yield from chunk[column].dropna().tolist()
         
         elif file_type == "pdf":
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
+            yield from (text for _, text in self.iter_uploads([(file_path, "pdf")], on_progress))
+    
+    def iter_uploads(self, files: List[Tuple[str, str]],
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[int, str]]:
+        """Stream (file index, document) pairs out of several uploaded files, file by file in order
+        
+        The pages of every PDF in the batch are queued on one process pool up
+        front, so workers extract later files while earlier ones are saved.
+        `on_progress` is called with (pages done, total pages) across all PDFs.
+        """
+        from pdf_extract import ParallelPdfExtractor, count_pages, iter_page_texts
+        
+        pdf_pages = {}
+        pages_before = {}
+        total_pages = 0
+        for i, (path, file_type) in enumerate(files):
+            if file_type == "pdf":
+                pdf_pages[i] = count_pages(path)
+                pages_before[i] = total_pages
+                total_pages += pdf_pages[i]
+        
+        def report(i: int, done: int):
+            if on_progress:
+                on_progress(pages_before[i] + done, total_pages)
+        
+        if total_pages < self.PDF_PARALLEL_MIN_PAGES or self.PDF_WORKERS <= 1:
+            for i, (path, file_type) in enumerate(files):
+                if file_type != "pdf":
+                    yield from ((i, text) for text in self.iter_upload(path, file_type))
+                    continue
+                for page, text in enumerate(iter_page_texts(path), 1):
                     if text:
-                        texts.append(text)
+                        yield i, text
+                    report(i, page)
+            return
         
-        return texts
+        tasks = -(-total_pages // self.PDF_PAGES_PER_TASK)
+        with ParallelPdfExtractor(min(self.PDF_WORKERS, tasks), self.PDF_PAGES_PER_TASK,
+                                  self.PDF_PAGE_TIMEOUT) as extractor:
+            jobs = {i: extractor.submit(files[i][0], pdf_pages[i]) for i in pdf_pages}
+            for i, (path, file_type) in enumerate(files):
+                if file_type == "pdf":
+                    texts = extractor.texts(jobs[i], lambda done, _, i=i: report(i, done))
+                else:
+                    texts = self.iter_upload(path, file_type)
+                yield from ((i, text) for text in texts)
     
-    def prepare_training_data(self, texts: List[str], tokenizer_name: str, max_length: int = 512) -> Dataset:
-        """Tokenize and prepare data for training"""
-        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
-        
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
-        
-        def tokenize_function(examples):
-            return tokenizer(
-                examples["text"],
-                truncation=True,
-                padding="max_length",
-                max_length=max_length,
-                return_tensors="pt"
-            )
-        
-        dataset = Dataset.from_dict({"text": texts})
-        tokenized_dataset = dataset.map(tokenize_function, batched=True)
-        
-        return tokenized_dataset
+    def _iter_txt(self, file_path: str) -> Iterator[str]:
+        buffer = []
+        buffered_chars = 0
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                buffer.append(line)
+                buffered_chars += len(line)
+                at_paragraph_break = not line.strip()
+                if buffered_chars >= self.TXT_CHUNK_CHARS and (
+                    at_paragraph_break or buffered_chars >= 2 * self.TXT_CHUNK_CHARS
+                ):
+                    yield "".join(buffer)
+                    buffer = []
+                    buffered_chars = 0
+        if buffer:
+            yield "".join(buffer)
     
-    def save_corpus(self, project_slug: str, texts: List[str]):
-        """Save processed corpus to workspace"""
-        project_dir = self.workspace_dir / project_slug
-        project_dir.mkdir(exist_ok=True)
-        
-        corpus_file = project_dir / "corpus.json"
-        with open(corpus_file, 'w', encoding='utf-8') as f:
-            json.dump({"texts": texts}, f, indent=2)
+    def prepare_training_data(self, texts: Iterable[str], tokenizer_name: str,
+                              max_length: int = 512, packing: str = "pack") -> "TorchDataset":
+        """Tokenize and prepare data for training.
+        
+        Token ids are cached next to the corpus, so an unchanged corpus is not
+        tokenized again and an appended one only tokenizes the new documents.
+        `packing` picks how documents become fixed-size samples: "pack"
+        concatenates them into full blocks, "bucket" splits them into unpadded
+        windows batched by length, and "pad" truncates and pads each one.
+        """
+        from token_cache import PACKING_MODES, TokenShardCache
+        
+        if packing not in PACKING_MODES:
+            raise ValueError(f"Unknown packing mode: {packing}")
+        
+        workspace = None
+        if not isinstance(texts, CorpusStore):
+            # Ad-hoc texts get a throwaway store so they go through the same pipeline
+            workspace = tempfile.TemporaryDirectory(prefix="corpus-", ignore_cleanup_errors=True)
+            corpus = CorpusStore(Path(workspace.name))
+            corpus.append(texts)
+            texts = corpus
+        
+        cache = TokenShardCache(texts, tokenizer_name)
+        shards = cache.open_shards(cache.sync())
+        dataset = PACKING_MODES[packing](shards, max_length)
+        if workspace is not None:
+            texts.close()
+            # The dataset reads the token cache inside the throwaway store, which is
+            # deleted when the dataset is garbage collected
+            dataset.workspace = workspace
+        return dataset
+    
+    def project_lock(self, project_slug: str) -> threading.RLock:
+        """Lock serializing writes to a project's corpus, duplicate index and retrieval index
+        
+        The stores are appended to in place and are not safe to write from two
+        threads at once; hold this for the whole of an upload.
+        """
+        with self._project_locks_guard:
+            return self._project_locks.setdefault(project_slug, threading.RLock())
+    
+    def save_corpus(self, project_slug: str, texts: Iterable[str], append: bool = True) -> Tuple[int, int]:
+        """Add processed texts to the project's corpus, streaming them to disk one at a time.
+        
+        Returns the number of texts and total characters written.
+        """
+        with self.project_lock(project_slug):
+            corpus = CorpusStore(self.workspace_dir / project_slug)
+            if not append:
+                corpus.clear()
+            return corpus.append(texts)
+    
+    def deduplicator(self, project_slug: str) -> "Deduplicator":
+        """Filter for exact and near-duplicate documents about to be appended to the project's corpus"""
+        from dedup import Deduplicator
+        
+        return Deduplicator(self.load_corpus(project_slug))
+    
+    def update_rag_index(self, project_slug: str) -> Dict[str, Any]:
+        """Embed documents appended since the last update into the project's retrieval index"""
+        from rag_index import RagIndex
+        
+        return RagIndex(self.load_corpus(project_slug)).sync()
     
-    def load_corpus(self, project_slug: str) -> List[str]:
-        """Load previously saved corpus"""
-        corpus_file = self.workspace_dir / project_slug / "corpus.json"
-        if corpus_file.exists():
-            with open(corpus_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("texts", [])
-        return []
+    def load_corpus(self, project_slug: str) -> CorpusStore:
+        """Open previously saved corpus (memory-mapped, so this is cheap at any size)"""
+        return CorpusStore(self.workspace_dir / project_slug)
     
     def get_project_list(self) -> List[str]:
         """Get list of existing projects"""
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from corpus_store import CorpusStore
+
+# Documents whose estimated MinHash (Jaccard) similarity to an earlier one reaches this are dropped
+DEFAULT_THRESHOLD = float(os.environ.get("LLM_DEDUP_THRESHOLD", "0.8"))
+
+# Rough size of a BPE token in English text, for reporting the tokens deduplication saved
+CHARS_PER_TOKEN = 4
+
+WORD_RE = re.compile(r"\w+")
+DIGITS_RE = re.compile(r"\d+")
+
+# (key, document) pairs of the exact-hash and LSH band tables
+TABLE_DTYPE = np.dtype([("key", "<u8"), ("doc", "<u4")])
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class _SortedTable:
+    """Multimap from uint64 keys to document numbers, kept sorted on disk.
+
+    Lookups are binary searches over the memory-mapped file, so only the pages
+    they touch are read. New entries wait in memory until `merge` rewrites the
+    file with them in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._table = np.zeros(0, dtype=TABLE_DTYPE)
+        self._pending: Dict[int, List[int]] = {}
+        self.pending_entries = 0
+
+    def open(self):
+        entries = self.path.stat().st_size // TABLE_DTYPE.itemsize if self.path.exists() else 0
+        self._table = (np.memmap(self.path, dtype=TABLE_DTYPE, mode="r", shape=(entries,))
+                       if entries else np.zeros(0, dtype=TABLE_DTYPE))
+
+    def lookup(self, keys: List[int]) -> List[int]:
+        """Documents stored under any of the keys"""
+        docs = []
+        if len(self._table):
+            key_array = np.asarray(keys, dtype="<u8")
+            stored = self._table["key"]
+            left = np.searchsorted(stored, key_array, side="left")
+            right = np.searchsorted(stored, key_array, side="right")
+            for start, end in zip(left, right):
+                docs.extend(int(doc) for doc in self._table["doc"][start:end])
+        for key in keys:
+            docs.extend(self._pending.get(key, ()))
+        return docs
+
+    def add(self, keys: List[int], doc: int):
+        for key in keys:
+            self._pending.setdefault(key, []).append(doc)
+        self.pending_entries += len(keys)
+
+    def discard_pending(self):
+        self._pending.clear()
+        self.pending_entries = 0
+
+    def merge(self, max_doc: Optional[int] = None):
+        """Write pending entries into the file, dropping stored entries for documents >= max_doc"""
+        if not self._pending and max_doc is None:
+            return
+        table = np.asarray(self._table)
+        if max_doc is not None:
+            table = table[table["doc"] < max_doc]
+        added = np.empty(self.pending_entries, dtype=TABLE_DTYPE)
+        i = 0
+        for key, docs in self._pending.items():
+            added["key"][i:i + len(docs)] = key
+            added["doc"][i:i + len(docs)] = docs
+            i += len(docs)
+        table = np.concatenate([table, added])
+        table = table[np.argsort(table["key"], kind="stable")]
+
+        self._table = np.zeros(0, dtype=TABLE_DTYPE)
+        tmp_path = self.path.with_suffix(".tmp")
+        table.tofile(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.discard_pending()
+        self.open()
+
+
+class Deduplicator:
+    """Drops exact and near-duplicate documents before they reach a project's corpus.
+
+    Exact duplicates are found by a 64-bit hash of the case- and whitespace-
+    normalised text. Near duplicates are found with MinHash signatures over
+    word 3-grams and locality-sensitive hashing: a signature's NUM_PERM values
+    are split into BANDS bands, documents sharing any band are candidates, and
+    a candidate whose estimated Jaccard similarity reaches `threshold` makes the
+    new document a duplicate. With `strip_edges`, first and last lines repeated
+    across pages (headers, footers, page numbers) are removed as well.
+
+    The hash tables and signatures live in `dedup/` under the project and are
+    searched on disk, with at most FLUSH_DOCS documents' entries held in
+    memory, so memory stays bounded however large the corpus grows. Like the
+    token cache the state is validated against the fingerprint of the documents
+    it covers: documents appended without deduplication are indexed (not removed)
+    on the next open, and a replaced corpus starts the state over.
+
+    Use as a context manager around one upload: state is committed on a clean
+    exit and the documents of a failed upload are forgotten.
+    """
+
+    NUM_PERM = 64
+    BANDS = 16
+    SHINGLE_WORDS = 3
+    # Documents shorter than this are only checked for exact duplicates
+    MIN_NEAR_DUP_WORDS = 2 * SHINGLE_WORDS
+    MAX_CANDIDATES = 64
+    FLUSH_DOCS = 100_000
+    # Header/footer detection: lines up to EDGE_LINE_CHARS long are stripped once they
+    # have started or ended EDGE_LINE_REPEATS pages; at most EDGE_LINES_TRACKED are counted
+    EDGE_LINE_CHARS = 120
+    EDGE_LINE_REPEATS = 3
+    EDGE_LINES_TRACKED = 100_000
+
+    # Permutations are taken modulo a 31-bit prime so a * x never overflows 64 bits
+    _MERSENNE_PRIME = (1 << 31) - 1
+
+    def __init__(self, corpus: CorpusStore, threshold: float = DEFAULT_THRESHOLD):
+        self.corpus = corpus
+        self.threshold = threshold
+        self.dedup_dir = corpus.project_dir / "dedup"
+        self.meta_path = self.dedup_dir / "meta.json"
+        self.signatures_path = self.dedup_dir / "signatures.u4"
+        self._exact = _SortedTable(self.dedup_dir / "exact.tbl")
+        self._bands = _SortedTable(self.dedup_dir / "bands.tbl")
+        self._signatures = np.zeros((0, self.NUM_PERM), dtype="<u4")
+        self._pending_signatures: List[np.ndarray] = []
+        self._edge_lines: Dict[str, int] = {}
+
+        # Fixed permutations, so signatures stay comparable across sessions
+        rng = np.random.default_rng(0)
+        self._perm_a = rng.integers(1, self._MERSENNE_PRIME, self.NUM_PERM, dtype=np.uint64)[:, None]
+        self._perm_b = rng.integers(0, self._MERSENNE_PRIME, self.NUM_PERM, dtype=np.uint64)[:, None]
+
+        self.stats = {
+            "documents": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "boilerplate_lines": 0,
+            "chars_removed": 0,
+            "estimated_tokens_saved": 0
+        }
+        self._sync()
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.meta_path.exists():
+            return None
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def _save_meta(self, meta: Dict[str, Any]):
+        tmp_path = self.meta_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _new_meta(self) -> Dict[str, Any]:
+        return {
+            "num_perm": self.NUM_PERM,
+            "bands": self.BANDS,
+            "shingle_words": self.SHINGLE_WORDS,
+            "num_docs": 0,
+            "corpus_fingerprint": self.corpus.fingerprint(0),
+            "dirty": False
+        }
+
+    def _sync(self):
+        """Bring the state up to date with the corpus before new documents are checked"""
+        meta = self._load_meta()
+        if meta is not None and (meta.get("corpus_fingerprint") != self.corpus.fingerprint(meta["num_docs"])
+                                 or (meta["num_perm"], meta["bands"], meta["shingle_words"])
+                                 != (self.NUM_PERM, self.BANDS, self.SHINGLE_WORDS)):
+            print(f"Corpus changed, rebuilding duplicate index in {self.dedup_dir}")
+            meta = None
+
+        if meta is None:
+            self.dedup_dir.mkdir(parents=True, exist_ok=True)
+            for path in (self.signatures_path, self._exact.path, self._bands.path):
+                path.unlink(missing_ok=True)
+            meta = self._new_meta()
+        self.meta = meta
+
+        num_docs = meta["num_docs"]
+        # Drop entries written by an upload that failed part way
+        with open(self.signatures_path, "ab") as f:
+            f.truncate(num_docs * self.NUM_PERM * 4)
+        self._exact.open()
+        self._bands.open()
+        if meta["dirty"]:
+            self._exact.merge(max_doc=num_docs)
+            self._bands.merge(max_doc=num_docs)
+        self._open_signatures()
+
+        # Documents added while deduplication was off are checked against from now on
+        self._next_doc = num_docs
+        for doc in range(num_docs, len(self.corpus)):
+            text = self.corpus[doc]
+            self._add(_hash64(_normalize(text).encode("utf-8")), self._signature(text))
+
+    def _open_signatures(self):
+        rows = self.signatures_path.stat().st_size // (self.NUM_PERM * 4)
+        self._signatures = (np.memmap(self.signatures_path, dtype="<u4", mode="r", shape=(rows, self.NUM_PERM))
+                            if rows else np.zeros((0, self.NUM_PERM), dtype="<u4"))
+
+    def _signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature of the text's word 3-grams (None for very short texts)"""
+        words = WORD_RE.findall(text.lower())
+        if len(words) < self.MIN_NEAR_DUP_WORDS:
+            return None
+        shingles = {" ".join(words[i:i + self.SHINGLE_WORDS]) for i in range(len(words) - self.SHINGLE_WORDS + 1)}
+        prime = np.uint64(self._MERSENNE_PRIME)
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # Each row is one random permutation h(x) = (a*x + b) mod p of the shingle hashes
+        permuted = (self._perm_a * (hashes % prime) + self._perm_b) % prime
+        return permuted.min(axis=1).astype("<u4")
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        return [_hash64(bytes([band]) + rows.tobytes())
+                for band, rows in enumerate(signature.reshape(self.BANDS, -1))]
+
+    def _signature_of(self, doc: int) -> np.ndarray:
+        if doc < len(self._signatures):
+            return self._signatures[doc]
+        return self._pending_signatures[doc - len(self._signatures)]
+
+    def _is_near_duplicate(self, signature: np.ndarray, band_keys: List[int]) -> bool:
+        candidates = list(dict.fromkeys(self._bands.lookup(band_keys)))[:self.MAX_CANDIDATES]
+        if not candidates:
+            return False
+        similarity = (np.stack([self._signature_of(doc) for doc in candidates]) == signature).mean(axis=1)
+        return bool(similarity.max() >= self.threshold)
+
+    def _add(self, exact_key: int, signature: Optional[np.ndarray]):
+        """Record a kept document, as the next document of the corpus"""
+        doc = self._next_doc
+        self._exact.add([exact_key], doc)
+        if signature is not None:
+            self._bands.add(self._band_keys(signature), doc)
+        # Short documents get an all-zero row so rows stay aligned with document numbers
+        self._pending_signatures.append(signature if signature is not None
+                                        else np.zeros(self.NUM_PERM, dtype="<u4"))
+        self._next_doc += 1
+        if len(self._pending_signatures) >= self.FLUSH_DOCS:
+            self._flush()
+
+    def _flush(self):
+        """Move in-memory entries to disk, marking the state as covering an unfinished upload"""
+        if not self.meta["dirty"]:
+            self.meta["dirty"] = True
+            self._save_meta(self.meta)
+        if self._pending_signatures:
+            self._signatures = np.zeros((0, self.NUM_PERM), dtype="<u4")
+            with open(self.signatures_path, "ab") as f:
+                f.write(np.stack(self._pending_signatures).astype("<u4").tobytes())
+            self._pending_signatures.clear()
+        self._exact.merge()
+        self._bands.merge()
+        self._open_signatures()
+
+    def _strip_edge_lines(self, text: str) -> str:
+        lines = text.split("\n")
+        if len(lines) < 3:
+            return text
+        for position in (0, -1):
+            line = lines[position]
+            if not line.strip() or len(line) > self.EDGE_LINE_CHARS:
+                continue
+            # Page numbers differ from page to page, so digits are ignored
+            key = DIGITS_RE.sub("0", _normalize(line))
+            seen = self._edge_lines.get(key, 0)
+            if seen >= self.EDGE_LINE_REPEATS:
+                lines[position] = ""
+                self.stats["boilerplate_lines"] += 1
+            if seen or len(self._edge_lines) < self.EDGE_LINES_TRACKED:
+                self._edge_lines[key] = seen + 1
+        return "\n".join(lines).strip("\n")
+
+    def process(self, text: str, strip_edges: bool = False) -> Optional[str]:
+        """The text to store for a new document, or None if it duplicates an earlier one"""
+        self.stats["documents"] += 1
+        original_chars = len(text)
+        if strip_edges:
+            text = self._strip_edge_lines(text)
+
+        exact_key = _hash64(_normalize(text).encode("utf-8"))
+        signature = self._signature(text)
+        duplicate = None
+        if self._exact.lookup([exact_key]):
+            duplicate = "exact_duplicates"
+        elif signature is not None and self._is_near_duplicate(signature, self._band_keys(signature)):
+            duplicate = "near_duplicates"
+
+        if duplicate:
+            self.stats[duplicate] += 1
+            text = None
+        else:
+            self._add(exact_key, signature)
+        self.stats["chars_removed"] += original_chars - (len(text) if text is not None else 0)
+        self.stats["estimated_tokens_saved"] = self.stats["chars_removed"] // CHARS_PER_TOKEN
+        return text
+
+    def commit(self):
+        """Record that every kept document has been appended to the corpus"""
+        corpus = CorpusStore(self.corpus.project_dir)
+        if len(corpus) != self._next_doc:
+            raise RuntimeError(f"Corpus has {len(corpus)} documents, deduplication expected {self._next_doc}")
+        self._flush()
+        self.meta.update(num_docs=len(corpus), corpus_fingerprint=corpus.fingerprint(len(corpus)), dirty=False)
+        self._save_meta(self.meta)
+
+    def discard(self):
+        """Forget documents that were checked but never stored"""
+        self._pending_signatures.clear()
+        self._exact.discard_pending()
+        self._bands.discard_pending()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
@@ -0,0 +1,50 @@
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+def to_legacy_cache(past_key_values) -> Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]]:
+    """Convert a model's KV cache into a tuple of (key, value) pairs per layer"""
+    if past_key_values is None or isinstance(past_key_values, tuple):
+        return past_key_values
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+
+
+def from_legacy_cache(legacy) -> Optional[DynamicCache]:
+    """Build a DynamicCache from a tuple of (key, value) pairs per layer"""
+    if legacy is None:
+        return None
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(legacy):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def sample_next_tokens(logits: torch.Tensor, temperatures: List[float], top_ps: List[float],
+                       generators: Optional[List[Optional[torch.Generator]]] = None) -> torch.Tensor:
+    """Pick one token id per row of last-position logits, each row with its own
+    temperature and top_p (rows with temperature 0 are decoded greedily).
+    Rows with a generator draw from it, so a seeded request samples reproducibly
+    whatever else shares its batch"""
+    temps = torch.tensor(temperatures, dtype=torch.float32, device=logits.device).unsqueeze(-1)
+    top_p = torch.tensor(top_ps, dtype=torch.float32, device=logits.device).unsqueeze(-1)
+
+    greedy = torch.argmax(logits, dim=-1)
+    probs = torch.softmax(logits.float() / temps.clamp(min=1e-5), dim=-1)
+
+    sorted_probs, sorted_idx = torch.sort(probs, descending=True, dim=-1)
+    cumulative = torch.cumsum(sorted_probs, dim=-1)
+    # Keep the smallest set of tokens whose probability mass reaches top_p
+    sorted_probs = sorted_probs.masked_fill((cumulative - sorted_probs) > top_p, 0.0)
+    probs = torch.zeros_like(probs).scatter_(-1, sorted_idx, sorted_probs)
+    sampled = torch.multinomial(probs, num_samples=1).squeeze(-1)
+    for i, generator in enumerate(generators or []):
+        if generator is not None:
+            sampled[i] = torch.multinomial(probs[i], num_samples=1, generator=generator)[0]
+
+    return torch.where(temps.squeeze(-1) <= 0, greedy, sampled)
@@ -0,0 +1,227 @@
+"""
+Forward-pass backends for the batching scheduler.
+
+A backend runs one step of a causal LM over a batch: it takes input ids, a 2D
+attention mask, position ids and the KV cache as (key, value) pairs per layer,
+and returns last-step logits plus the updated cache. The scheduler does the
+rest (padding, merging, sampling), so swapping PyTorch for onnxruntime only
+changes how that single step is executed.
+"""
+import argparse
+import json
+import os
+import warnings
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from transformers import AutoModelForCausalLM
+
+from generation_utils import from_legacy_cache, to_legacy_cache
+from model_utils import checkpoint_version
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Optional: projects fall back to the PyTorch backend
+    ort = None
+
+ONNX_DIR = "onnx"
+ONNX_OPSET = 17
+
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+class TorchBackend:
+    """Runs steps with the PyTorch model itself"""
+
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+        self.config = model.config
+        self.device = next(model.parameters()).device
+
+    def step(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, position_ids: torch.Tensor,
+             past: Optional[LegacyCache], adapter_names: Optional[List[str]] = None):
+        kwargs = {}
+        if hasattr(self.model, "peft_config"):
+            # Per-row adapter selection; "__base__" runs the bare base model
+            kwargs["adapter_names"] = [name or "__base__" for name in adapter_names or [None] * len(input_ids)]
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=from_legacy_cache(past),
+            use_cache=True,
+            **kwargs
+        )
+        return outputs.logits[:, -1, :], to_legacy_cache(outputs.past_key_values)
+
+
+class OnnxBackend:
+    """Runs steps with an exported ONNX graph on onnxruntime's CPU provider"""
+
+    name = "onnx"
+
+    def __init__(self, onnx_path: Path, config):
+        self.config = config
+        self.device = torch.device("cpu")
+        self.num_layers = config.n_layer
+        self.num_heads = config.n_head
+        self.head_dim = config.n_embd // config.n_head
+        self.size_bytes = Path(onnx_path).stat().st_size
+        self.session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+
+    def step(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, position_ids: torch.Tensor,
+             past: Optional[LegacyCache], adapter_names: Optional[List[str]] = None):
+        batch_size = input_ids.shape[0]
+        if past is None:
+            # The graph always takes a cache; prefill passes an empty one
+            empty = np.zeros((batch_size, self.num_heads, 0, self.head_dim), dtype=np.float32)
+            past = [(empty, empty)] * self.num_layers
+
+        feed = {
+            "input_ids": input_ids.numpy(),
+            "attention_mask": attention_mask.numpy(),
+            "position_ids": position_ids.numpy()
+        }
+        for i, (key, value) in enumerate(past):
+            feed[f"past_key_{i}"] = np.asarray(key)
+            feed[f"past_value_{i}"] = np.asarray(value)
+
+        outputs = self.session.run(None, feed)
+        present = tuple(
+            (torch.from_numpy(outputs[1 + 2 * i]), torch.from_numpy(outputs[2 + 2 * i]))
+            for i in range(self.num_layers)
+        )
+        return torch.from_numpy(outputs[0][:, -1, :]), present
+
+
+class _ExportWrapper(nn.Module):
+    """Flat tensor signature around the model so the KV cache can be graph inputs and outputs"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        # Build the causal + padding mask here with traceable ops; the library's
+        # own mask construction is specialised to the example shapes when traced
+        total_length = attention_mask.shape[1]
+        query_length = input_ids.shape[1]
+        key_positions = torch.arange(total_length)
+        query_positions = torch.arange(query_length) + (total_length - query_length)
+        causal = key_positions[None, :] <= query_positions[:, None]
+        keep = causal[None, None] & attention_mask[:, None, None, :].bool()
+        mask = torch.zeros(keep.shape, dtype=torch.float32).masked_fill(~keep, torch.finfo(torch.float32).min)
+
+        legacy = tuple((past[2 * i], past[2 * i + 1]) for i in range(len(past) // 2))
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=from_legacy_cache(legacy),
+            use_cache=True
+        )
+        present = [tensor for pair in to_legacy_cache(outputs.past_key_values) for tensor in pair]
+        return (outputs.logits, *present)
+
+
+def export_onnx(checkpoint_path: Path, quantization: Optional[str] = None) -> Path:
+    """Export a checkpoint to ONNX with KV-cache inputs/outputs, returning the graph path
+
+    The graph is cached in `<checkpoint>/onnx/` and re-exported when the
+    checkpoint changes. With quantization="int8" the exported graph's weights
+    are additionally quantized with onnxruntime's dynamic quantization.
+    """
+    checkpoint_path = Path(checkpoint_path)
+    onnx_dir = checkpoint_path / ONNX_DIR
+    suffix = f".{quantization}" if quantization else ""
+    onnx_path = onnx_dir / f"model{suffix}.onnx"
+    meta_path = onnx_dir / f"model{suffix}.json"
+    version = checkpoint_version(checkpoint_path)
+
+    if onnx_path.exists() and meta_path.exists():
+        with open(meta_path, "r") as f:
+            if json.load(f).get("source_version") == version:
+                return onnx_path
+
+    onnx_dir.mkdir(exist_ok=True)
+    if quantization:
+        if quantization != "int8":
+            raise ValueError(f"Unsupported quantization mode: {quantization}")
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print(f"Quantizing ONNX graph for {checkpoint_path} to {quantization}")
+        quantize_dynamic(str(export_onnx(checkpoint_path)), str(onnx_path), weight_type=QuantType.QInt8)
+    else:
+        print(f"Exporting {checkpoint_path} to ONNX")
+        _export(checkpoint_path, onnx_path)
+
+    with open(meta_path, "w") as f:
+        json.dump({"source_version": version, "quantization": quantization, "opset": ONNX_OPSET}, f, indent=2)
+    return onnx_path
+
+
+def _export(checkpoint_path: Path, onnx_path: Path):
+    model = AutoModelForCausalLM.from_pretrained(str(checkpoint_path))
+    wrapper = _ExportWrapper(model).eval()
+    config = model.config
+    num_layers, num_heads = config.n_layer, config.n_head
+    head_dim = config.n_embd // num_heads
+
+    # Example inputs: a batch of 2 decoding 3 tokens after a 4-token cache
+    batch_size, query_length, past_length = 2, 3, 4
+    input_ids = torch.ones((batch_size, query_length), dtype=torch.long)
+    attention_mask = torch.ones((batch_size, past_length + query_length), dtype=torch.long)
+    position_ids = torch.arange(past_length, past_length + query_length).repeat(batch_size, 1)
+    past = [torch.zeros(batch_size, num_heads, past_length, head_dim) for _ in range(2 * num_layers)]
+
+    past_names = [f"past_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    present_names = [f"present_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "query"},
+        "attention_mask": {0: "batch", 1: "total"},
+        "position_ids": {0: "batch", 1: "query"},
+        "logits": {0: "batch", 1: "query"}
+    }
+    dynamic_axes.update({name: {0: "batch", 2: "past"} for name in past_names})
+    dynamic_axes.update({name: {0: "batch", 2: "total"} for name in present_names})
+
+    temp_path = onnx_path.with_suffix(".onnx.tmp")
+    with torch.no_grad(), warnings.catch_warnings():
+        # Tracing warns about every shape-dependent branch; the mask above is what keeps the graph general
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        torch.onnx.export(
+            wrapper,
+            (input_ids, attention_mask, position_ids, *past),
+            str(temp_path),
+            input_names=["input_ids", "attention_mask", "position_ids", *past_names],
+            output_names=["logits", *present_names],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            dynamo=False
+        )
+    os.replace(temp_path, onnx_path)
+
+
+def load_onnx_backend(checkpoint_path: Path, quantization: Optional[str] = None) -> OnnxBackend:
+    """Export (if needed) and open a checkpoint's ONNX graph"""
+    if ort is None:
+        raise RuntimeError("onnxruntime is not installed")
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(str(checkpoint_path))
+    if config.model_type != "gpt2":
+        raise RuntimeError(f"ONNX export supports GPT-2 style models, not {config.model_type}")
+    return OnnxBackend(export_onnx(checkpoint_path, quantization), config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained checkpoint to ONNX")
+    parser.add_argument("checkpoint", help="Path to a project's checkpoint directory")
+    parser.add_argument("--quantization", choices=["int8"], help="Also quantize the exported graph")
+    args = parser.parse_args()
+    print(f"✅ Exported {export_onnx(Path(args.checkpoint), args.quantization)}")
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Job lifecycle: queued -> running -> done | failed | cancelled, with
+# running -> paused -> queued when a job is paused and resumed
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """Persistent queue of training jobs stored in SQLite.
+
+    The API process enqueues and controls jobs; the training worker process
+    reports progress and reads control requests ("cancel" / "pause") through
+    the same database, so the queue survives restarts of either side.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    project_slug TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    control TEXT,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    resume_checkpoint TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["config"] = json.loads(job["config"])
+        job["progress"] = json.loads(job["progress"])
+        return job
+
+    def enqueue(self, project_slug: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a job to the back of the queue"""
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (project_slug, config, status, created_at) VALUES (?, ?, ?, ?)",
+                (project_slug, json.dumps(config), QUEUED, time.time())
+            )
+        return self.get(cursor.lastrowid)
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent jobs first"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self, status: str) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def queue_position(self, job_id: int) -> int:
+        """How many queued jobs are ahead of this one"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND id < ?", (QUEUED, job_id)
+            ).fetchone()[0]
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running and return it"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, control = NULL, error = NULL, started_at = ? WHERE id = ?",
+                (RUNNING, time.time(), row["id"])
+            )
+        return self.get(row["id"])
+
+    def set_status(self, job_id: int, status: str, error: Optional[str] = None):
+        finished_at = time.time() if status in FINISHED_STATES else None
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, control = NULL, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, finished_at, job_id)
+            )
+
+    def update_progress(self, job_id: int, progress: Dict[str, Any]):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id))
+
+    def set_resume_checkpoint(self, job_id: int, checkpoint: Optional[str]):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET resume_checkpoint = ? WHERE id = ?", (checkpoint, job_id))
+
+    def request_control(self, job_id: int, action: str):
+        """Ask the worker running a job to "cancel" or "pause" it"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET control = ? WHERE id = ?", (action, job_id))
+
+    def control(self, job_id: int) -> Optional[str]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT control FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["control"] if row else None
+
+    def requeue_interrupted(self) -> int:
+        """Put jobs left running by a previous API process back in the queue"""
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, control = NULL WHERE status = ?", (QUEUED, RUNNING)
+            )
+        return cursor.rowcount
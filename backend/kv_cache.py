@@ -0,0 +1,90 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from model_cache import ModelCache
+
+if TYPE_CHECKING:
+    import torch
+
+LegacyCache = Tuple[Tuple["torch.Tensor", "torch.Tensor"], ...]
+
+
+def kv_size_bytes(past: LegacyCache) -> int:
+    return sum(t.numel() * t.element_size() for pair in past for t in pair)
+
+
+def slice_kv(past: LegacyCache, row: int, start: int, end: Optional[int] = None) -> LegacyCache:
+    """Copy one sequence's cache positions [start, end) out of a batched cache"""
+    return tuple(
+        (k[row:row + 1, :, start:end].clone(), v[row:row + 1, :, start:end].clone())
+        for k, v in past
+    )
+
+
+class KVCache(ModelCache):
+    """Past key/values kept between requests, within a byte budget.
+
+    Two kinds of entries share the budget and its LRU eviction:
+    - session entries hold a chat session's whole conversation so far, so the
+      next turn only has to prefill the new message;
+    - prefix entries hold a common prompt prefix (e.g. a system prompt) that
+      any request starting with the same tokens can reuse.
+
+    Keys are namespaced per scheduler, since a cache is only valid for the
+    model (and adapter) that produced it. Evicting an entry only costs a
+    recomputation on the next request, never context.
+    """
+
+    def store(self, key: str, token_ids: Sequence[int], past: LegacyCache, adapter_name: Optional[str] = None):
+        entry = {
+            "tokens": tuple(token_ids),
+            "past": past,
+            "adapter_name": adapter_name,
+            "size_bytes": kv_size_bytes(past)
+        }
+        if entry["size_bytes"] <= self.budget_bytes:
+            self.put(key, entry)
+
+    def lookup(self, keys: List[str], prefix_namespace: str, input_ids: List[int],
+               adapter_name: Optional[str] = None) -> Optional[Tuple[int, LegacyCache]]:
+        """Find the longest cached prefix of input_ids among `keys` and the namespace's prefix entries
+
+        Returns the number of tokens covered and their cache, leaving at least
+        one token of input_ids to prefill so the request gets its next-token logits.
+        """
+        candidates = [(key, self.peek(key)) for key in keys]
+        candidates += [(key, entry) for key, entry in self.items() if key.startswith(prefix_namespace)]
+
+        best_key, best_entry = None, None
+        for key, entry in candidates:
+            if entry is None or entry["adapter_name"] != adapter_name:
+                continue
+            tokens = entry["tokens"]
+            if len(tokens) > len(input_ids) or tuple(input_ids[:len(tokens)]) != tokens:
+                continue
+            if best_entry is None or len(tokens) > len(best_entry["tokens"]):
+                best_key, best_entry = key, entry
+
+        if best_entry is None:
+            self.misses += 1
+            return None
+        self.get(best_key)  # Mark as recently used and count the hit
+        length = min(len(best_entry["tokens"]), len(input_ids) - 1)
+        if length <= 0:
+            return None
+        past = best_entry["past"]
+        if length < len(best_entry["tokens"]):
+            past = tuple((k[:, :, :length], v[:, :, :length]) for k, v in past)
+        return length, past
+
+    def drop_namespace(self, namespace: str):
+        for key, _ in self.items():
+            if key.startswith(namespace):
+                self.pop(key)
+
+    def _release(self, key: str, entry: Dict[str, Any]):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["entries"] = stats.pop("models")
+        return stats
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def model_size_bytes(model) -> int:
+    """Resident size of a model's weights and buffers
+
+    Walks the state dict rather than parameters() so that dynamically quantized
+    layers, whose int8 weights are packed outside the parameter list, are counted,
+    and tensors shared between keys (tied embeddings) are counted once.
+    """
+    seen = set()
+    size = 0
+    values = list(model.state_dict(keep_vars=True).values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):
+            values.extend(value)
+        elif hasattr(value, "element_size") and value.data_ptr() not in seen:
+            seen.add(value.data_ptr())
+            size += value.numel() * value.element_size()
+    return size
+
+
+class ModelCache:
+    """LRU cache of loaded models bounded by a total byte budget.
+
+    Each entry is a dict that must carry a "size_bytes" key. When a new entry
+    would push the total over budget, the least recently used entries are
+    evicted (skipping any that `can_evict` reports as busy) and handed to
+    `on_evict` so their resources can be released.
+    """
+
+    def __init__(self, budget_bytes: int,
+                 on_evict: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 can_evict: Optional[Callable[[str, Dict[str, Any]], bool]] = None):
+        self.budget_bytes = budget_bytes
+        self.on_evict = on_evict
+        self.can_evict = can_evict
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return an entry and mark it most recently used, counting the hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return an entry without touching recency or counters"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Insert an entry, evicting least recently used models to stay within budget"""
+        with self._lock:
+            self._entries.pop(key, None)
+            candidates = list(self._entries.items())
+        # The callbacks may look at the cache themselves, so they run without holding the lock
+        evictable = {k: e for k, e in candidates if not self.can_evict or self.can_evict(k, e)}
+        with self._lock:
+            evicted = self._make_room(entry["size_bytes"], evictable)
+            self._entries[key] = entry
+        for evicted_key, evicted_entry in evicted:
+            self._release(evicted_key, evicted_entry)
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """Remove an entry without counting it as an eviction"""
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def _make_room(self, size_bytes: int,
+                   evictable: Dict[str, Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+        evicted = []
+        used = sum(e["size_bytes"] for e in self._entries.values())
+        for key in list(self._entries):
+            if used + size_bytes <= self.budget_bytes:
+                break
+            entry = self._entries[key]
+            # Skip busy entries, and any replaced since can_evict looked at them
+            if evictable.get(key) is not entry:
+                continue
+            self._entries.pop(key)
+            used -= entry["size_bytes"]
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def _release(self, key: str, entry: Dict[str, Any]):
+        print(f"Evicting model {key} ({entry['size_bytes'] / 1024 ** 2:.0f} MB) from cache")
+        if self.on_evict:
+            self.on_evict(key, entry)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return list(self._entries.items())
+
+    @property
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(e["size_bytes"] for e in self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": len(self),
+            "used_bytes": self.used_bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
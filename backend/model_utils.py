@@ -1,14 +1,17 @@
-import torch
-import torch.nn as nn
-from transformers import (
-    AutoTokenizer, AutoModelForCausalLM, AutoConfig,
-    TrainingArguments, Trainer, DataCollatorForLanguageModeling
-)
 from pathlib import Path
+import importlib.util
 import json
+import os
 import psutil
-import GPUtil
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+
+# torch, transformers and peft are imported where they are used, so the API
+# servers can start (and answer /health) without paying for them up front
+
+def checkpoint_version(checkpoint_path: Path) -> float:
+    """Newest modification time among the checkpoint's weight files"""
+    weights = list(checkpoint_path.glob("*.safetensors")) + list(checkpoint_path.glob("*.bin"))
+    return max((p.stat().st_mtime for p in weights), default=0.0)
 
 class ModelManager:
     MODEL_CONFIGS = {
@@ -35,10 +38,20 @@ class ModelManager:
             self.workspace_dir = Path(__file__).parent.parent / "data"
         else:
             self.workspace_dir = Path(workspace_dir)
-        self.device = self._get_best_device()
+        self._device = None
+        self._system_info = None
+    
+    @property
+    def device(self) -> str:
+        """Best available device, probed on first use"""
+        if self._device is None:
+            self._device = self._get_best_device()
+        return self._device
     
     def _get_best_device(self) -> str:
         """Auto-detect best available device"""
+        import torch
+        
         if torch.cuda.is_available():
             return "cuda"
         elif torch.backends.mps.is_available():
@@ -46,17 +59,21 @@ class ModelManager:
         else:
             return "cpu"
     
-    def get_system_info(self) -> Dict[str, Any]:
-        """Get current system resource usage"""
+    def sample_system_info(self) -> Dict[str, Any]:
+        """Measure current system resource usage (blocking; the servers call it on a background interval)"""
+        # Reported as "detecting" until the device has been probed (importing torch
+        # here would stall a freshly started server)
         info = {
-            "device": self.device,
+            "device": self._device or "detecting",
             "cpu_percent": psutil.cpu_percent(),
             "memory_percent": psutil.virtual_memory().percent,
-            "gpu_available": torch.cuda.is_available()
+            "gpu_available": self._device == "cuda"
         }
         
-        if torch.cuda.is_available():
+        if self._device == "cuda":
             try:
+                import GPUtil
+                
                 gpus = GPUtil.getGPUs()
                 if gpus:
                     gpu = gpus[0]
@@ -68,17 +85,37 @@ class ModelManager:
             except:
                 pass
         
+        self._system_info = info
         return info
     
-    def load_model_and_tokenizer(self, model_size: str, project_slug: Optional[str] = None):
+    def get_system_info(self) -> Dict[str, Any]:
+        """Most recently sampled system resource usage"""
+        if self._system_info is None:
+            return self.sample_system_info()
+        return {**self._system_info, "device": self._device or "detecting"}
+    
+    # Full fine-tunes save a whole checkpoint; LoRA runs save only adapter weights
+    OUTPUT_DIRS = {"full": "checkpoint", "lora": "adapter"}
+    
+    def get_output_dir(self, project_slug: str, training_mode: str = "full") -> Path:
+        """Directory a project's trained weights are saved to"""
+        return self.workspace_dir / project_slug / self.OUTPUT_DIRS[training_mode]
+    
+    def load_model_and_tokenizer(self, model_size: str, project_slug: Optional[str] = None,
+                                 training_mode: str = "full", lora_rank: int = 8):
         """Load model and tokenizer, either fresh or from checkpoint"""
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        
         config = self.MODEL_CONFIGS[model_size]
         model_name = config["model_name"]
         
+        if training_mode == "lora":
+            model, tokenizer = self._load_lora_model(model_name, project_slug, lora_rank)
         # Check for existing checkpoint
-        if project_slug:
-            checkpoint_path = self.workspace_dir / project_slug / "checkpoint"
-            if checkpoint_path.exists():
+        elif project_slug:
+            checkpoint_path = self.get_output_dir(project_slug)
+            # The directory may only hold intermediate checkpoint-N folders from an unfinished run
+            if (checkpoint_path / "config.json").exists():
                 print(f"Loading from checkpoint: {checkpoint_path}")
                 model = AutoModelForCausalLM.from_pretrained(checkpoint_path)
                 tokenizer = AutoTokenizer.from_pretrained(checkpoint_path)
@@ -95,35 +132,266 @@ class ModelManager:
         model.to(self.device)
         return model, tokenizer
     
+    def _load_lora_model(self, model_name: str, project_slug: Optional[str], lora_rank: int):
+        """Wrap the base model with a trainable LoRA adapter, continuing from the project's adapter if it has one"""
+        from peft import LoraConfig, PeftModel, get_peft_model
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        
+        adapter_path = self.get_output_dir(project_slug, "lora") if project_slug else None
+        if adapter_path and (adapter_path / "adapter_config.json").exists():
+            print(f"Loading adapter: {adapter_path}")
+            model = PeftModel.from_pretrained(model, adapter_path, is_trainable=True)
+        else:
+            lora_config = LoraConfig(
+                task_type="CAUSAL_LM",
+                r=lora_rank,
+                lora_alpha=2 * lora_rank,
+                lora_dropout=0.05
+            )
+            model = get_peft_model(model, lora_config)
+        model.print_trainable_parameters()
+        return model, tokenizer
+    
+    # Per-job training memory profiles (TrainingConfig.memory_profile). "lean" recomputes
+    # activations in the backward pass instead of keeping them, trains no embedding weights
+    # and uses an optimizer with little or no per-weight state, so the larger tiers fit in
+    # the RAM of a CPU-only host at the cost of roughly a third more compute per step
+    MEMORY_PROFILES = {
+        "standard": {"gradient_checkpointing": False, "freeze_embeddings": False, "lean_optimizer": False},
+        "lean": {"gradient_checkpointing": True, "freeze_embeddings": True, "lean_optimizer": True}
+    }
+    # Optimizer state kept per trainable weight, in bytes (AdamW's two fp32 moments by default)
+    OPTIMIZER_STATE_BYTES = {"adamw_bnb_8bit": 2, "adafactor": 0}
+    
+    def training_optimizer(self, memory_profile: str = "standard") -> Optional[str]:
+        """TrainingArguments.optim for a memory profile; None keeps the Trainer's AdamW
+        
+        Lean profiles use bitsandbytes' 8-bit AdamW on a GPU. Its optimizers need
+        CUDA, so on the CPU they use Adafactor, whose factored second moment
+        takes a row and a column per weight matrix instead of two full copies.
+        """
+        if not self.MEMORY_PROFILES[memory_profile]["lean_optimizer"]:
+            return None
+        if self.device == "cuda" and importlib.util.find_spec("bitsandbytes") is not None:
+            return "adamw_bnb_8bit"
+        return "adafactor"
+    
+    def apply_memory_profile(self, model, memory_profile: str = "standard"):
+        """Freeze the embeddings and enable gradient checkpointing as the profile asks, before training starts"""
+        import torch
+        
+        profile = self.MEMORY_PROFILES[memory_profile]
+        if profile["freeze_embeddings"]:
+            # Token and position embeddings, and the output projection GPT-2 ties to the former
+            embeddings = [m for m in model.modules() if isinstance(m, torch.nn.Embedding)]
+            for module in embeddings + [model.get_output_embeddings()]:
+                if module is not None:
+                    module.requires_grad_(False)
+            trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+            total = sum(p.numel() for p in model.parameters())
+            print(f"Embeddings frozen: training {trainable:,} of {total:,} parameters")
+        if profile["gradient_checkpointing"]:
+            # The non-reentrant variant also backpropagates through blocks whose inputs
+            # need no gradient, as with frozen embeddings or a LoRA adapter
+            model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    
+    # Samples per optimizer step, kept the same whatever the number of training processes
+    EFFECTIVE_BATCH_SIZE = int(os.environ.get("LLM_EFFECTIVE_BATCH_SIZE", "16"))
+    # Micro-batch size when it is not tuned to the memory available
+    PER_DEVICE_BATCH_SIZE = 2
+    # Seconds a data-parallel worker waits on the others before giving up
+    DDP_TIMEOUT = int(os.environ.get("LLM_DDP_TIMEOUT", "600"))
+    
+    # Memory each training process may allocate beyond the loaded model when tuning the
+    # micro-batch size (0 = 80% of the free RAM or GPU memory, split between processes)
+    TRAIN_MEMORY_MB = int(os.environ.get("LLM_TRAIN_MEMORY_MB", "0"))
+    # Headroom over the measured activations for the temporaries of the backward pass
+    ACTIVATION_OVERHEAD = 1.5
+    
+    def batch_layout(self, world_size: int = 1, max_batch_size: Optional[int] = None) -> Tuple[int, int]:
+        """Per-process batch size and gradient accumulation steps for `world_size` processes
+        
+        Together they give EFFECTIVE_BATCH_SIZE samples per optimizer step, or
+        the nearest achievable size when the processes cannot split it evenly.
+        The batch size is the largest that divides each process's share and
+        does not exceed `max_batch_size` (PER_DEVICE_BATCH_SIZE by default).
+        """
+        per_process = max(1, round(self.EFFECTIVE_BATCH_SIZE / world_size))
+        limit = min(max_batch_size or self.PER_DEVICE_BATCH_SIZE, per_process)
+        batch_size = max(size for size in range(1, limit + 1) if per_process % size == 0)
+        return batch_size, per_process // batch_size
+    
+    def memory_budget(self, world_size: int = 1) -> int:
+        """Bytes each of `world_size` training processes may allocate for activations, gradients and optimizer state"""
+        if self.TRAIN_MEMORY_MB:
+            return self.TRAIN_MEMORY_MB * 1024 * 1024
+        if self.device == "cuda":
+            import torch
+            
+            free = torch.cuda.mem_get_info()[0]
+        else:
+            free = psutil.virtual_memory().available
+        return int(free * 0.8 / world_size)
+    
+    @staticmethod
+    def measure_activation_memory(model, seq_length: int) -> int:
+        """Bytes a training forward pass over one sample of seq_length tokens keeps for the backward pass"""
+        if not getattr(model, "is_gradient_checkpointing", False):
+            return ModelManager._saved_tensor_bytes(model, seq_length)
+        
+        # Checkpointed blocks keep only their input; the backward pass recomputes the
+        # activations of one block at a time. What lies outside them (embeddings, the
+        # final layer norm and the logits) is saved as usual.
+        outside = ModelManager._saved_tensor_bytes(model, seq_length)
+        model.gradient_checkpointing_disable()
+        try:
+            blocks = ModelManager._saved_tensor_bytes(model, seq_length) - outside
+        finally:
+            model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+        config = model.config
+        element_size = next(model.parameters()).element_size()
+        block_inputs = config.num_hidden_layers * seq_length * config.hidden_size * element_size
+        return outside + blocks // config.num_hidden_layers + block_inputs
+    
+    @staticmethod
+    def _saved_tensor_bytes(model, seq_length: int) -> int:
+        import torch
+        
+        # Weights are saved for backward too, but they are already allocated
+        seen = {p.untyped_storage().data_ptr() for p in model.parameters()}
+        saved_bytes = 0
+        
+        def pack(tensor):
+            nonlocal saved_bytes
+            storage = tensor.untyped_storage()
+            if storage.data_ptr() not in seen:
+                seen.add(storage.data_ptr())
+                saved_bytes += storage.nbytes()
+            return tensor
+        
+        device = next(model.parameters()).device
+        input_ids = torch.zeros((1, seq_length), dtype=torch.long, device=device)
+        was_training = model.training
+        model.train()
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            outputs = model(input_ids=input_ids, labels=input_ids)
+        del outputs
+        model.train(was_training)
+        return saved_bytes
+    
+    def tune_batch_size(self, model, job_config: Dict[str, Any], seq_length: int, world_size: int = 1) -> Dict[str, Any]:
+        """Pick the largest micro-batch that fits the memory budget and the accumulation that goes with it
+        
+        Activation memory per sample is measured with one forward pass; gradients
+        and the optimizer state of the trainable weights come on top. Call it
+        after apply_memory_profile, so the measurement sees the profile. The
+        result is stored as `batch_tuning` in the project's config.json and
+        reused by later runs with the same model, memory profile, sequence
+        length and worker count while it still fits the budget.
+        
+        `job_config` is the configuration of the job being trained. The project's
+        config.json may already describe a later job by the time this runs, so
+        the stored result is only ever matched against the job's own settings.
+        """
+        project_slug = job_config["project_slug"]
+        config = self.load_model_config(project_slug)
+        key = {
+            "model_size": job_config.get("model_size"),
+            "training_mode": job_config.get("training_mode", "full"),
+            "lora_rank": job_config.get("lora_rank", 8),
+            "memory_profile": job_config.get("memory_profile", "standard"),
+            "seq_length": seq_length,
+            "world_size": world_size,
+            "effective_batch_size": self.EFFECTIVE_BATCH_SIZE
+        }
+        budget = self.memory_budget(world_size)
+        previous = config.get("batch_tuning")
+        if previous and all(previous.get(k) == v for k, v in key.items()) and previous["estimated_bytes"] <= budget:
+            print(f"Reusing micro-batch size {previous['micro_batch_size']} from {project_slug}/config.json")
+            return previous
+        
+        per_sample = self.measure_activation_memory(model, seq_length) * self.ACTIVATION_OVERHEAD
+        trainable = [p for p in model.parameters() if p.requires_grad]
+        state_bytes = self.OPTIMIZER_STATE_BYTES.get(self.training_optimizer(key["memory_profile"]), 8)
+        fixed = sum(p.numel() * (p.element_size() + state_bytes) for p in trainable)
+        fits = int((budget - fixed) // per_sample) if budget > fixed else 0
+        if fits < 1:
+            print(f"A batch of one may not fit in the {budget / 2**20:.0f} MB training memory budget")
+        batch_size, accumulation_steps = self.batch_layout(world_size, max(fits, 1))
+        
+        tuning = {
+            **key,
+            "memory_budget_mb": round(budget / 2**20),
+            "activation_mb_per_sample": round(per_sample / 2**20, 1),
+            "estimated_bytes": int(fixed + batch_size * per_sample),
+            "micro_batch_size": batch_size,
+            "gradient_accumulation_steps": accumulation_steps
+        }
+        print(f"Tuned micro-batch size {batch_size} x {accumulation_steps} accumulation steps "
+              f"({tuning['activation_mb_per_sample']} MB activations per sample, "
+              f"{tuning['memory_budget_mb']} MB budget)")
+        config["batch_tuning"] = tuning
+        self.save_model_config(project_slug, config)
+        return tuning
+    
     def create_trainer(self, model, tokenizer, train_dataset, project_slug: str, 
-                      epochs: int = 1, learning_rate: float = 5e-5):
-        """Create Trainer instance with appropriate settings"""
+                      epochs: int = 1, learning_rate: float = 5e-5, training_mode: str = "full",
+                      world_size: int = 1, micro_batch_size: Optional[int] = None,
+                      memory_profile: str = "standard"):
+        """Create Trainer instance with appropriate settings
+        
+        With world_size > 1 the caller runs one process per rank on the CPU, with
+        the gloo process group already initialized; each rank trains on its own
+        share of every batch and gradients are averaged across them.
+        `micro_batch_size` (e.g. from tune_batch_size) caps the per-process batch.
+        The model is expected to have been through apply_memory_profile.
+        """
+        import torch
+        from transformers import TrainingArguments
+        
+        from token_cache import CausalLMCollator
+        from trainer_utils import LengthBucketingTrainer
         
-        output_dir = self.workspace_dir / project_slug / "checkpoint"
+        output_dir = self.get_output_dir(project_slug, training_mode)
+        batch_size, accumulation_steps = self.batch_layout(world_size, micro_batch_size)
+        extra_args = {}
+        if world_size > 1:
+            extra_args = {
+                "use_cpu": True,
+                "ddp_backend": "gloo",
+                "ddp_timeout": self.DDP_TIMEOUT,
+                # Frozen weights (LoRA's base model, lean embeddings) get no gradients, but DDP only tracks trainable ones
+                "ddp_find_unused_parameters": False
+            }
+        optimizer = self.training_optimizer(memory_profile)
+        if optimizer:
+            extra_args["optim"] = optimizer
         
         training_args = TrainingArguments(
             output_dir=str(output_dir),
-            overwrite_output_dir=True,
             num_train_epochs=epochs,
-            per_device_train_batch_size=2,
-            gradient_accumulation_steps=8,
+            per_device_train_batch_size=batch_size,
+            gradient_accumulation_steps=accumulation_steps,
             learning_rate=learning_rate,
             warmup_steps=100,
             logging_steps=10,
+            logging_first_step=True,
             save_steps=100,
             save_total_limit=2,
             prediction_loss_only=True,
             remove_unused_columns=False,
             dataloader_pin_memory=False,
-            fp16=torch.cuda.is_available(),
+            fp16=torch.cuda.is_available() and world_size == 1,
+            **extra_args
         )
         
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=tokenizer,
-            mlm=False,
-        )
+        # Pads each batch to its longest sample; packed blocks need no padding at all
+        data_collator = CausalLMCollator(tokenizer.pad_token_id)
         
-        trainer = Trainer(
+        trainer = LengthBucketingTrainer(
             model=model,
             args=training_args,
             train_dataset=train_dataset,
@@ -148,26 +416,3 @@ class ModelManager:
             with open(config_file, 'r') as f:
                 return json.load(f)
         return {}
-
-class TrainingCallback:
-    """Callback to track training progress"""
-    def __init__(self):
-        self.logs = []
-        self.current_step = 0
-        self.total_steps = 0
-    
-    def on_step_begin(self, step: int, logs: Dict[str, float]):
-        self.current_step = step
-        self.logs.append({
-            "step": step,
-            "loss": logs.get("train_loss", 0),
-            "learning_rate": logs.get("learning_rate", 0)
-        })
-    
-    def get_progress(self) -> Dict[str, Any]:
-        return {
-            "current_step": self.current_step,
-            "total_steps": self.total_steps,
-            "progress_percent": (self.current_step / max(self.total_steps, 1)) * 100,
-            "recent_logs": self.logs[-10:] if self.logs else []
-        }
\ No newline at end of file
@@ -0,0 +1,92 @@
+import multiprocessing
+from multiprocessing.pool import AsyncResult
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Called with (pages done, total pages) as a file's pages come back
+ProgressCallback = Callable[[int, int], None]
+
+# (first page, end page, pending result) for one slice of a PDF
+PageTask = Tuple[int, int, AsyncResult]
+
+
+def count_pages(file_path: str) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def iter_page_texts(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Text of each page in [start, end), in order ("" for pages without text)"""
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:end]:
+            yield page.extract_text() or ""
+            # Release the parsed page objects as we go
+            page.flush_cache()
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end), one string per page (runs in a worker process)"""
+    return list(iter_page_texts(file_path, start, end))
+
+
+class ParallelPdfExtractor:
+    """Extracts PDF pages in a pool of worker processes.
+
+    Each submitted PDF is split into tasks of `pages_per_task` pages. Tasks
+    from every submitted file share the pool, so a batch of PDFs keeps all
+    workers busy, and `texts` hands each file's pages back in page order.
+
+    A task gets `page_timeout` seconds per page once it is next in line; one
+    that takes longer is abandoned and its pages skipped. The pool is then
+    terminated on close, so a page that hangs the parser cannot outlive the
+    upload.
+    """
+
+    def __init__(self, workers: int, pages_per_task: int = 4, page_timeout: float = 60):
+        self.pages_per_task = pages_per_task
+        self.page_timeout = page_timeout
+        self.skipped_pages = 0
+        # Spawned rather than forked: the API process runs threads and an event loop
+        self._pool = multiprocessing.get_context("spawn").Pool(workers)
+
+    def submit(self, file_path: str, num_pages: Optional[int] = None) -> List[PageTask]:
+        """Queue every page of a PDF for extraction"""
+        if num_pages is None:
+            num_pages = count_pages(file_path)
+        tasks = []
+        for start in range(0, num_pages, self.pages_per_task):
+            end = min(start + self.pages_per_task, num_pages)
+            tasks.append((start, end, self._pool.apply_async(extract_page_range, (file_path, start, end))))
+        return tasks
+
+    def texts(self, tasks: List[PageTask], on_progress: Optional[ProgressCallback] = None) -> Iterator[str]:
+        """Yield the non-empty page texts of one submitted PDF in page order"""
+        total = tasks[-1][1] if tasks else 0
+        for start, end, result in tasks:
+            try:
+                page_texts = result.get(timeout=self.page_timeout * (end - start))
+            except multiprocessing.TimeoutError:
+                print(f"Skipping PDF pages {start + 1}-{end}: extraction took over {self.page_timeout:g}s per page")
+                self.skipped_pages += end - start
+                page_texts = []
+            yield from (text for text in page_texts if text)
+            if on_progress:
+                on_progress(end, total)
+
+    def close(self, terminate: bool = False):
+        if terminate or self.skipped_pages:
+            # Workers may still be stuck on abandoned pages, or nobody wants the rest
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Also reached when a consumer stops reading part way (GeneratorExit)
+        self.close(terminate=exc_type is not None)
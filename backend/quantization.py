@@ -0,0 +1,112 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import torch
+import torch.nn as nn
+import transformers
+from transformers import AutoConfig, AutoModelForCausalLM
+from transformers.pytorch_utils import Conv1D
+
+from model_utils import checkpoint_version
+
+QUANTIZED_DIR = "quantized"
+
+
+def conv1d_to_linear(model: nn.Module) -> nn.Module:
+    """Swap GPT-2 style Conv1D layers for equivalent nn.Linear layers, in place
+
+    Conv1D is a Linear with a transposed weight, but dynamic quantization only
+    recognises nn.Linear, so GPT-2 attention and MLP layers would otherwise stay fp32.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, name, linear)
+    return model
+
+
+def quantize_int8(model: nn.Module) -> nn.Module:
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations quantized per batch)"""
+    model = conv1d_to_linear(model.cpu().eval())
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized(checkpoint_path: Path, mode: str = "int8") -> Optional[nn.Module]:
+    """Load a cached quantized model if it was built from the current checkpoint with these libraries
+
+    Only the quantized state dict is cached; the module is rebuilt from the
+    checkpoint's config and quantized empty before the weights are loaded into it.
+    """
+    cache_dir = Path(checkpoint_path) / QUANTIZED_DIR
+    meta_path = cache_dir / f"{mode}.json"
+    model_path = cache_dir / f"{mode}.pt"
+    if not meta_path.exists() or not model_path.exists():
+        return None
+
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta != _cache_meta(checkpoint_path, mode, model_path.stat().st_size):
+        return None
+    model = quantize_int8(AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(str(checkpoint_path))))
+    model.load_state_dict(torch.load(model_path, weights_only=True))
+    return model.eval()
+
+
+def save_quantized(model: nn.Module, checkpoint_path: Path, mode: str = "int8"):
+    """Cache a quantized model's state dict next to the checkpoint it was built from"""
+    cache_dir = Path(checkpoint_path) / QUANTIZED_DIR
+    cache_dir.mkdir(exist_ok=True)
+    model_path = cache_dir / f"{mode}.pt"
+    meta_path = cache_dir / f"{mode}.json"
+    temp_path = model_path.with_suffix(".pt.tmp")
+    torch.save(model.state_dict(), temp_path)
+    # The meta names the size of the weights file it describes, and is removed while
+    # the weights are swapped, so readers never pair one version's meta with another's weights
+    meta_path.unlink(missing_ok=True)
+    os.replace(temp_path, model_path)
+    temp_meta = meta_path.with_suffix(".json.tmp")
+    with open(temp_meta, "w") as f:
+        json.dump(_cache_meta(checkpoint_path, mode, model_path.stat().st_size), f, indent=2)
+    os.replace(temp_meta, meta_path)
+
+
+def _cache_meta(checkpoint_path: Path, mode: str, size_bytes: int) -> Dict[str, Any]:
+    return {
+        "mode": mode,
+        "source_version": checkpoint_version(Path(checkpoint_path)),
+        "bytes": size_bytes,
+        "torch": torch.__version__,
+        "transformers": transformers.__version__
+    }
+
+
+def load_or_quantize(checkpoint_path: Path, mode: str = "int8") -> nn.Module:
+    """Return the quantized model for a checkpoint, quantizing and caching it on first use
+
+    The cache only saves time: a cache that cannot be read is rebuilt, and one
+    that cannot be written leaves the freshly quantized model in use.
+    """
+    if mode != "int8":
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+    try:
+        model = load_quantized(checkpoint_path, mode)
+    except Exception as e:
+        print(f"Ignoring unreadable {mode} cache for {checkpoint_path}: {e}")
+        model = None
+    if model is not None:
+        print(f"Loaded cached {mode} model from {Path(checkpoint_path) / QUANTIZED_DIR}")
+        return model
+
+    print(f"Quantizing {checkpoint_path} to {mode}")
+    model = quantize_int8(AutoModelForCausalLM.from_pretrained(str(checkpoint_path)))
+    try:
+        save_quantized(model, checkpoint_path, mode)
+    except Exception as e:
+        print(f"Could not cache the {mode} model for {checkpoint_path}: {e}")
+    return model
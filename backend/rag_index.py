@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from corpus_store import CorpusStore
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# "hashing" needs no model or download; any other value is a sentence-transformers model name
+DEFAULT_EMBEDDER = os.environ.get("LLM_RAG_EMBEDDER", "hashing")
+
+WORD_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i if in into is it its of on or "
+    "our she so that the their them then there they this to was we were what when which who will with "
+    "you your".split()
+)
+
+
+class HashingEmbedder:
+    """Bag of words and word bigrams hashed into a fixed-size vector.
+
+    Needs nothing beyond numpy and gives the same vector for a passage on any
+    machine, so an index can grow incrementally without ever being re-embedded.
+    It matches on shared vocabulary rather than meaning; install
+    sentence-transformers and set LLM_RAG_EMBEDDER for semantic retrieval.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [w for w in WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+            # The top bit picks the sign, so colliding features tend to cancel rather than pile up
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        # Damp repeated terms, then normalise so a dot product is a cosine similarity
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Dense embeddings from a sentence-transformers model (optional dependency)"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=64, normalize_embeddings=True,
+                                  convert_to_numpy=True).astype(np.float32)
+
+
+_embedders: Dict[str, Any] = {}
+
+
+def load_embedder(name: str = DEFAULT_EMBEDDER):
+    """The named embedder, or the hashing embedder if the model cannot be loaded"""
+    if name not in _embedders:
+        if name == HashingEmbedder.name:
+            _embedders[name] = HashingEmbedder()
+        else:
+            try:
+                _embedders[name] = SentenceTransformerEmbedder(name)
+            except Exception as e:
+                print(f"Embedding model {name} unavailable ({e}); using the hashing embedder")
+                _embedders[name] = load_embedder(HashingEmbedder.name)
+    return _embedders[name]
+
+
+def split_passages(text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """Character spans of up to max_chars, cut at a paragraph, sentence or word break where possible"""
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for separator in ("\n\n", ". ", " "):
+                cut = window.rfind(separator)
+                if cut > max_chars // 2:
+                    end = start + cut + len(separator)
+                    break
+        if text[start:end].strip():
+            spans.append((start, end))
+        start = end
+    return spans
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on `path` across processes, blocking until it is free"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ten seconds
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class RagIndex:
+    """Passage embeddings for a project's corpus, persisted as memory-mapped files.
+
+    Documents are split into passages of up to PASSAGE_CHARS characters.
+    `rag_index/<embedder key>/vectors.f32` holds one normalised vector per
+    passage and `passages.idx` its (document, start, end) character span, so
+    passage text is read back from the corpus rather than stored twice. Like
+    the token cache, the index is validated against the fingerprint of the
+    documents it was built from: appended documents are embedded incrementally and
+    a replaced corpus is re-indexed from scratch.
+
+    Search is an exact dot product against the memory-mapped vectors, which
+    stays within a few milliseconds up to around a hundred thousand passages.
+    Both the training server (after uploads) and the chat server (on lookup)
+    sync the index, so syncs take a file lock shared between processes.
+    """
+
+    PASSAGE_CHARS = 800
+    EMBED_BATCH = 256
+
+    def __init__(self, corpus: CorpusStore, embedder=None):
+        self.corpus = corpus
+        self.embedder = embedder or load_embedder()
+        key = hashlib.sha256(self.embedder.name.encode("utf-8")).hexdigest()[:16]
+        self.index_dir = corpus.project_dir / "rag_index" / key
+        self.meta_path = self.index_dir / "meta.json"
+        self.vectors_path = self.index_dir / "vectors.f32"
+        self.passages_path = self.index_dir / "passages.idx"
+        self.lock_path = corpus.project_dir / "rag_index" / "sync.lock"
+        self.meta: Optional[Dict[str, Any]] = None
+        self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._passages = np.zeros((0, 3), dtype="<u8")
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.meta_path.exists():
+            return None
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def _save_meta(self, meta: Dict[str, Any]):
+        tmp_path = self.meta_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _new_meta(self) -> Dict[str, Any]:
+        return {
+            "embedder": self.embedder.name,
+            "dim": self.embedder.dim,
+            "passage_chars": self.PASSAGE_CHARS,
+            "num_docs": 0,
+            "num_passages": 0,
+            "corpus_fingerprint": self.corpus.fingerprint(0)
+        }
+
+    def sync(self) -> Dict[str, Any]:
+        """Bring the index up to date with the corpus, then open it for search"""
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.lock_path):
+            return self._sync()
+
+    def _sync(self) -> Dict[str, Any]:
+        meta = self._load_meta()
+        if meta is not None and (meta.get("corpus_fingerprint") != self.corpus.fingerprint(meta["num_docs"])
+                                 or meta["passage_chars"] != self.PASSAGE_CHARS):
+            print(f"Corpus changed, rebuilding retrieval index in {self.index_dir}")
+            meta = None
+
+        if meta is None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            for path in (self.vectors_path, self.passages_path):
+                path.unlink(missing_ok=True)
+            meta = self._new_meta()
+
+        if len(self.corpus) > meta["num_docs"]:
+            self._embed_new_documents(meta)
+            meta["corpus_fingerprint"] = self.corpus.fingerprint(meta["num_docs"])
+            self._save_meta(meta)
+        elif not self.meta_path.exists():
+            self._save_meta(meta)
+        self.open(meta)
+        return meta
+
+    def _embed_new_documents(self, meta: Dict[str, Any]):
+        """Split and embed documents appended since the last sync onto the end of the index files"""
+        first_doc = meta["num_docs"]
+        added = 0
+        with open(self.vectors_path, "ab") as vectors_file, open(self.passages_path, "ab") as passages_file:
+            # Drop anything written past the recorded passages by an interrupted sync
+            vectors_file.truncate(meta["num_passages"] * meta["dim"] * 4)
+            passages_file.truncate(meta["num_passages"] * 3 * 8)
+            spans, texts = [], []
+            for doc in range(first_doc, len(self.corpus)):
+                text = self.corpus[doc]
+                for start, end in split_passages(text, self.PASSAGE_CHARS):
+                    spans.append((doc, start, end))
+                    texts.append(text[start:end])
+                if len(texts) >= self.EMBED_BATCH or doc == len(self.corpus) - 1:
+                    if texts:
+                        vectors_file.write(self.embedder.embed(texts).astype("<f4").tobytes())
+                        passages_file.write(np.asarray(spans, dtype="<u8").tobytes())
+                        added += len(texts)
+                    spans, texts = [], []
+
+        meta["num_docs"] = len(self.corpus)
+        meta["num_passages"] += added
+        print(f"Indexed {added} passages from {len(self.corpus) - first_doc} new documents in {self.index_dir}")
+
+    def open(self, meta: Optional[Dict[str, Any]] = None) -> bool:
+        """Map the index files for search; False if the project has no index yet"""
+        meta = meta or self._load_meta()
+        if meta is None:
+            return False
+        self.meta = meta
+        count = meta["num_passages"]
+        if count:
+            # Only the passages the metadata vouches for; a concurrent sync may be appending more
+            self._vectors = np.memmap(self.vectors_path, dtype="<f4", mode="r", shape=(count, meta["dim"]))
+            self._passages = np.memmap(self.passages_path, dtype="<u8", mode="r", shape=(count, 3))
+        return True
+
+    def covers(self, corpus: CorpusStore) -> bool:
+        """Whether the opened index was built from exactly the documents in `corpus`"""
+        return (self.meta is not None and self.meta["num_docs"] == len(corpus)
+                and self.meta.get("corpus_fingerprint") == corpus.fingerprint(len(corpus)))
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """The k passages most similar to the query, best first"""
+        if not len(self) or k <= 0:
+            return []
+        scores = self._vectors @ self.embedder.embed([query])[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            doc, start, end = (int(v) for v in self._passages[i])
+            results.append({
+                "document": doc,
+                "score": round(float(scores[i]), 4),
+                "text": self.corpus[doc][start:end].strip()
+            })
+        return results
+
+
+def open_index(project_dir: Path, embedder=None) -> RagIndex:
+    """Open a project's retrieval index for search, first indexing documents it does not cover yet"""
+    index = RagIndex(CorpusStore(project_dir), embedder)
+    if not index.open() or not index.covers(index.corpus):
+        index.sync()
+    return index
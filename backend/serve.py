@@ -1,19 +1,41 @@
 import asyncio
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional, AsyncGenerator
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from typing import Dict, Any, List, Literal, Optional, AsyncGenerator, TYPE_CHECKING
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
-import torch
-from transformers import TextGenerationPipeline, AutoTokenizer, AutoModelForCausalLM
+import psutil
 
-from model_utils import ModelManager
+# The inference stack (torch, transformers, peft and the modules built on them)
+# is imported in the background after startup, so /health answers immediately
+from model_utils import ModelManager, checkpoint_version
+from model_cache import ModelCache, model_size_bytes
+from kv_cache import KVCache
+from response_cache import ResponseCache, response_cache_key
+from corpus_store import CorpusStore
+from rag_index import RagIndex, open_index
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsRegistry, add_system_metrics, sample_periodically
 
-app = FastAPI(title="LLM Chat Server")
+if TYPE_CHECKING:
+    from batch_scheduler import BatchScheduler
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = asyncio.create_task(warm_up())
+    sampler = asyncio.create_task(sample_periodically(model_manager.sample_system_info, RESOURCE_SAMPLE_SECONDS))
+    yield
+    sampler.cancel()
+    warmup.cancel()
+
+app = FastAPI(title="LLM Chat Server", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,7 +47,105 @@ app.add_middleware(
 
 # Global instances
 model_manager = ModelManager()
-active_models: Dict[str, Dict[str, Any]] = {}
+
+# Continuous batching settings shared by every loaded model
+MAX_BATCH_SIZE = int(os.environ.get("LLM_MAX_BATCH_SIZE", "8"))
+MAX_QUEUE_DELAY_MS = float(os.environ.get("LLM_MAX_QUEUE_DELAY_MS", "10"))
+MAX_QUEUE_SIZE = int(os.environ.get("LLM_MAX_QUEUE_SIZE", "64"))
+
+# Blocking work (checkpoint loading) runs here so the event loop keeps serving
+INFERENCE_THREADS = int(os.environ.get("LLM_INFERENCE_THREADS", "2"))
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+
+# Loaded models are kept within a memory budget (default: half of system RAM)
+MODEL_CACHE_BYTES = int(
+    float(os.environ["LLM_MODEL_CACHE_MB"]) * 1024 ** 2
+    if "LLM_MODEL_CACHE_MB" in os.environ
+    else psutil.virtual_memory().total // 2
+)
+
+# Past key/values kept for chat sessions and shared system prompts, across all models
+KV_CACHE_BYTES = int(float(os.environ.get("LLM_KV_CACHE_MB", "512")) * 1024 ** 2)
+kv_cache = KVCache(KV_CACHE_BYTES)
+
+# Finished /chat responses for repeated deterministic prompts (0 entries disables the cache)
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("LLM_RESPONSE_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.environ.get("LLM_RESPONSE_CACHE_TTL", "300"))
+)
+
+# Projects loaded and warmed up with a short generation once the server is listening
+PRELOAD_PROJECTS = [slug.strip() for slug in os.environ.get("LLM_PRELOAD_PROJECTS", "").split(",") if slug.strip()]
+WARMUP_TOKENS = 4
+
+# Readiness, as opposed to liveness: the inference stack is imported and preloading has finished
+startup_state: Dict[str, Any] = {"ready": False, "imports_loaded": False, "preloaded": [], "failed": {}}
+
+# How often a waiting /chat request checks whether its client has disconnected
+DISCONNECT_POLL_SECONDS = 0.25
+
+# How often a model replaced by a retrained checkpoint is checked for requests still running on it
+RETIRE_POLL_SECONDS = 0.5
+
+# Text placed between a system prompt and the conversation turns that follow it
+TURN_SEPARATOR = "\n\n"
+
+# CPU, memory and GPU usage are sampled this often in the background, never inside a request
+RESOURCE_SAMPLE_SECONDS = float(os.environ.get("LLM_RESOURCE_SAMPLE_SECONDS", "5"))
+
+# Prometheus metrics served on /metrics; "endpoint" is "chat" or "stream"
+metrics = MetricsRegistry()
+chat_requests = metrics.counter("llm_chat_requests_total", "Chat requests received", ["project", "endpoint"])
+chat_errors = metrics.counter("llm_chat_errors_total", "Chat requests that failed", ["project", "endpoint", "status"])
+input_tokens_total = metrics.counter("llm_input_tokens_total", "Prompt tokens fed to the model", ["project"])
+cached_tokens_total = metrics.counter("llm_cached_tokens_total", "Prompt tokens reused from the KV cache", ["project"])
+output_tokens_total = metrics.counter("llm_output_tokens_total", "Tokens generated", ["project"])
+queue_wait_seconds = metrics.histogram("llm_queue_wait_seconds", "Time requests wait for a batch slot", ["project"])
+prefill_seconds = metrics.histogram("llm_prefill_seconds", "Time spent prefilling prompts", ["project"])
+decode_seconds_per_token = metrics.histogram(
+    "llm_decode_seconds_per_token", "Decode time per generated token after the first", ["project"]
+)
+retrieval_seconds = metrics.histogram("llm_retrieval_seconds", "Time to find passages for rag_top_k", ["project"])
+request_latency_seconds = metrics.histogram(
+    "llm_request_latency_seconds", "End-to-end chat latency, including cached responses", ["project", "endpoint"]
+)
+add_system_metrics(metrics, model_manager.get_system_info)
+
+def _release_model(key: str, model_data: Dict[str, Any]):
+    """Free a model's resources once it leaves the cache"""
+    if "base" in model_data:
+        # A retired adapter may already have been replaced by a newer version under the same slug
+        if model_cache.peek(key) is None:
+            model_data["base"]["adapters"].discard(key)
+        _detach_adapter(model_data)
+        return
+    
+    import torch
+    
+    model_data["scheduler"].stop()
+    # Adapters riding on an evicted base model go with it
+    for slug in list(model_data.get("adapters", ())):
+        model_cache.pop(slug)
+    torch.cuda.empty_cache() if torch.cuda.is_available() else None
+
+def _is_idle(key: str, model_data: Dict[str, Any]) -> bool:
+    scheduler = model_data["scheduler"]
+    if "adapter_name" in model_data:
+        return not scheduler.has_requests_for(model_data["adapter_name"])
+    # A shared base model outlives the adapters loaded on it
+    if model_data.get("adapters"):
+        return False
+    return scheduler.batch_size == 0 and scheduler.queue_size == 0
+
+model_cache = ModelCache(MODEL_CACHE_BYTES, on_evict=_release_model, can_evict=_is_idle)
+_load_locks: Dict[str, asyncio.Lock] = {}
+# Quantization and backend chosen per project on /load-model, reused when an evicted model is reloaded
+DEFAULT_LOAD_OPTIONS = {"quantization": None, "backend": "torch"}
+load_options: Dict[str, Dict[str, Optional[str]]] = {}
+# Open retrieval indexes, replaced once the corpus has documents they do not cover
+rag_indexes: Dict[str, RagIndex] = {}
+# Models replaced by a retrained checkpoint, released once their in-flight requests finish
+_retiring: set = set()
 
 class ChatMessage(BaseModel):
     message: str
@@ -33,63 +153,331 @@ class ChatMessage(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 150
     top_p: float = 0.9
+    # Prepended to the message; its KV cache is shared by every request using the same system prompt
+    system_prompt: Optional[str] = None
+    # Makes sampling reproducible; seeded requests can be answered from the response cache
+    seed: Optional[int] = None
+    # None caches greedy and seeded requests, True also caches sampled ones, False bypasses the cache
+    cache: Optional[bool] = None
+    # Passages retrieved from the project's corpus and placed before the message (0 disables retrieval)
+    rag_top_k: int = 0
 
 class ModelLoadRequest(BaseModel):
     project_slug: str
+    # "int8" serves a dynamically quantized copy of the checkpoint on CPU
+    quantization: Optional[Literal["int8"]] = None
+    # "onnx" runs generation on onnxruntime (CPU); falls back to PyTorch if the export or runtime is unavailable
+    backend: Literal["torch", "onnx"] = "torch"
 
-@app.post("/load-model")
-async def load_model(request: ModelLoadRequest):
-    """Load a trained model for inference"""
-    try:
-        # Check if model is already loaded
-        if request.project_slug in active_models:
-            return {"success": True, "message": "Model already loaded"}
+async def get_model(project_slug: str) -> Dict[str, Any]:
+    """Return a loaded model, loading it from its checkpoint if it is not cached"""
+    model_data = model_cache.get(project_slug)
+    if model_data is not None and _is_stale(project_slug, model_data):
+        _retire_model(project_slug, model_data)
+        model_data = None
+    if model_data is not None:
+        if "base" in model_data:
+            # Using an adapter keeps its shared base model warm too
+            model_cache.get(model_data["base_key"])
+        return model_data
+    
+    # Only one request loads a given project; the rest wait for it
+    lock = _load_locks.setdefault(project_slug, asyncio.Lock())
+    async with lock:
+        model_data = model_cache.peek(project_slug)
+        if model_data is not None:
+            return model_data
         
         # Load model config
-        config = model_manager.load_model_config(request.project_slug)
+        config = model_manager.load_model_config(project_slug)
         if not config:
             raise HTTPException(status_code=404, detail="Project not found")
         
-        # Check if checkpoint exists
-        checkpoint_path = Path(model_manager.workspace_dir) / request.project_slug / "checkpoint"
-        if not checkpoint_path.exists():
-            raise HTTPException(status_code=404, detail="No trained model found")
+        # A request that arrives before the warm-up has imported everything waits off the event loop
+        await asyncio.get_running_loop().run_in_executor(inference_executor, _import_inference_stack)
         
-        # Load model and tokenizer
-        model = AutoModelForCausalLM.from_pretrained(str(checkpoint_path))
-        tokenizer = AutoTokenizer.from_pretrained(str(checkpoint_path))
-        
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
+        if config.get("training_mode") == "lora":
+            model_data = await _load_adapter(project_slug, config)
+        else:
+            model_data = await _load_full_model(project_slug, config)
+        model_cache.put(project_slug, model_data)
+        return model_data
+
+def _checkpoint_path(project_slug: str, config: Dict[str, Any]) -> Path:
+    return model_manager.get_output_dir(project_slug, config.get("training_mode", "full"))
+
+def _is_stale(project_slug: str, model_data: Dict[str, Any]) -> bool:
+    """Whether the project has been retrained since its cached model was loaded"""
+    config = model_manager.load_model_config(project_slug)
+    if not config:
+        return False
+    return checkpoint_version(_checkpoint_path(project_slug, config)) != model_data["checkpoint_version"]
+
+def _retire_model(project_slug: str, model_data: Dict[str, Any]):
+    """Take a stale model out of the cache, releasing it once the requests running on it finish"""
+    if model_cache.peek(project_slug) is not model_data:
+        return
+    model_cache.pop(project_slug)
+    task = asyncio.create_task(_release_when_idle(project_slug, model_data))
+    _retiring.add(task)
+    task.add_done_callback(_retiring.discard)
+
+async def _release_when_idle(key: str, model_data: Dict[str, Any]):
+    while not _is_idle(key, model_data):
+        await asyncio.sleep(RETIRE_POLL_SECONDS)
+    _release_model(key, model_data)
+
+async def _load_full_model(project_slug: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Load a fully fine-tuned checkpoint with a batching scheduler of its own"""
+    # Check if checkpoint exists
+    checkpoint_path = model_manager.get_output_dir(project_slug)
+    if not checkpoint_path.exists():
+        raise HTTPException(status_code=404, detail="No trained model found")
+    # Read before loading, so weights rewritten during the load are picked up by the next request
+    version = checkpoint_version(checkpoint_path)
+    
+    # Load model and tokenizer without blocking other requests
+    options = load_options.get(project_slug, DEFAULT_LOAD_OPTIONS)
+    quantization = options["quantization"]
+    loop = asyncio.get_running_loop()
+    model, tokenizer = await loop.run_in_executor(
+        inference_executor, _load_checkpoint, checkpoint_path, quantization, options["backend"]
+    )
+    from inference_backends import OnnxBackend
+    
+    is_onnx = isinstance(model, OnnxBackend)
+    
+    return {
+        "model": model,
+        "scheduler": _create_scheduler(model, tokenizer),
+        "tokenizer": tokenizer,
+        "config": config,
+        "loaded_at": time.time(),
+        "size_bytes": model.size_bytes if is_onnx else model_size_bytes(model),
+        "quantization": quantization,
+        "backend": "onnx" if is_onnx else "torch",
+        "load_options": options,
+        "checkpoint_version": version
+    }
+
+async def get_base_model(model_size: str) -> Dict[str, Any]:
+    """Return the shared base model that LoRA projects of this size run on"""
+    key = f"base:{model_size}"
+    model_data = model_cache.get(key)
+    if model_data is not None:
+        return model_data
+    
+    lock = _load_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        model_data = model_cache.peek(key)
+        if model_data is not None:
+            return model_data
         
-        # Create text generation pipeline
-        pipeline = TextGenerationPipeline(
-            model=model,
-            tokenizer=tokenizer,
-            device=0 if torch.cuda.is_available() else -1,
-            return_full_text=False,
-            do_sample=True
+        model_name = model_manager.MODEL_CONFIGS[model_size]["model_name"]
+        loop = asyncio.get_running_loop()
+        model, tokenizer = await loop.run_in_executor(
+            inference_executor, _load_checkpoint, model_name
         )
-        
-        # Store in active models
-        active_models[request.project_slug] = {
-            "pipeline": pipeline,
+        model_data = {
+            "model": model,
+            "scheduler": _create_scheduler(model, tokenizer),
             "tokenizer": tokenizer,
-            "config": config,
-            "loaded_at": time.time()
+            "config": {"model_size": model_size, "model_name": model_name},
+            "loaded_at": time.time(),
+            "size_bytes": model_size_bytes(model),
+            # Slugs of the cached adapter entries running on this model
+            "adapters": set()
         }
+        model_cache.put(key, model_data)
+        return model_data
+
+async def _load_adapter(project_slug: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach a project's LoRA adapter to the shared base model of its size"""
+    adapter_path = model_manager.get_output_dir(project_slug, "lora")
+    if not (adapter_path / "adapter_config.json").exists():
+        raise HTTPException(status_code=404, detail="No trained adapter found")
+    
+    version = checkpoint_version(adapter_path)
+    base = await get_base_model(config["model_size"])
+    # Module names cannot contain dots, and peft misloads names that occur inside "lora_".
+    # The version suffix keeps a retrained adapter from reusing the old weights or their KV cache
+    adapter_name = f"project_{project_slug.replace('.', '_')}_v{int(version * 1000)}"
+    loop = asyncio.get_running_loop()
+    size_bytes = await loop.run_in_executor(
+        inference_executor, _attach_adapter, base, adapter_name, adapter_path
+    )
+    base["adapters"].add(project_slug)
+    
+    return {
+        "model": base["model"],
+        "scheduler": base["scheduler"],
+        "tokenizer": base["tokenizer"],
+        "config": config,
+        "loaded_at": time.time(),
+        "size_bytes": size_bytes,
+        "base": base,
+        "base_key": f"base:{config['model_size']}",
+        "adapter_name": adapter_name,
+        "checkpoint_version": version
+    }
+
+def _attach_adapter(base: Dict[str, Any], adapter_name: str, adapter_path: Path) -> int:
+    """Load adapter weights into the base model (runs in the inference executor), returning their size"""
+    from peft import PeftModel
+    from inference_backends import TorchBackend
+    
+    scheduler = base["scheduler"]
+    with scheduler.model_lock:
+        model = base["model"]
+        if not hasattr(model, "peft_config"):
+            # The first adapter turns the plain base model into a peft model
+            model = PeftModel.from_pretrained(model, str(adapter_path), adapter_name=adapter_name)
+            model.eval()
+            base["model"] = model
+            scheduler.backend = TorchBackend(model)
+        elif adapter_name not in model.peft_config:
+            model.load_adapter(str(adapter_path), adapter_name=adapter_name)
+        # An older version peft kept resident as its only adapter can go now that it has company
+        project = adapter_name.rsplit("_v", 1)[0]
+        for name in [n for n in model.peft_config if n != adapter_name and n.rsplit("_v", 1)[0] == project]:
+            if not scheduler.has_requests_for(name):
+                if model.active_adapter == name:
+                    model.set_adapter(adapter_name)
+                model.delete_adapter(name)
+    return sum(
+        p.numel() * p.element_size()
+        for name, p in model.named_parameters() if f".{adapter_name}." in name
+    )
+
+def _detach_adapter(model_data: Dict[str, Any]):
+    """Drop an evicted project's adapter weights from its base model"""
+    base = model_data["base"]
+    adapter_name = model_data["adapter_name"]
+    with base["scheduler"].model_lock:
+        model = base["model"]
+        # peft cannot delete its only adapter; a lone adapter stays resident until the base goes
+        if adapter_name not in model.peft_config or len(model.peft_config) == 1:
+            return
+        if model.active_adapter == adapter_name:
+            model.set_adapter(next(name for name in model.peft_config if name != adapter_name))
+        model.delete_adapter(adapter_name)
+
+def _create_scheduler(model, tokenizer) -> "BatchScheduler":
+    from batch_scheduler import BatchScheduler
+    
+    # Every request for this model goes through one batching scheduler
+    return BatchScheduler(
+        model,
+        tokenizer,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_queue_delay_ms=MAX_QUEUE_DELAY_MS,
+        max_queue_size=MAX_QUEUE_SIZE,
+        kv_cache=kv_cache
+    )
+
+def _load_checkpoint(checkpoint_path, quantization: Optional[str] = None, backend: str = "torch"):
+    """Load a trained checkpoint or base model ready for inference (runs in the inference executor)
+
+    With backend="onnx" the model is an OnnxBackend instead of a PyTorch model.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from inference_backends import load_onnx_backend
+    from quantization import load_or_quantize
+    
+    tokenizer = AutoTokenizer.from_pretrained(str(checkpoint_path))
+    
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    
+    if backend == "onnx":
+        # The exported graph is cached next to the checkpoint; any failure falls back to PyTorch
+        try:
+            return load_onnx_backend(checkpoint_path, quantization), tokenizer
+        except Exception as e:
+            print(f"ONNX backend unavailable for {checkpoint_path}, using PyTorch: {e}")
+    
+    if quantization:
+        # Quantized kernels are CPU-only; the quantized copy is cached next to the checkpoint
+        model = load_or_quantize(checkpoint_path, quantization)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(str(checkpoint_path))
+        if torch.cuda.is_available():
+            model.to("cuda")
+    
+    model.eval()
+    return model, tokenizer
+
+def _import_inference_stack():
+    """Import the heavy inference modules and probe the device (runs in the inference executor)"""
+    import batch_scheduler  # noqa: F401
+    import inference_backends  # noqa: F401
+    import peft  # noqa: F401
+    import quantization  # noqa: F401
+    
+    model_manager.device
+    startup_state["imports_loaded"] = True
+
+async def warm_up():
+    """Import the inference stack, then load and exercise the preloaded projects"""
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(inference_executor, _import_inference_stack)
+    
+    for project_slug in PRELOAD_PROJECTS:
+        try:
+            model_data = await get_model(project_slug)
+            # One short generation allocates the KV cache and warms kernels before real traffic
+            request = model_data["scheduler"].submit(
+                "Hello", max_new_tokens=WARMUP_TOKENS, temperature=0,
+                adapter_name=model_data.get("adapter_name")
+            )
+            await request.result()
+            startup_state["preloaded"].append(project_slug)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Preloading {project_slug} failed: {detail}")
+            startup_state["failed"][project_slug] = detail
+    
+    startup_state["ready"] = True
+    print(f"Chat server ready in {time.time() - start_time:.1f}s ({len(startup_state['preloaded'])} model(s) preloaded)")
+
+@app.post("/load-model")
+async def load_model(request: ModelLoadRequest):
+    """Load a trained model for inference"""
+    try:
+        config = model_manager.load_model_config(request.project_slug)
+        if request.quantization and config.get("training_mode") == "lora":
+            raise HTTPException(status_code=400, detail="Quantization is not supported for LoRA projects")
         
-        return {"success": True, "message": "Model loaded successfully"}
+        options = {"quantization": request.quantization, "backend": request.backend}
+        
+        # Check if model is already loaded
+        model_data = model_cache.peek(request.project_slug)
+        # A retrained project is reloaded by get_model below
+        if model_data is not None and not _is_stale(request.project_slug, model_data):
+            # LoRA adapters always run on their shared PyTorch base model
+            if model_data.get("load_options") == options or "adapter_name" in model_data:
+                return {"success": True, "message": "Model already loaded", "backend": model_data.get("backend", "torch")}
+            # Loaded with different options; swap it out
+            model_cache.pop(request.project_slug)
+            _release_model(request.project_slug, model_data)
+        
+        load_options[request.project_slug] = options
+        model_data = await get_model(request.project_slug)
+        return {"success": True, "message": "Model loaded successfully", "backend": model_data.get("backend", "torch")}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/unload-model")
 async def unload_model(request: ModelLoadRequest):
     """Unload a model from memory"""
-    if request.project_slug in active_models:
-        del active_models[request.project_slug]
-        torch.cuda.empty_cache() if torch.cuda.is_available() else None
+    model_data = model_cache.pop(request.project_slug)
+    if model_data is not None:
+        _release_model(request.project_slug, model_data)
         return {"success": True, "message": "Model unloaded"}
     else:
         raise HTTPException(status_code=404, detail="Model not loaded")
@@ -98,54 +486,176 @@ async def unload_model(request: ModelLoadRequest):
 async def get_active_models():
     """Get list of currently loaded models"""
     models = []
-    for slug, model_data in active_models.items():
+    for slug, model_data in model_cache.items():
         models.append({
             "project_slug": slug,
             "config": model_data["config"],
-            "loaded_at": model_data["loaded_at"]
+            "loaded_at": model_data["loaded_at"],
+            "size_bytes": model_data["size_bytes"],
+            "base_model": model_data.get("base_key"),
+            "quantization": model_data.get("quantization"),
+            "backend": model_data.get("backend", "torch")
         })
     return {"models": models}
 
 @app.post("/chat")
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage, http_request: Request):
     """Generate response for a chat message"""
+    chat_requests.inc(project=message.project_slug, endpoint="chat")
     try:
-        if message.project_slug not in active_models:
-            raise HTTPException(status_code=404, detail="Model not loaded")
+        start_time = time.time()
+        rag_index = await get_rag_index(message.project_slug) if message.rag_top_k > 0 else None
+        cache_key = _response_cache_key(message, rag_index)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            latency = time.time() - start_time
+            request_latency_seconds.observe(latency, project=message.project_slug, endpoint="chat")
+            return {**cached, "latency_ms": round(latency * 1000, 2), "cached": True}
         
-        model_data = active_models[message.project_slug]
-        pipeline = model_data["pipeline"]
+        # Evicted or never-loaded models are loaded on demand
+        model_data = await get_model(message.project_slug)
+        from batch_scheduler import QueueFullError
+        
+        prompt = message.message
+        passages = []
+        if rag_index is not None:
+            retrieval_start = time.perf_counter()
+            passages = rag_index.search(message.message, message.rag_top_k)
+            retrieval_time = time.perf_counter() - retrieval_start
+            retrieval_seconds.observe(retrieval_time, project=message.project_slug)
+            if passages:
+                prompt = TURN_SEPARATOR.join(p["text"] for p in passages) + TURN_SEPARATOR + message.message
         
         # Generate response
-        start_time = time.time()
+        try:
+            request = model_data["scheduler"].submit(
+                prompt,
+                max_new_tokens=message.max_tokens,
+                temperature=message.temperature,
+                top_p=message.top_p,
+                adapter_name=model_data.get("adapter_name"),
+                system_prompt=message.system_prompt + TURN_SEPARATOR if message.system_prompt else None,
+                seed=message.seed
+            )
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
         
-        response = pipeline(
-            message.message,
-            max_length=len(message.message.split()) + message.max_tokens,
-            temperature=message.temperature,
-            top_p=message.top_p,
-            do_sample=True,
-            pad_token_id=pipeline.tokenizer.eos_token_id
-        )
+        result = await _result_unless_disconnected(request, http_request)
         
-        generated_text = response[0]["generated_text"]
         latency = time.time() - start_time
+        _record_generation(message.project_slug, "chat", result, latency)
         
-        # Count tokens
-        input_tokens = len(pipeline.tokenizer.encode(message.message))
-        output_tokens = len(pipeline.tokenizer.encode(generated_text))
-        
-        return {
-            "response": generated_text,
+        # Token counts come straight from the ids the scheduler fed and generated
+        response = {
+            "response": result["text"],
             "latency_ms": round(latency * 1000, 2),
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "total_tokens": input_tokens + output_tokens
+            "input_tokens": result["input_tokens"],
+            "output_tokens": result["output_tokens"],
+            "total_tokens": result["input_tokens"] + result["output_tokens"],
+            "cached_tokens": result["cached_tokens"],
+            "truncated_tokens": result["truncated_tokens"],
+            "finish_reason": result["finish_reason"],
+            "timings_ms": result["timings_ms"]
         }
+        if rag_index is not None:
+            response["retrieved"] = passages
+            response["timings_ms"] = {**result["timings_ms"], "retrieval": round(retrieval_time * 1000, 2)}
+        if cache_key:
+            response_cache.put(cache_key, response)
+        return {**response, "cached": False}
     
+    except HTTPException as e:
+        chat_errors.inc(project=message.project_slug, endpoint="chat", status=str(e.status_code))
+        raise
     except Exception as e:
+        chat_errors.inc(project=message.project_slug, endpoint="chat", status="500")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _result_unless_disconnected(request, http_request: Request) -> Dict[str, Any]:
+    """Wait for a generation to finish, cancelling it if the HTTP client disconnects first
+    
+    uvicorn does not cancel a plain HTTP handler when its client goes away, so
+    the connection is checked every DISCONNECT_POLL_SECONDS while waiting.
+    """
+    result = asyncio.ensure_future(request.result())
+    try:
+        while True:
+            done, _ = await asyncio.wait({result}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return result.result()
+            if await http_request.is_disconnected():
+                # Stop spending decode steps on a response nobody will read
+                request.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    except asyncio.CancelledError:
+        request.cancel()
+        raise
+    finally:
+        result.cancel()
+
+def _record_generation(project_slug: str, endpoint: str, result: Dict[str, Any], latency: float):
+    """Record a finished generation's token counts and stage timings"""
+    timings = result["timings_ms"]
+    input_tokens_total.inc(result["input_tokens"], project=project_slug)
+    cached_tokens_total.inc(result["cached_tokens"], project=project_slug)
+    output_tokens_total.inc(result["output_tokens"], project=project_slug)
+    queue_wait_seconds.observe(timings["queue"] / 1000, project=project_slug)
+    prefill_seconds.observe(timings["prefill"] / 1000, project=project_slug)
+    # Prefill produces the first token; every later one costs a decode step
+    if result["output_tokens"] > 1:
+        decode_seconds_per_token.observe(
+            timings["decode"] / 1000 / (result["output_tokens"] - 1), project=project_slug
+        )
+    request_latency_seconds.observe(latency, project=project_slug, endpoint=endpoint)
+
+async def get_rag_index(project_slug: str) -> RagIndex:
+    """A project's retrieval index, brought up to date whenever the corpus has grown or changed"""
+    project_dir = model_manager.workspace_dir / project_slug
+    if not project_dir.exists():
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    # Opening the corpus only maps it, and the fingerprint reads two documents
+    index = rag_indexes.get(project_slug)
+    if index is not None:
+        corpus = CorpusStore(project_dir)
+        current = index.covers(corpus)
+        corpus.close()
+        if current:
+            return index
+    
+    # Documents uploaded with LLM_RAG_INDEX_ON_UPLOAD=0 (or before indexing existed) are embedded here
+    index = await asyncio.to_thread(open_index, project_dir)
+    rag_indexes[project_slug] = index
+    return index
+
+def _response_cache_key(message: ChatMessage, rag_index: Optional[RagIndex] = None) -> Optional[str]:
+    """Response cache key for a /chat request, or None if its response must be generated fresh"""
+    if message.cache is False or response_cache.max_entries <= 0:
+        return None
+    # Sampled output differs run to run unless it is seeded or the caller accepts a repeat
+    if message.temperature > 0 and message.seed is None and not message.cache:
+        return None
+    config = model_manager.load_model_config(message.project_slug)
+    if not config:
+        return None
+    
+    # The checkpoint's modification time changes whenever the project is retrained
+    checkpoint_path = _checkpoint_path(message.project_slug, config)
+    return response_cache_key(
+        project_slug=message.project_slug,
+        checkpoint_version=checkpoint_version(checkpoint_path),
+        load_options=load_options.get(message.project_slug, DEFAULT_LOAD_OPTIONS),
+        message=message.message,
+        system_prompt=message.system_prompt,
+        temperature=message.temperature,
+        max_tokens=message.max_tokens,
+        top_p=message.top_p,
+        seed=message.seed,
+        # Retrieved passages change as the corpus grows
+        rag_top_k=message.rag_top_k,
+        rag_passages=len(rag_index) if rag_index is not None else 0
+    )
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
@@ -166,27 +676,49 @@ manager = ConnectionManager()
 
 @app.websocket("/chat-stream/{project_slug}/{client_id}")
 async def websocket_chat(websocket: WebSocket, project_slug: str, client_id: str):
-    """WebSocket endpoint for streaming chat responses"""
+    """WebSocket endpoint for streaming chat responses
+
+    Each connection is one conversation: every message is answered with the
+    earlier turns as context, and the session's KV cache is kept between turns
+    so only the new message has to be prefilled.
+    """
     await manager.connect(websocket, client_id)
+    session_id = f"{project_slug}/{client_id}"
+    # Token ids of the conversation so far (system prompt, messages and replies)
+    history: List[int] = []
+    scheduler = None
     
     try:
-        if project_slug not in active_models:
+        try:
+            await get_model(project_slug)
+        except HTTPException as e:
+            chat_errors.inc(project=project_slug, endpoint="stream", status=str(e.status_code))
             await manager.send_message(
-                {"error": "Model not loaded"}, client_id
+                {"error": e.detail}, client_id
             )
             return
-        
-        model_data = active_models[project_slug]
-        pipeline = model_data["pipeline"]
+        # Loading the model above has imported the inference stack
+        from batch_scheduler import QueueFullError
         
         while True:
             # Receive message
             data = await websocket.receive_text()
             message_data = json.loads(data)
             
+            if message_data.get("type") == "reset":
+                # Start a new conversation on the same connection
+                history = []
+                if scheduler is not None:
+                    scheduler.end_session(session_id)
+                await manager.send_message({"type": "session_reset"}, client_id)
+                continue
+            
             user_message = message_data.get("message", "")
             temperature = message_data.get("temperature", 0.7)
             max_tokens = message_data.get("max_tokens", 150)
+            top_p = message_data.get("top_p", 0.9)
+            
+            chat_requests.inc(project=project_slug, endpoint="stream")
             
             # Send acknowledgment
             await manager.send_message({
@@ -194,65 +726,155 @@ async def websocket_chat(websocket: WebSocket, project_slug: str, client_id: str
                 "message": user_message
             }, client_id)
             
-            # Generate streaming response
+            # Stream tokens to the client as the model produces them
             start_time = time.time()
+            token_times = []
             
             try:
-                # For now, generate full response (streaming would require custom implementation)
-                response = pipeline(
-                    user_message,
-                    max_length=len(user_message.split()) + max_tokens,
+                # Resolve the model per message in case it was evicted in between
+                model_data = await get_model(project_slug)
+                scheduler = model_data["scheduler"]
+                system_prompt = message_data.get("system_prompt")
+                request = scheduler.submit(
+                    TURN_SEPARATOR + user_message if history else user_message,
+                    max_new_tokens=max_tokens,
                     temperature=temperature,
-                    do_sample=True,
-                    pad_token_id=pipeline.tokenizer.eos_token_id
+                    top_p=top_p,
+                    adapter_name=model_data.get("adapter_name"),
+                    system_prompt=system_prompt + TURN_SEPARATOR if system_prompt and not history else None,
+                    context_ids=history,
+                    session_id=session_id
                 )
-                
-                generated_text = response[0]["generated_text"]
-                latency = time.time() - start_time
-                
-                # Send response in chunks to simulate streaming
-                words = generated_text.split()
-                for i, word in enumerate(words):
+            except QueueFullError as e:
+                chat_errors.inc(project=project_slug, endpoint="stream", status="429")
+                await manager.send_message({
+                    "type": "error",
+                    "error": str(e),
+                    "status": 429
+                }, client_id)
+                continue
+            except HTTPException as e:
+                chat_errors.inc(project=project_slug, endpoint="stream", status=str(e.status_code))
+                await manager.send_message({
+                    "type": "error",
+                    "error": e.detail,
+                    "status": e.status_code
+                }, client_id)
+                continue
+            
+            try:
+                async for event in request.stream():
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    if event.get("done"):
+                        final = event
+                        break
+                    
+                    token_times.append(event["time"])
                     await manager.send_message({
                         "type": "token",
-                        "token": word + " ",
-                        "is_final": i == len(words) - 1
+                        "token": event["token"]
                     }, client_id)
-                    await asyncio.sleep(0.05)  # Simulate streaming delay
                 
-                # Send final metrics
-                input_tokens = len(pipeline.tokenizer.encode(user_message))
-                output_tokens = len(pipeline.tokenizer.encode(generated_text))
+                latency = time.time() - start_time
+                _record_generation(project_slug, "stream", final, latency)
+                time_to_first_token = (token_times[0] - start_time) if token_times else latency
+                inter_token_latency = (
+                    (token_times[-1] - token_times[0]) / (len(token_times) - 1)
+                    if len(token_times) > 1 else 0.0
+                )
                 
+                # Send final metrics
                 await manager.send_message({
                     "type": "complete",
                     "latency_ms": round(latency * 1000, 2),
-                    "input_tokens": input_tokens,
-                    "output_tokens": output_tokens,
-                    "total_tokens": input_tokens + output_tokens
+                    "time_to_first_token_ms": round(time_to_first_token * 1000, 2),
+                    "inter_token_latency_ms": round(inter_token_latency * 1000, 2),
+                    "input_tokens": final["input_tokens"],
+                    "output_tokens": final["output_tokens"],
+                    "total_tokens": final["input_tokens"] + final["output_tokens"],
+                    "cached_tokens": final["cached_tokens"],
+                    "truncated_tokens": final["truncated_tokens"],
+                    "finish_reason": final["finish_reason"],
+                    "timings_ms": final["timings_ms"]
                 }, client_id)
                 
+                # The reply becomes context for the next turn
+                history = request.input_ids + request.generated
+                
             except Exception as e:
+                chat_errors.inc(project=project_slug, endpoint="stream", status="500")
                 await manager.send_message({
                     "type": "error",
                     "error": str(e)
                 }, client_id)
+            finally:
+                # Stop generating if the client disconnected mid-response
+                if not request.finished:
+                    request.cancel()
     
     except WebSocketDisconnect:
         manager.disconnect(client_id)
     except Exception as e:
         print(f"WebSocket error: {e}")
         manager.disconnect(client_id)
+    finally:
+        if scheduler is not None:
+            scheduler.end_session(session_id)
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: the server is up and answering (models may still be loading)"""
     return {
         "status": "healthy",
-        "active_models": len(active_models),
+        "ready": startup_state["ready"],
+        "active_models": len(model_cache),
+        "model_cache": model_cache.stats(),
+        "kv_cache": kv_cache.stats(),
+        "response_cache": response_cache.stats(),
         "system_info": model_manager.get_system_info()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the inference stack is imported and preloaded models are warm, 503 before"""
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=startup_state)
+
+cache_entries = metrics.gauge("llm_cache_entries", "Entries held by each cache", ["cache"])
+cache_used_bytes = metrics.gauge("llm_cache_used_bytes", "Memory held by each cache", ["cache"])
+cache_budget_bytes = metrics.gauge("llm_cache_budget_bytes", "Memory budget of each cache", ["cache"])
+cache_hits = metrics.counter("llm_cache_hits_total", "Cache lookups that found an entry", ["cache"])
+cache_misses = metrics.counter("llm_cache_misses_total", "Cache lookups that found nothing", ["cache"])
+cache_evictions = metrics.counter("llm_cache_evictions_total", "Entries evicted to stay within budget", ["cache"])
+scheduler_batch_size = metrics.gauge("llm_scheduler_batch_size", "Requests decoding in each model's batch", ["project"])
+scheduler_queue_size = metrics.gauge("llm_scheduler_queue_size", "Requests waiting for a batch slot", ["project"])
+
+@metrics.on_collect
+def _collect_serving_state():
+    """Refresh cache and scheduler gauges from their current state at scrape time"""
+    for name, stats in (("model", model_cache.stats()), ("kv", kv_cache.stats()), ("response", response_cache.stats())):
+        cache_entries.set(stats.get("models", stats.get("entries", 0)), cache=name)
+        if "used_bytes" in stats:
+            cache_used_bytes.set(stats["used_bytes"], cache=name)
+            cache_budget_bytes.set(stats["budget_bytes"], cache=name)
+        cache_hits.set(stats["hits"], cache=name)
+        cache_misses.set(stats["misses"], cache=name)
+        cache_evictions.set(stats["evictions"], cache=name)
+    
+    # Unloaded models drop out of the scheduler gauges
+    scheduler_batch_size.clear()
+    scheduler_queue_size.clear()
+    for slug, model_data in model_cache.items():
+        if "adapter_name" in model_data:
+            continue
+        scheduler_batch_size.set(model_data["scheduler"].batch_size, project=slug)
+        scheduler_queue_size.set(model_data["scheduler"].queue_size, project=slug)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: request and token counters, latency histograms, cache and resource gauges"""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Serve static files for frontend
 if Path("../frontend/dist").exists():
     app.mount("/", StaticFiles(directory="../frontend/dist", html=True), name="static")
@@ -0,0 +1,203 @@
+"""
+Tests for the continuous-batching scheduler
+"""
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+
+from batch_scheduler import BatchScheduler, GenerationRequest, QueueFullError
+
+
+def _greedy(scheduler, prompt, max_new_tokens):
+    request = scheduler.submit(prompt, max_new_tokens=max_new_tokens, temperature=0)
+    list(request.events())
+    return request.generated
+
+
+def test_batched_greedy_matches_solo_decoding(tiny_model):
+    model, tokenizer = tiny_model
+    prompts = ["Once upon a time", "Tick would wind himself up and hop", "magical"]
+
+    solo = BatchScheduler(model, tokenizer, max_batch_size=1)
+    expected = [_greedy(solo, prompt, 12 + i) for i, prompt in enumerate(prompts)]
+    solo.stop()
+
+    batched = BatchScheduler(model, tokenizer, max_batch_size=8, max_queue_delay_ms=1)
+    requests = []
+    for i, prompt in enumerate(prompts):
+        # Stagger arrivals so sequences join a batch that is already decoding
+        requests.append(batched.submit(prompt, max_new_tokens=12 + i, temperature=0))
+        time.sleep(0.005)
+    for request in requests:
+        events = list(request.events())
+        assert events[-1]["done"]
+    batched.stop()
+
+    assert [r.generated for r in requests] == expected
+
+
+def test_max_new_tokens_is_respected(tiny_model):
+    model, tokenizer = tiny_model
+    scheduler = BatchScheduler(model, tokenizer)
+    request = scheduler.submit("Once upon a time", max_new_tokens=5, temperature=0.7)
+    final = list(request.events())[-1]
+    scheduler.stop()
+
+    assert final["output_tokens"] <= 5
+    assert final["output_tokens"] == len(request.generated)
+
+
+def test_large_max_new_tokens_keeps_the_tail_of_a_long_prompt(tiny_model):
+    model, tokenizer = tiny_model
+    scheduler = BatchScheduler(model, tokenizer)
+    prompt_ids = tokenizer.encode("Tick would wind himself up and hop " * 90)
+    request = scheduler.submit(tokenizer.decode(prompt_ids), max_new_tokens=500, temperature=0)
+    done = list(request.events())[-1]
+    scheduler.stop()
+
+    # Half of the 128-position window stays for the prompt, the rest for generation
+    assert request.input_ids == prompt_ids[-64:]
+    assert done["truncated_tokens"] == len(prompt_ids) - 64
+    assert done["output_tokens"] <= 64
+    assert done["finish_reason"] in ("length", "stop")
+
+
+def test_streamed_pieces_are_decoded_incrementally(tiny_model):
+    _, tokenizer = tiny_model
+    text = "Tick hopped to the café 🥕 and back, " * 8
+    token_ids = tokenizer.encode(text)
+
+    class CountingTokenizer:
+        eos_token_id = tokenizer.eos_token_id
+
+        def __init__(self):
+            self.lengths = []
+
+        def decode(self, ids, **kwargs):
+            self.lengths.append(len(ids))
+            return tokenizer.decode(ids, **kwargs)
+
+    counting = CountingTokenizer()
+    request = GenerationRequest("", counting, max_new_tokens=len(token_ids))
+    for token_id in token_ids:
+        request._push(token_id)
+    events = []
+    while not request._events.empty():
+        events.append(request._events.get_nowait())
+
+    pieces = [event["token"] for event in events if "token" in event]
+    assert "".join(pieces) == events[-1]["text"] == text
+    assert not any("�" in piece for piece in pieces)
+    # Each step decodes a few trailing tokens; only the final text covers the whole reply
+    assert counting.lengths[-1] == len(token_ids)
+    assert max(counting.lengths[:-1]) <= 6
+
+
+def test_full_queue_is_rejected_and_requests_can_be_cancelled(tiny_model):
+    model, tokenizer = tiny_model
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=1, max_queue_size=1)
+    scheduler.stop()  # Nothing drains the queue once the decode loop has stopped
+
+    request = scheduler.submit("Once upon a time")
+    with pytest.raises(QueueFullError):
+        scheduler.submit("Once upon a time")
+
+    request.cancel()
+    assert request.cancelled
+
+
+def test_chat_cancels_generation_when_client_disconnects(tiny_model, monkeypatch):
+    pytest.importorskip("fastapi")
+    import asyncio
+
+    from fastapi import HTTPException
+
+    import serve
+
+    class Disconnecting:
+        async def is_disconnected(self):
+            return True
+
+    # Check at once rather than after a poll interval the tiny model could finish within
+    monkeypatch.setattr(serve, "DISCONNECT_POLL_SECONDS", 0)
+    model, tokenizer = tiny_model
+    scheduler = BatchScheduler(model, tokenizer)
+
+    async def chat():
+        request = scheduler.submit("Once upon a time", max_new_tokens=100, temperature=0)
+        with pytest.raises(HTTPException) as error:
+            await serve._result_unless_disconnected(request, Disconnecting())
+        return request, error.value.status_code
+
+    request, status = asyncio.run(chat())
+    deadline = time.time() + 10
+    while scheduler.batch_size and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+
+    assert status == 499 and request.cancelled
+    assert scheduler.batch_size == 0
+    assert len(request.generated) < 100
+
+
+def test_one_batch_can_mix_lora_adapters(tiny_model_dir):
+    pytest.importorskip("peft")
+    import torch
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    torch.manual_seed(0)
+    # Randomly initialised adapters so each one changes the output
+    for name in ("first", "second"):
+        lora_config = LoraConfig(task_type="CAUSAL_LM", r=4, lora_alpha=64, init_lora_weights=False)
+        if name == "first":
+            model = get_peft_model(model, lora_config, adapter_name=name)
+        else:
+            model.add_adapter(name, lora_config)
+    model.eval()
+
+    prompt = "Once upon a time"
+    solo = BatchScheduler(model, tokenizer, max_batch_size=1)
+    expected = {}
+    for adapter in ("first", "second", None):
+        request = solo.submit(prompt, max_new_tokens=10, temperature=0, adapter_name=adapter)
+        list(request.events())
+        expected[adapter] = request.generated
+    solo.stop()
+    assert expected["first"] != expected["second"]
+
+    batched = BatchScheduler(model, tokenizer, max_batch_size=8, max_queue_delay_ms=20)
+    requests = {
+        adapter: batched.submit(prompt, max_new_tokens=10, temperature=0, adapter_name=adapter)
+        for adapter in ("first", "second", None)
+    }
+    for request in requests.values():
+        list(request.events())
+    batched.stop()
+
+    assert {adapter: r.generated for adapter, r in requests.items()} == expected
+
+
+def test_done_event_reports_exact_counts_finish_reason_and_timings(tiny_model):
+    model, tokenizer = tiny_model
+    scheduler = BatchScheduler(model, tokenizer)
+    # Longer than the 128-position context, so the front of the prompt is dropped
+    prompt = "Tick would wind himself up and hop " * 20
+    request = scheduler.submit(prompt, max_new_tokens=6, temperature=0)
+    done = list(request.events())[-1]
+    scheduler.stop()
+
+    assert done["input_tokens"] == len(request.input_ids) == 128 - 6
+    assert done["truncated_tokens"] == len(tokenizer.encode(prompt)) - done["input_tokens"]
+    assert done["output_tokens"] == len(request.generated)
+    if done["output_tokens"] == 6:
+        assert done["finish_reason"] == "length"
+    else:
+        assert done["finish_reason"] == "stop"
+    assert set(done["timings_ms"]) == {"queue", "tokenize", "prefill", "decode", "detokenize"}
+    assert done["timings_ms"]["prefill"] > 0
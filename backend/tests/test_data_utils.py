@@ -0,0 +1,248 @@
+"""
+Tests for upload parsing and corpus storage
+"""
+import gc
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("pdfplumber")
+pytest.importorskip("datasets")
+
+from data_utils import DataProcessor
+
+
+def test_txt_is_streamed_in_paragraph_chunks(tmp_path):
+    paragraphs = [f"Paragraph {i} " + "word " * 20 + "\n\n" for i in range(10)]
+    path = tmp_path / "stories.txt"
+    path.write_text("".join(paragraphs), encoding="utf-8")
+
+    processor = DataProcessor(str(tmp_path / "data"))
+    processor.TXT_CHUNK_CHARS = 200
+    texts = list(processor.iter_upload(str(path), "txt"))
+
+    assert len(texts) > 1
+    assert "".join(texts) == path.read_text(encoding="utf-8")
+    assert all(text.endswith("\n\n") for text in texts)
+
+
+def test_csv_and_jsonl_are_parsed_incrementally(tmp_path):
+    csv_path = tmp_path / "rows.csv"
+    csv_path.write_text("id,story\n1,hello\n2,\n3,world\n", encoding="utf-8")
+    jsonl_path = tmp_path / "rows.jsonl"
+    jsonl_path.write_text('{"text": "a"}\n\n{"content": "b"}\n', encoding="utf-8")
+
+    processor = DataProcessor(str(tmp_path / "data"))
+    processor.CSV_CHUNK_ROWS = 1
+
+    assert processor.process_upload(str(csv_path), "csv") == ["hello", "world"]
+    assert processor.process_upload(str(jsonl_path), "jsonl") == ["a", "b"]
+
+
+def _write_pdf(path, page_texts):
+    """Minimal one-line-per-page PDF"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", "", "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(out)
+
+
+def test_pdf_pages_are_extracted_in_parallel_and_in_order(tmp_path):
+    first, second = tmp_path / "first.pdf", tmp_path / "second.pdf"
+    _write_pdf(first, [f"Page {i} of the first book" for i in range(7)])
+    _write_pdf(second, [f"Page {i} of the second book" for i in range(5)])
+    notes = tmp_path / "notes.jsonl"
+    notes.write_text('{"text": "between the books"}\n', encoding="utf-8")
+
+    processor = DataProcessor(str(tmp_path / "data"))
+    serial = processor.process_upload(str(first), "pdf")
+    processor.PDF_WORKERS = 2
+    processor.PDF_PARALLEL_MIN_PAGES = 1
+    processor.PDF_PAGES_PER_TASK = 2
+    progress = []
+
+    assert processor.process_upload(str(first), "pdf") == serial
+    documents = list(processor.iter_uploads(
+        [(str(first), "pdf"), (str(notes), "jsonl"), (str(second), "pdf")],
+        on_progress=lambda done, total: progress.append((done, total))
+    ))
+
+    assert serial == [f"Page {i} of the first book" for i in range(7)]
+    assert [i for i, _ in documents] == [0] * 7 + [1] + [2] * 5
+    assert [text for _, text in documents] == serial + ["between the books"] + [
+        f"Page {i} of the second book" for i in range(5)
+    ]
+    assert progress[-1] == (12, 12)
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+def test_pdf_pages_that_time_out_are_skipped(tmp_path):
+    from pdf_extract import ParallelPdfExtractor
+
+    path = tmp_path / "slow.pdf"
+    _write_pdf(path, ["only page"])
+
+    # No worker can start up and parse a page this fast
+    with ParallelPdfExtractor(workers=1, page_timeout=1e-6) as extractor:
+        assert list(extractor.texts(extractor.submit(str(path)))) == []
+    assert extractor.skipped_pages == 1
+
+
+def test_save_corpus_appends_to_memory_mapped_store(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    count, total_chars = processor.save_corpus("demo", (t for t in ["one", "twö"]))
+    processor.save_corpus("demo", ["three"])
+
+    assert (count, total_chars) == (2, 6)
+    corpus = processor.load_corpus("demo")
+    assert len(corpus) == 3
+    assert list(corpus) == ["one", "twö", "three"]
+    assert corpus[-1] == "three"
+
+    processor.save_corpus("demo", ["fresh"], append=False)
+    assert list(processor.load_corpus("demo")) == ["fresh"]
+
+
+def test_corpus_fingerprint_survives_appends_but_not_replacement(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    processor.save_corpus("demo", ["one", "two", "three"])
+    fingerprint = processor.load_corpus("demo").fingerprint(3)
+
+    processor.save_corpus("demo", ["four"])
+    corpus = processor.load_corpus("demo")
+    assert corpus.fingerprint(3) == fingerprint
+    assert corpus.fingerprint(4) != fingerprint
+
+    processor.save_corpus("demo", ["one", "two", "tree"], append=False)
+    assert processor.load_corpus("demo").fingerprint(3) != fingerprint
+    processor.save_corpus("demo", ["one"], append=False)
+    assert processor.load_corpus("demo").fingerprint(3) != fingerprint
+
+
+def test_concurrent_saves_to_one_project_do_not_interleave(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    batches = [[f"{name} document {i} " * 20 for i in range(200)] for name in ("first", "second")]
+    threads = [threading.Thread(target=processor.save_corpus, args=("demo", iter(batch))) for batch in batches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    corpus = processor.load_corpus("demo")
+    assert sorted(corpus) == sorted(batches[0] + batches[1])
+    assert corpus.total_bytes == (tmp_path / "demo" / "corpus.bin").stat().st_size
+
+
+def test_concurrent_uploads_are_ingested_one_at_a_time(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    import train
+
+    monkeypatch.setattr(train, "data_processor", DataProcessor(str(tmp_path)))
+    monkeypatch.setattr(train, "RAG_INDEX_ON_UPLOAD", True)
+    files = []
+    for name in ("first", "second"):
+        path = tmp_path / f"{name}.jsonl"
+        path.write_text("".join(json.dumps({"text": f"The {name} upload, story {i}: " + "words " * i}) + "\n"
+                                for i in range(300)))
+        files.append([(str(path), "jsonl")])
+
+    results = []
+    threads = [threading.Thread(target=lambda f=f: results.append(train.ingest_files("demo", f))) for f in files]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [counts[0]["texts_count"] for counts, _ in results] == [300, 300]
+    corpus = train.data_processor.load_corpus("demo")
+    assert len(corpus) == 600 and all(text.startswith("The ") for text in corpus)
+    assert train.data_processor.update_rag_index("demo")["num_docs"] == 600
+
+
+def test_legacy_corpus_json_is_migrated(tmp_path):
+    project_dir = tmp_path / "old"
+    project_dir.mkdir()
+    (project_dir / "corpus.json").write_text(json.dumps({"texts": ["a", "b"]}), encoding="utf-8")
+
+    corpus = DataProcessor(str(tmp_path)).load_corpus("old")
+
+    assert list(corpus) == ["a", "b"]
+    assert not (project_dir / "corpus.json").exists()
+    assert (project_dir / "corpus.json.migrated").exists()
+
+
+def test_token_cache_only_tokenizes_new_documents(tmp_path, tiny_model_dir):
+    from token_cache import TokenShardCache
+
+    processor = DataProcessor(str(tmp_path))
+    processor.save_corpus("demo", ["Once upon a time", "Tick hopped"])
+    dataset = processor.prepare_training_data(processor.load_corpus("demo"), str(tiny_model_dir), max_length=16)
+    processor.prepare_training_data(processor.load_corpus("demo"), str(tiny_model_dir), max_length=32)
+    processor.save_corpus("demo", ["through the village"])
+    dataset = processor.prepare_training_data(
+        processor.load_corpus("demo"), str(tiny_model_dir), max_length=16, packing="pad"
+    )
+
+    meta = TokenShardCache(processor.load_corpus("demo"), str(tiny_model_dir))._load_meta()
+    assert [shard["docs"] for shard in meta["shards"]] == [2, 1]
+    assert len(dataset) == 3
+    assert dataset[0]["input_ids"].shape == (16,)
+
+    # Replacing the corpus invalidates the cached shards
+    processor.save_corpus("demo", ["fresh"], append=False)
+    processor.prepare_training_data(processor.load_corpus("demo"), str(tiny_model_dir))
+    meta = TokenShardCache(processor.load_corpus("demo"), str(tiny_model_dir))._load_meta()
+    assert [shard["docs"] for shard in meta["shards"]] == [1]
+
+
+def test_ad_hoc_texts_are_removed_with_their_dataset(tmp_path, tiny_model_dir):
+    processor = DataProcessor(str(tmp_path))
+    dataset = processor.prepare_training_data(["Once upon a time", "Tick hopped"] * 4, str(tiny_model_dir), max_length=8)
+    workspace = Path(dataset.workspace.name)
+
+    assert workspace.exists()
+    assert len(dataset) and dataset[0]["input_ids"].shape == (8,)
+
+    del dataset
+    gc.collect()
+    assert not workspace.exists()
+
+
+def test_packing_modes_keep_every_token(tmp_path, tiny_model_dir):
+    from token_cache import CausalLMCollator
+
+    processor = DataProcessor(str(tmp_path))
+    processor.save_corpus("demo", ["Once upon a time " * 6, "Tick", "hopped through the village"])
+    corpus = processor.load_corpus("demo")
+
+    padded = processor.prepare_training_data(corpus, str(tiny_model_dir), max_length=8, packing="pad")
+    packed = processor.prepare_training_data(corpus, str(tiny_model_dir), max_length=8, packing="pack")
+    bucketed = processor.prepare_training_data(corpus, str(tiny_model_dir), max_length=8, packing="bucket")
+
+    total = packed.num_tokens
+    assert padded.stats()["dropped_tokens"] > 0
+    assert sum(len(packed[i]["input_ids"]) for i in range(len(packed))) == total
+    assert sum(len(bucketed[i]["input_ids"]) for i in range(len(bucketed))) == total
+    assert packed.stats()["padding_efficiency"] > padded.stats()["padding_efficiency"] - 1e-9
+    assert all(len(packed[i]["input_ids"]) == 8 for i in range(len(packed) - 1))
+
+    batch = CausalLMCollator(pad_token_id=0)([bucketed[0], bucketed[len(bucketed) - 1]])
+    assert (batch["labels"][batch["attention_mask"] == 0] == -100).all()
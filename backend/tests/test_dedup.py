@@ -0,0 +1,76 @@
+"""
+Tests for exact and near-duplicate detection on upload
+"""
+from corpus_store import CorpusStore
+from dedup import Deduplicator
+
+STORY = ("Tick the rabbit hopped through the village looking for carrots and clover. "
+         "He met a fox by the old mill, who told him where the best gardens were hidden. ") * 3
+OTHER = ("The lighthouse keeper polished the great lamp every evening before the ships came in, "
+         "and wrote the weather in a battered logbook that had belonged to her grandfather.")
+
+
+def _ingest(corpus_dir, texts, **kwargs):
+    corpus = CorpusStore(corpus_dir)
+    with Deduplicator(corpus) as dedup:
+        corpus.append(text for text in (dedup.process(t, **kwargs) for t in texts) if text is not None)
+    return dedup.stats
+
+
+def test_exact_and_near_duplicates_are_dropped(tmp_path):
+    near = STORY.replace("old mill", "old windmill")
+    stats = _ingest(tmp_path, [STORY, "  " + STORY.upper() + "\n", near, OTHER, "short row", "Short  ROW"])
+
+    assert list(CorpusStore(tmp_path)) == [STORY, OTHER, "short row"]
+    assert stats["exact_duplicates"] == 2
+    assert stats["near_duplicates"] == 1
+    assert stats["estimated_tokens_saved"] == (len(STORY) + 2 + len(near) + len("Short  ROW")) // 4
+
+
+def test_later_uploads_are_checked_against_the_corpus(tmp_path):
+    _ingest(tmp_path, [STORY])
+    # Documents stored without deduplication are indexed on the next upload
+    CorpusStore(tmp_path).append([OTHER])
+
+    stats = _ingest(tmp_path, [OTHER, STORY, "A brand new story about a dragon who loved to bake bread."])
+    assert stats["exact_duplicates"] == 2
+    assert len(CorpusStore(tmp_path)) == 3
+
+    # A replaced corpus starts the duplicate index over
+    CorpusStore(tmp_path).clear()
+    stats = _ingest(tmp_path, [STORY])
+    assert stats["exact_duplicates"] == 0
+    assert list(CorpusStore(tmp_path)) == [STORY]
+
+
+def test_state_is_flushed_to_disk_and_failed_uploads_are_forgotten(tmp_path, monkeypatch):
+    monkeypatch.setattr(Deduplicator, "FLUSH_DOCS", 2)
+    chapter = " ".join(f"On day {day} the rabbit found {day * 3} carrots." for day in range(60))
+    stories = [f"Story number {i}: " + chapter for i in range(5)]
+    stats = _ingest(tmp_path, [f"Document {i} is about topic {i * 7919}" for i in range(5)] + stories)
+    # Numbered copies of the story only differ in a few shingles
+    assert stats["near_duplicates"] == 4
+    assert len(CorpusStore(tmp_path)) == 6
+
+    # An upload that fails after a flush leaves nothing behind
+    corpus = CorpusStore(tmp_path)
+    try:
+        with Deduplicator(corpus) as dedup:
+            for i in range(3):
+                assert dedup.process(f"Unsaved note {i}") is not None
+            raise RuntimeError("upload failed")
+    except RuntimeError:
+        pass
+    assert _ingest(tmp_path, ["Unsaved note 0", "Unsaved note 1"])["exact_duplicates"] == 0
+    assert len(CorpusStore(tmp_path)) == 8
+
+
+def test_repeated_pdf_headers_and_footers_are_stripped(tmp_path):
+    pages = [f"ACME Corp Annual Report\nBody of page {i} talks about {OTHER.split()[i]}.\nPage {i + 1} of 9"
+             for i in range(6)]
+    stats = _ingest(tmp_path, pages, strip_edges=True)
+
+    corpus = list(CorpusStore(tmp_path))
+    assert corpus[:3] == pages[:3]
+    assert corpus[3:] == [f"Body of page {i} talks about {OTHER.split()[i]}." for i in range(3, 6)]
+    assert stats["boilerplate_lines"] == 6
@@ -0,0 +1,54 @@
+"""
+Tests for the ONNX export and the onnxruntime generation backend
+"""
+import shutil
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from batch_scheduler import BatchScheduler
+from inference_backends import ONNX_DIR, OnnxBackend, export_onnx, load_onnx_backend
+
+
+def _generate(scheduler, prompts, max_new_tokens):
+    requests = []
+    for prompt in prompts:
+        requests.append(scheduler.submit(prompt, max_new_tokens=max_new_tokens, temperature=0))
+        time.sleep(0.005)
+    for request in requests:
+        list(request.events())
+    scheduler.stop()
+    return [r.generated for r in requests]
+
+
+def test_onnx_backend_matches_pytorch(tmp_path, tiny_model_dir, tiny_model):
+    model, tokenizer = tiny_model
+    checkpoint = tmp_path / "checkpoint"
+    shutil.copytree(tiny_model_dir, checkpoint)
+    prompts = ["Once upon a time", "Tick would wind himself up and hop", "magical"]
+
+    backend = load_onnx_backend(checkpoint)
+    assert isinstance(backend, OnnxBackend)
+    expected = _generate(BatchScheduler(model, tokenizer, max_batch_size=8, max_queue_delay_ms=1), prompts, 10)
+    actual = _generate(BatchScheduler(backend, tokenizer, max_batch_size=8, max_queue_delay_ms=1), prompts, 10)
+    assert actual == expected
+
+
+def test_export_is_cached_until_checkpoint_changes(tmp_path, tiny_model_dir):
+    import os
+
+    checkpoint = tmp_path / "checkpoint"
+    shutil.copytree(tiny_model_dir, checkpoint)
+
+    onnx_path = export_onnx(checkpoint)
+    assert onnx_path.parent == checkpoint / ONNX_DIR
+    exported_at = onnx_path.stat().st_mtime_ns
+    assert export_onnx(checkpoint).stat().st_mtime_ns == exported_at
+
+    weights = next(checkpoint.glob("*.safetensors"))
+    os.utime(weights, (weights.stat().st_atime, weights.stat().st_mtime + 10))
+    assert export_onnx(checkpoint).stat().st_mtime_ns != exported_at
@@ -0,0 +1,80 @@
+"""
+Tests for the persistent training job queue
+"""
+import pytest
+
+from job_queue import JobQueue, QUEUED, RUNNING, PAUSED, DONE, FAILED
+
+
+def test_jobs_run_in_order_and_survive_a_restart(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    jobs = JobQueue(db_path)
+    first = jobs.enqueue("alpha", {"epochs": 1})
+    second = jobs.enqueue("beta", {"epochs": 2})
+    assert jobs.queue_position(second["id"]) == 1
+
+    claimed = jobs.claim_next()
+    assert claimed["id"] == first["id"] and claimed["status"] == RUNNING
+
+    # A new process sees the same queue and re-queues the interrupted job
+    reopened = JobQueue(db_path)
+    assert reopened.requeue_interrupted() == 1
+    assert [job["status"] for job in reopened.list()] == [QUEUED, QUEUED]
+    assert reopened.claim_next()["id"] == first["id"]
+    assert reopened.get(second["id"])["config"] == {"epochs": 2}
+
+
+def test_control_requests_and_progress(tmp_path):
+    jobs = JobQueue(tmp_path / "jobs.db")
+    job = jobs.enqueue("alpha", {})
+    jobs.claim_next()
+
+    jobs.request_control(job["id"], "pause")
+    assert jobs.control(job["id"]) == "pause"
+    jobs.update_progress(job["id"], {"current_step": 5})
+    jobs.set_resume_checkpoint(job["id"], "checkpoint-5")
+    jobs.set_status(job["id"], PAUSED)
+
+    paused = jobs.get(job["id"])
+    assert paused["control"] is None
+    assert paused["progress"] == {"current_step": 5}
+    assert paused["resume_checkpoint"] == "checkpoint-5"
+
+    jobs.set_status(job["id"], QUEUED)
+    assert jobs.claim_next()["id"] == job["id"]
+    jobs.set_status(job["id"], DONE)
+    assert jobs.get(job["id"])["finished_at"] is not None
+    assert jobs.claim_next() is None
+
+
+def test_job_whose_worker_cannot_start_is_failed(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    import asyncio
+
+    import train
+
+    jobs = JobQueue(tmp_path / "jobs.db")
+    job = jobs.enqueue("alpha", {})
+
+    def start_worker(job):
+        raise OSError("Too many open files")
+
+    monkeypatch.setattr(train, "job_queue", jobs)
+    monkeypatch.setattr(train, "start_worker", start_worker)
+    monkeypatch.setattr(train, "JOB_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(train, "training_status", dict(train.training_status))
+
+    async def dispatch_until_finished():
+        dispatcher = asyncio.create_task(train.dispatch_jobs())
+        for _ in range(200):
+            if jobs.get(job["id"])["status"] != RUNNING and jobs.count(QUEUED) == 0:
+                break
+            await asyncio.sleep(0.01)
+        dispatcher.cancel()
+
+    asyncio.run(dispatch_until_finished())
+
+    failed = jobs.get(job["id"])
+    assert failed["status"] == FAILED
+    assert "Too many open files" in failed["error"]
+    assert train.training_status["status"] == FAILED
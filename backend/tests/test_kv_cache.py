@@ -0,0 +1,69 @@
+"""
+Tests for KV-cache reuse across chat turns and shared prompt prefixes
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from batch_scheduler import BatchScheduler
+from kv_cache import KVCache
+
+
+def _run(scheduler, prompt, **kwargs):
+    request = scheduler.submit(prompt, max_new_tokens=8, temperature=0, **kwargs)
+    list(request.events())
+    return request
+
+
+def test_follow_up_turn_reuses_session_cache(tiny_model):
+    model, tokenizer = tiny_model
+    cached = BatchScheduler(model, tokenizer, kv_cache=KVCache(64 * 1024 ** 2))
+    uncached = BatchScheduler(model, tokenizer)
+
+    first = _run(cached, "Once upon a time", session_id="chat")
+    context = first.input_ids + first.generated
+    second = _run(cached, "\n\nTick would wind himself up", context_ids=context, session_id="chat")
+    expected = _run(uncached, "\n\nTick would wind himself up", context_ids=context)
+    cached.stop()
+    uncached.stop()
+
+    # Everything fed during the first turn is reused; only the new message is prefilled
+    assert second.cached_tokens >= len(context) - 1
+    assert second.input_ids == expected.input_ids
+    assert second.generated == expected.generated
+
+
+def test_system_prompt_prefix_is_shared_across_sessions(tiny_model):
+    model, tokenizer = tiny_model
+    kv_cache = KVCache(64 * 1024 ** 2)
+    scheduler = BatchScheduler(model, tokenizer, kv_cache=kv_cache)
+    uncached = BatchScheduler(model, tokenizer)
+    system_prompt = "You are a storyteller who loves clockwork animals. "
+
+    _run(scheduler, "Tell me about Tick", system_prompt=system_prompt, session_id="a")
+    other = _run(scheduler, "magical", system_prompt=system_prompt, session_id="b")
+    expected = _run(uncached, "magical", system_prompt=system_prompt)
+    scheduler.stop()
+    uncached.stop()
+
+    assert other.cached_tokens == len(tokenizer.encode(system_prompt))
+    assert other.generated == expected.generated
+    # Stopping the scheduler drops everything it cached
+    assert len(kv_cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    def past(length):
+        return ((torch.zeros(1, 2, length, 4), torch.zeros(1, 2, length, 4)),)
+
+    entry_bytes = 2 * 2 * 10 * 4 * 4
+    kv_cache = KVCache(2 * entry_bytes)
+    kv_cache.store("s:session:a", range(10), past(10))
+    kv_cache.store("s:session:b", range(10), past(10))
+    assert kv_cache.lookup(["s:session:a"], "s:prefix:", list(range(12))) is not None
+    kv_cache.store("s:session:c", range(10), past(10))
+
+    assert "s:session:a" in kv_cache and "s:session:b" not in kv_cache
+    length, cached = kv_cache.lookup(["s:session:a"], "s:prefix:", list(range(10)))
+    # At least one prompt token is always left to prefill
+    assert length == 9 and cached[0][0].shape[2] == 9
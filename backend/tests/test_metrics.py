@@ -0,0 +1,62 @@
+"""
+Tests for the Prometheus metrics registry and the chat server's /metrics endpoint
+"""
+import json
+import shutil
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_registry_renders_text_exposition_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests received", ["project"])
+    latency = registry.histogram("latency_seconds", "Latency", ["project"], buckets=(0.1, 1.0))
+    requests.inc(project='say "hi"')
+    requests.inc(2, project='say "hi"')
+    latency.observe(0.05, project="a")
+    latency.observe(0.5, project="a")
+    latency.observe(5, project="a")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{project="say \\"hi\\""} 3' in lines
+    # Buckets are cumulative and end with +Inf
+    assert 'latency_seconds_bucket{project="a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{project="a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{project="a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{project="a"} 3' in lines
+    assert 'latency_seconds_sum{project="a"} 5.55' in lines
+
+    with pytest.raises(ValueError):
+        requests.inc(endpoint="chat")
+
+
+def test_chat_requests_show_up_in_metrics(tiny_model_dir, tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import serve
+
+    shutil.copytree(tiny_model_dir, tmp_path / "demo" / "checkpoint")
+    (tmp_path / "demo" / "config.json").write_text(json.dumps({"model_size": "toy", "training_mode": "full"}))
+    monkeypatch.setattr(serve.model_manager, "workspace_dir", tmp_path)
+
+    with TestClient(serve.app) as client:
+        response = client.post("/chat", json={
+            "message": "Once upon a time", "project_slug": "demo", "temperature": 0, "max_tokens": 5
+        }).json()
+        assert client.post("/chat", json={"message": "Hi", "project_slug": "missing"}).status_code == 404
+        body = client.get("/metrics").text
+        model_data = serve.model_cache.pop("demo")
+        serve._release_model("demo", model_data)
+
+    lines = body.splitlines()
+    assert 'llm_chat_requests_total{project="demo",endpoint="chat"} 1' in lines
+    assert 'llm_chat_errors_total{project="missing",endpoint="chat",status="404"} 1' in lines
+    assert f'llm_output_tokens_total{{project="demo"}} {response["output_tokens"]}' in lines
+    assert 'llm_prefill_seconds_count{project="demo"} 1' in lines
+    assert 'llm_request_latency_seconds_count{project="demo",endpoint="chat"} 1' in lines
+    assert 'llm_cache_entries{cache="model"} 1' in lines
+    assert any(line.startswith("llm_cpu_percent ") for line in lines)
@@ -0,0 +1,132 @@
+"""
+Tests for the memory-budgeted model cache
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from model_cache import ModelCache
+
+
+def _entry(size, busy=False):
+    return {"size_bytes": size, "busy": busy}
+
+
+def test_least_recently_used_model_is_evicted():
+    evicted = []
+    cache = ModelCache(250, on_evict=lambda key, entry: evicted.append(key))
+    cache.put("a", _entry(100))
+    cache.put("b", _entry(100))
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("c", _entry(100))
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_busy_models_are_not_evicted():
+    cache = ModelCache(150, can_evict=lambda key, entry: not entry["busy"])
+    cache.put("busy", _entry(100, busy=True))
+    cache.put("idle", _entry(40))
+    cache.put("new", _entry(100))
+
+    assert "busy" in cache and "new" in cache
+    assert "idle" not in cache
+
+
+def test_hit_and_miss_counters():
+    cache = ModelCache(100)
+    cache.put("a", _entry(10))
+    cache.get("a")
+    cache.get("missing")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["used_bytes"]) == (1, 1, 10)
+
+
+class _Scheduler:
+    """Stands in for a BatchScheduler with nothing queued or running"""
+
+    def __init__(self):
+        self.model_lock = threading.Lock()
+        self.batch_size = self.queue_size = 0
+        self.stopped = False
+
+    def has_requests_for(self, adapter_name):
+        return False
+
+    def stop(self):
+        self.stopped = True
+
+
+def _put(cache, key, entry):
+    # Run in a thread so a deadlock fails the test instead of hanging it
+    worker = threading.Thread(target=cache.put, args=(key, entry), daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+    assert not worker.is_alive(), f"put({key!r}) deadlocked"
+
+
+def test_chat_server_callbacks_evict_full_models_and_adapters(monkeypatch):
+    pytest.importorskip("fastapi")
+    import serve
+
+    cache = ModelCache(100, on_evict=serve._release_model, can_evict=serve._is_idle)
+    monkeypatch.setattr(serve, "model_cache", cache)
+    full = {"size_bytes": 80, "scheduler": _Scheduler()}
+    _put(cache, "a", full)
+    _put(cache, "b", {"size_bytes": 80, "scheduler": _Scheduler()})
+    assert "a" not in cache and full["scheduler"].stopped
+
+    # A base model stays while an adapter is loaded on it
+    base = {"size_bytes": 30, "scheduler": _Scheduler(), "model": SimpleNamespace(peft_config={"project_lora": None}),
+            "adapters": {"lora"}}
+    _put(cache, "base:toy", base)
+    _put(cache, "lora", {"size_bytes": 10, "scheduler": base["scheduler"], "base": base, "adapter_name": "project_lora"})
+    _put(cache, "c", {"size_bytes": 70, "scheduler": _Scheduler()})
+    assert "base:toy" in cache and "lora" not in cache
+    assert base["adapters"] == set()
+
+    _put(cache, "d", {"size_bytes": 50, "scheduler": _Scheduler()})
+    assert "base:toy" not in cache and base["scheduler"].stopped
+
+
+def test_retrained_checkpoint_replaces_cached_model(tiny_model_dir, tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import serve
+
+    checkpoint = tmp_path / "demo" / "checkpoint"
+    shutil.copytree(tiny_model_dir, checkpoint)
+    (tmp_path / "demo" / "config.json").write_text(json.dumps({"model_size": "toy", "training_mode": "full"}))
+    monkeypatch.setattr(serve.model_manager, "workspace_dir", tmp_path)
+    monkeypatch.setattr(serve, "RETIRE_POLL_SECONDS", 0.01)
+    request = {"message": "Once upon a time", "project_slug": "demo", "temperature": 0, "max_tokens": 2}
+
+    with TestClient(serve.app) as client:
+        client.post("/chat", json=request)
+        old = serve.model_cache.peek("demo")
+        client.post("/chat", json=request)
+        assert serve.model_cache.peek("demo") is old
+
+        # Retraining rewrites the weights
+        for weights in checkpoint.glob("*.safetensors"):
+            os.utime(weights, (time.time() + 10, time.time() + 10))
+        response = client.post("/chat", json=request).json()
+        new = serve.model_cache.peek("demo")
+        deadline = time.time() + 5
+        while serve._retiring and time.time() < deadline:
+            time.sleep(0.01)
+        serve.model_cache.pop("demo")
+        serve._release_model("demo", new)
+
+    assert new is not old and new["checkpoint_version"] > old["checkpoint_version"]
+    assert not response["cached"]
+    assert old["scheduler"]._stop_event.is_set()
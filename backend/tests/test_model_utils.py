@@ -0,0 +1,182 @@
+"""
+Tests for trainer construction and progress reporting
+"""
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("psutil")
+pytest.importorskip("GPUtil")
+
+from conftest import SAMPLE_TEXT
+from data_utils import DataProcessor
+from model_utils import ModelManager
+from trainer_utils import TrainingCallback
+
+
+def test_training_runs_each_epoch_once_and_reports_progress(tmp_path, tiny_model_dir):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    manager = ModelManager(str(tmp_path))
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    dataset = DataProcessor(str(tmp_path)).prepare_training_data(
+        [SAMPLE_TEXT] * 8, str(tiny_model_dir), max_length=32
+    )
+    trainer = manager.create_trainer(model, tokenizer, dataset, "demo", epochs=2)
+    trainer.args.gradient_accumulation_steps = 1
+    trainer.args.warmup_steps = 0
+
+    progress = {}
+    updates = []
+    trainer.add_callback(TrainingCallback(progress, tokens_per_sample=32, on_update=updates.append))
+    trainer.train()
+
+    steps_per_epoch = -(-len(dataset) // trainer.args.per_device_train_batch_size)
+    assert progress["total_steps"] == 2 * steps_per_epoch
+    assert progress["current_step"] == progress["total_steps"]
+    assert progress["current_epoch"] == pytest.approx(2.0)
+    assert progress["tokens_per_second"] > 0
+    assert progress["recent_logs"] and "loss" in progress
+    assert updates
+
+
+def test_batch_layout_keeps_the_effective_batch_size(tmp_path):
+    manager = ModelManager(str(tmp_path))
+    for world_size in (1, 2, 4, 8, 16):
+        batch_size, accumulation_steps = manager.batch_layout(world_size)
+        assert batch_size * accumulation_steps * world_size == manager.EFFECTIVE_BATCH_SIZE
+    assert manager.batch_layout(1) == (2, 8)
+    # Three processes cannot split 16 samples evenly; the closest layout is used
+    assert manager.batch_layout(3) == (1, 5)
+    # A micro-batch limit is rounded down to a size that divides each process's share
+    assert manager.batch_layout(1, 16) == (16, 1)
+    assert manager.batch_layout(1, 5) == (4, 4)
+    assert manager.batch_layout(2, 64) == (8, 1)
+
+
+def test_batch_size_is_tuned_to_the_memory_budget_and_reused(tmp_path, tiny_model_dir, monkeypatch):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    manager = ModelManager(str(tmp_path))
+    job = {"project_slug": "demo", "model_size": "toy", "training_mode": "full"}
+    manager.save_model_config("demo", {"model_size": "toy", "training_mode": "full"})
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    per_sample = manager.measure_activation_memory(model, 32) * manager.ACTIVATION_OVERHEAD
+    assert manager.measure_activation_memory(model, 64) > 1.5 * manager.measure_activation_memory(model, 32)
+
+    # Room for five samples besides the gradients and optimizer state: 4 divides 16, 5 does not
+    fixed = sum(p.numel() * 12 for p in model.parameters())
+    monkeypatch.setattr(manager, "memory_budget", lambda world_size=1: int(fixed + 5.5 * per_sample))
+    tuning = manager.tune_batch_size(model, job, seq_length=32)
+    assert (tuning["micro_batch_size"], tuning["gradient_accumulation_steps"]) == (4, 4)
+    assert manager.load_model_config("demo")["batch_tuning"] == tuning
+
+    # Later runs reuse the recorded values without probing again
+    monkeypatch.setattr(manager, "measure_activation_memory", lambda *args: pytest.fail("probed again"))
+    assert manager.tune_batch_size(model, job, seq_length=32) == tuning
+    # A queued job for another profile does not pick up this job's result, whatever config.json says
+    with pytest.raises(pytest.fail.Exception, match="probed again"):
+        manager.tune_batch_size(model, {**job, "memory_profile": "lean"}, seq_length=32)
+
+    trainer = manager.create_trainer(model, AutoTokenizer.from_pretrained(tiny_model_dir), [], "demo", micro_batch_size=tuning["micro_batch_size"])
+    assert trainer.args.per_device_train_batch_size == 4
+    assert trainer.args.gradient_accumulation_steps == 4
+
+
+
+def test_lean_memory_profile(tmp_path, tiny_model_dir):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    manager = ModelManager(str(tmp_path))
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    standard = manager.measure_activation_memory(model, 64)
+    manager.apply_memory_profile(model, "lean")
+
+    frozen = {name for name, p in model.named_parameters() if not p.requires_grad}
+    assert frozen == {"transformer.wte.weight", "transformer.wpe.weight"}
+    assert model.lm_head.weight is model.transformer.wte.weight
+    assert model.is_gradient_checkpointing
+    assert manager.measure_activation_memory(model, 64) < standard
+
+    trainer = manager.create_trainer(model, AutoTokenizer.from_pretrained(tiny_model_dir), [], "demo",
+                                     memory_profile="lean")
+    assert trainer.args.optim == "adafactor"
+    assert manager.training_optimizer("standard") is None
+
+    # Backpropagates through the checkpointed blocks even though their inputs need no gradient
+    input_ids = torch.randint(0, model.config.vocab_size, (2, 16))
+    model.train()
+    model(input_ids=input_ids, labels=input_ids).loss.backward()
+    assert all(p.grad is not None for p in model.parameters() if p.requires_grad)
+    assert model.transformer.wte.weight.grad is None
+
+
+RANK_SCRIPT = """
+import json, os, sys
+sys.path.insert(0, {backend!r})
+import torch
+import torch.distributed as dist
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from data_utils import DataProcessor
+from model_utils import ModelManager
+from trainer_utils import TrainingCallback
+
+dist.init_process_group("gloo")
+torch.manual_seed(0)
+model = AutoModelForCausalLM.from_pretrained({model_dir!r})
+tokenizer = AutoTokenizer.from_pretrained({model_dir!r})
+tokenizer.pad_token = tokenizer.eos_token
+dataset = DataProcessor({workspace!r}).prepare_training_data([{text!r}] * 16, {model_dir!r}, max_length=32)
+trainer = ModelManager({workspace!r}).create_trainer(model, tokenizer, dataset, "demo", world_size=2)
+trainer.args.warmup_steps = 0
+progress = {{}}
+trainer.add_callback(TrainingCallback(progress, tokens_per_sample=32))
+trainer.train()
+progress["weight_sum"] = sum(p.double().sum().item() for p in model.parameters())
+progress["batches"] = len(trainer.get_train_dataloader())
+progress["samples"] = len(dataset)
+with open(os.path.join({workspace!r}, "rank%s.json" % os.environ["RANK"]), "w") as f:
+    json.dump(progress, f)
+dist.destroy_process_group()
+"""
+
+
+def test_data_parallel_ranks_share_batches_and_stay_in_sync(tmp_path, tiny_model_dir):
+    import json
+    import os
+    import socket
+    import subprocess
+    import sys
+
+    # The token cache is built before the ranks start, as rank 0 does in the training worker
+    DataProcessor(str(tmp_path)).prepare_training_data([SAMPLE_TEXT] * 16, str(tiny_model_dir), max_length=32)
+    script = tmp_path / "rank.py"
+    script.write_text(RANK_SCRIPT.format(
+        backend=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        model_dir=str(tiny_model_dir), workspace=str(tmp_path), text=SAMPLE_TEXT
+    ))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    ranks = []
+    for rank in range(2):
+        env = dict(os.environ, RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE="2",
+                   MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), OMP_NUM_THREADS="1")
+        ranks.append(subprocess.Popen([sys.executable, str(script)], env=env))
+    assert [rank.wait(timeout=300) for rank in ranks] == [0, 0]
+
+    results = [json.loads((tmp_path / f"rank{rank}.json").read_text()) for rank in range(2)]
+    # Each rank takes every other batch of 2 and accumulates 4 of them per optimizer step
+    samples = results[0]["samples"]
+    assert results[0]["batches"] == -(-samples // 4)
+    assert results[0]["total_steps"] == -(-results[0]["batches"] // 4)
+    assert results[0]["weight_sum"] == pytest.approx(results[1]["weight_sum"])
+    assert [rank["rank"] for rank in results[0]["ranks"]] == [0, 1]
+    assert results[0]["samples_per_second"] == pytest.approx(
+        sum(rank["samples_per_second"] for rank in results[0]["ranks"])
+    )
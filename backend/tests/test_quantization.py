@@ -0,0 +1,69 @@
+"""
+Tests for int8 dynamic quantization and its on-disk cache
+"""
+import os
+import shutil
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from model_cache import model_size_bytes
+from quantization import QUANTIZED_DIR, conv1d_to_linear, load_or_quantize, load_quantized
+
+
+def test_conv1d_to_linear_keeps_outputs(tiny_model_dir):
+    from transformers import AutoModelForCausalLM
+
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir).eval()
+    input_ids = torch.tensor([[5, 6, 7, 8]])
+    with torch.no_grad():
+        expected = model(input_ids).logits
+        converted = conv1d_to_linear(model)(input_ids).logits
+    assert torch.allclose(expected, converted, atol=1e-5)
+
+
+def test_quantized_model_is_cached_and_invalidated(tmp_path, tiny_model_dir):
+    checkpoint = tmp_path / "checkpoint"
+    shutil.copytree(tiny_model_dir, checkpoint)
+
+    quantized = load_or_quantize(checkpoint)
+    assert (checkpoint / QUANTIZED_DIR / "int8.pt").exists()
+    with torch.no_grad():
+        logits = quantized(torch.tensor([[5, 6, 7]])).logits
+    assert torch.isfinite(logits).all()
+
+    cached = load_quantized(checkpoint)
+    assert cached is not None
+    assert model_size_bytes(cached) == model_size_bytes(quantized)
+
+    # Re-saving the checkpoint (e.g. after more training) makes the cache stale
+    weights = next(checkpoint.glob("*.safetensors"))
+    os.utime(weights, (weights.stat().st_atime, weights.stat().st_mtime + 10))
+    assert load_quantized(checkpoint) is None
+
+
+def test_unreadable_or_unwritable_cache_falls_back_to_quantizing(tmp_path, tiny_model_dir, monkeypatch):
+    import json
+
+    import quantization
+
+    checkpoint = tmp_path / "checkpoint"
+    shutil.copytree(tiny_model_dir, checkpoint)
+    load_or_quantize(checkpoint)
+    meta = json.loads((checkpoint / QUANTIZED_DIR / "int8.json").read_text())
+    assert meta["transformers"] and meta["bytes"] == (checkpoint / QUANTIZED_DIR / "int8.pt").stat().st_size
+
+    # A truncated weights file no longer matches its meta
+    (checkpoint / QUANTIZED_DIR / "int8.pt").write_bytes(b"garbage")
+    assert load_quantized(checkpoint) is None
+
+    # Errors reading or writing the cache cost a re-quantization, never the load
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(quantization, "load_quantized", fail)
+    monkeypatch.setattr(quantization, "save_quantized", fail)
+    model = load_or_quantize(checkpoint)
+    with torch.no_grad():
+        assert torch.isfinite(model(torch.tensor([[5, 6, 7]])).logits).all()
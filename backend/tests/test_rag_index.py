@@ -0,0 +1,140 @@
+"""
+Tests for the retrieval index and retrieval-augmented /chat
+"""
+import json
+import shutil
+import threading
+import time
+
+import pytest
+
+from corpus_store import CorpusStore
+from rag_index import RagIndex, _file_lock, open_index, split_passages
+
+DOCUMENTS = [
+    "The lighthouse keeper polished the great lamp every evening before the ships came in.",
+    "Tick the rabbit hopped through the village looking for carrots and clover.",
+    "Sourdough bread needs a lively starter, flour, water, salt and a long slow rise.",
+]
+
+
+def test_passages_split_at_word_breaks():
+    text = "word " * 100
+    spans = split_passages(text, 64)
+    assert all(end - start <= 64 for start, end in spans)
+    assert "".join(text[start:end] for start, end in spans) == text
+    assert all(text[end - 1] == " " for _, end in spans)
+
+
+def test_index_embeds_only_new_documents(tmp_path):
+    corpus = CorpusStore(tmp_path)
+    corpus.append(DOCUMENTS[:2])
+    meta = RagIndex(corpus).sync()
+    assert (meta["num_docs"], meta["num_passages"]) == (2, 2)
+
+    corpus.append(DOCUMENTS[2:])
+    index = RagIndex(CorpusStore(tmp_path))
+    index.embedder.embed = embed = _counting(index.embedder.embed)
+    meta = index.sync()
+    assert (meta["num_docs"], meta["num_passages"]) == (3, 3)
+    assert embed.texts == 1
+    assert index.search("how do I bake bread with a starter", k=1)[0]["document"] == 2
+
+    # Replacing the corpus rebuilds the index from scratch
+    corpus = CorpusStore(tmp_path)
+    corpus.clear()
+    corpus.append(["A single new document about rockets."])
+    meta = RagIndex(corpus).sync()
+    assert (meta["num_docs"], meta["num_passages"]) == (1, 1)
+
+
+def test_sync_waits_for_the_shared_index_lock(tmp_path):
+    corpus = CorpusStore(tmp_path)
+    corpus.append(DOCUMENTS)
+    index = RagIndex(corpus)
+    index.lock_path.parent.mkdir(parents=True)
+
+    # Another process (here, another open of the lock file) is writing the index
+    with _file_lock(index.lock_path):
+        worker = threading.Thread(target=index.sync)
+        worker.start()
+        worker.join(timeout=0.3)
+        assert worker.is_alive() and not index.meta_path.exists()
+    worker.join(timeout=10)
+    assert len(index) == 3
+
+
+def test_search_ranks_matching_passage_first(tmp_path):
+    corpus = CorpusStore(tmp_path)
+    corpus.append(DOCUMENTS * 200)
+    index = open_index(tmp_path)
+    assert len(index) == 600
+
+    start = time.perf_counter()
+    results = index.search("Where did the rabbit hop?", k=3)
+    elapsed = time.perf_counter() - start
+
+    assert [r["document"] % 3 for r in results] == [1, 1, 1]
+    assert results[0]["text"] == DOCUMENTS[1]
+    assert results[0]["score"] > 0
+    assert elapsed < 0.5
+
+
+def test_chat_prepends_retrieved_passages(tiny_model_dir, tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import serve
+
+    shutil.copytree(tiny_model_dir, tmp_path / "demo" / "checkpoint")
+    (tmp_path / "demo" / "config.json").write_text(json.dumps({"model_size": "toy", "training_mode": "full"}))
+    CorpusStore(tmp_path / "demo").append(DOCUMENTS)
+    monkeypatch.setattr(serve.model_manager, "workspace_dir", tmp_path)
+
+    with TestClient(serve.app) as client:
+        request = {"message": "Tell me about the lighthouse", "project_slug": "demo",
+                   "temperature": 0, "max_tokens": 3, "cache": False}
+        plain = client.post("/chat", json=request).json()
+        augmented = client.post("/chat", json={**request, "rag_top_k": 1}).json()
+        model_data = serve.model_cache.pop("demo")
+        serve._release_model("demo", model_data)
+        serve.rag_indexes.clear()
+
+    assert "retrieved" not in plain
+    assert augmented["retrieved"][0]["text"] == DOCUMENTS[0]
+    assert augmented["input_tokens"] > plain["input_tokens"]
+    assert "retrieval" in augmented["timings_ms"]
+
+
+def test_chat_indexes_documents_uploaded_without_indexing(tiny_model_dir, tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import serve
+
+    shutil.copytree(tiny_model_dir, tmp_path / "demo" / "checkpoint")
+    (tmp_path / "demo" / "config.json").write_text(json.dumps({"model_size": "toy", "training_mode": "full"}))
+    CorpusStore(tmp_path / "demo").append(DOCUMENTS[:2])
+    monkeypatch.setattr(serve.model_manager, "workspace_dir", tmp_path)
+
+    with TestClient(serve.app) as client:
+        request = {"message": "How do I bake sourdough bread?", "project_slug": "demo",
+                   "temperature": 0, "max_tokens": 1, "cache": False, "rag_top_k": 1}
+        before = client.post("/chat", json=request).json()
+        # An upload with LLM_RAG_INDEX_ON_UPLOAD=0 appends to the corpus without touching the index
+        CorpusStore(tmp_path / "demo").append(DOCUMENTS[2:])
+        after = client.post("/chat", json=request).json()
+        model_data = serve.model_cache.pop("demo")
+        serve._release_model("demo", model_data)
+        serve.rag_indexes.clear()
+
+    assert before["retrieved"][0]["document"] != 2
+    assert after["retrieved"][0]["document"] == 2
+
+
+def _counting(embed):
+    def wrapper(texts):
+        wrapper.texts += len(texts)
+        return embed(texts)
+    wrapper.texts = 0
+    return wrapper
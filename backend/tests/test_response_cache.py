@@ -0,0 +1,35 @@
+"""
+Tests for the /chat response cache
+"""
+import time
+
+from response_cache import ResponseCache, response_cache_key
+
+
+def test_key_covers_every_generation_parameter():
+    key = response_cache_key(project_slug="p", checkpoint_version=1.0, message="hi", temperature=0, seed=None)
+    assert key == response_cache_key(seed=None, temperature=0, message="hi", checkpoint_version=1.0, project_slug="p")
+    # Retraining bumps the checkpoint version, so old responses are no longer found
+    assert key != response_cache_key(project_slug="p", checkpoint_version=2.0, message="hi", temperature=0, seed=None)
+    assert key != response_cache_key(project_slug="p", checkpoint_version=1.0, message="hi", temperature=0, seed=1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", {"response": "a"})
+    cache.put("b", {"response": "b"})
+    cache.get("a")
+    cache.put("c", {"response": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"response": "a"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl_seconds=0.05)
+    cache.put("a", {"response": "a"})
+    assert cache.get("a") is not None
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
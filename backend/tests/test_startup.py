@@ -0,0 +1,38 @@
+"""
+Tests for fast server startup: lazy heavy imports and readiness after warm-up
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_chat_server_imports_without_the_inference_stack():
+    code = (
+        "import sys, serve; "
+        "heavy = [m for m in ('torch', 'transformers', 'peft', 'pandas', 'pdfplumber') if m in sys.modules]; "
+        "assert not heavy, heavy"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True)
+
+
+def test_ready_follows_liveness():
+    pytest.importorskip("torch")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import serve
+
+    with TestClient(serve.app) as client:
+        assert client.get("/health").status_code == 200
+        deadline = time.time() + 60
+        while client.get("/ready").status_code != 200:
+            assert time.time() < deadline
+            time.sleep(0.05)
+        state = client.get("/ready").json()
+        assert state["ready"] and state["imports_loaded"]
+        assert client.get("/health").json()["ready"]
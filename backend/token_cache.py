@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset as TorchDataset
+from transformers import AutoTokenizer
+
+from corpus_store import CorpusStore
+
+
+class TokenShardCache:
+    """Token ids for a project's corpus, persisted as memory-mapped shards.
+
+    Each document is stored untruncated and followed by an EOS token, so the
+    same shards serve any max_length. Shards live under
+    `token_cache/<tokenizer key>/` and are validated against the fingerprint
+    of the documents they were built from: an unchanged corpus is never
+    re-tokenized, an appended corpus only tokenizes the new documents, and a
+    replaced corpus is rebuilt from scratch.
+    """
+
+    TOKENIZE_BATCH = 1000
+
+    def __init__(self, corpus: CorpusStore, tokenizer_name: str):
+        self.corpus = corpus
+        self.tokenizer_name = tokenizer_name
+        key = hashlib.sha256(tokenizer_name.encode("utf-8")).hexdigest()[:16]
+        self.cache_dir = corpus.project_dir / "token_cache" / key
+        self.meta_path = self.cache_dir / "meta.json"
+        self._tokenizer = None
+
+    @property
+    def tokenizer(self):
+        # Only loaded when there is something left to tokenize
+        if self._tokenizer is None:
+            self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        return self._tokenizer
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.meta_path.exists():
+            return None
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def _save_meta(self, meta: Dict[str, Any]):
+        tmp_path = self.meta_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _new_meta(self) -> Dict[str, Any]:
+        tokenizer = self.tokenizer
+        return {
+            "tokenizer": self.tokenizer_name,
+            "dtype": "uint16" if len(tokenizer) <= np.iinfo(np.uint16).max else "uint32",
+            "eos_token_id": tokenizer.eos_token_id,
+            "pad_token_id": tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+            "num_docs": 0,
+            "num_tokens": 0,
+            "corpus_fingerprint": self.corpus.fingerprint(0),
+            "shards": []
+        }
+
+    def sync(self) -> Dict[str, Any]:
+        """Bring the shards up to date with the corpus and return the cache metadata"""
+        meta = self._load_meta()
+        if meta is not None and meta.get("corpus_fingerprint") != self.corpus.fingerprint(meta["num_docs"]):
+            print(f"Corpus changed, rebuilding token cache in {self.cache_dir}")
+            meta = None
+
+        if meta is None:
+            for path in self.cache_dir.glob("shard_*"):
+                path.unlink()
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            meta = self._new_meta()
+
+        if len(self.corpus) > meta["num_docs"]:
+            self._tokenize_new_documents(meta)
+            meta["corpus_fingerprint"] = self.corpus.fingerprint(meta["num_docs"])
+            self._save_meta(meta)
+        return meta
+
+    def _tokenize_new_documents(self, meta: Dict[str, Any]):
+        """Tokenize documents appended since the last sync into a new shard"""
+        shard_name = f"shard_{len(meta['shards']):05d}"
+        dtype = np.dtype(meta["dtype"])
+        eos = meta["eos_token_id"]
+        first_doc = meta["num_docs"]
+        total_tokens = 0
+        offsets = []
+
+        with open(self.cache_dir / f"{shard_name}.bin", "wb") as tokens_file:
+            for start in range(first_doc, len(self.corpus), self.TOKENIZE_BATCH):
+                end = min(start + self.TOKENIZE_BATCH, len(self.corpus))
+                batch = [self.corpus[i] for i in range(start, end)]
+                encoded = self.tokenizer(batch, add_special_tokens=False, verbose=False)["input_ids"]
+                for ids in encoded:
+                    ids = np.asarray(ids + [eos], dtype=dtype)
+                    tokens_file.write(ids.tobytes())
+                    total_tokens += len(ids)
+                    offsets.append(total_tokens)
+        np.asarray(offsets, dtype="<u8").tofile(self.cache_dir / f"{shard_name}.idx")
+
+        meta["shards"].append({"name": shard_name, "docs": len(offsets), "tokens": total_tokens})
+        meta["num_docs"] += len(offsets)
+        meta["num_tokens"] += total_tokens
+        print(f"Tokenized {len(offsets)} new documents ({total_tokens} tokens) into {shard_name}")
+
+    def open_shards(self, meta: Dict[str, Any]) -> "TokenShards":
+        return TokenShards(self.cache_dir, meta)
+
+
+class TokenShards:
+    """Read-only, memory-mapped view over the documents in a token cache"""
+
+    def __init__(self, cache_dir: Path, meta: Dict[str, Any]):
+        self.eos_token_id = meta["eos_token_id"]
+        self.pad_token_id = meta["pad_token_id"]
+        self._tokens = []
+        self._offsets = []
+        doc_counts = []
+        for shard in meta["shards"]:
+            if not shard["tokens"]:
+                continue
+            self._tokens.append(np.memmap(cache_dir / f"{shard['name']}.bin", dtype=meta["dtype"], mode="r"))
+            self._offsets.append(np.fromfile(cache_dir / f"{shard['name']}.idx", dtype="<u8").astype(np.int64))
+            doc_counts.append(shard["docs"])
+        self._doc_starts = np.concatenate([[0], np.cumsum(doc_counts, dtype=np.int64)])
+        self._token_starts = np.concatenate(
+            [[0], np.cumsum([len(tokens) for tokens in self._tokens], dtype=np.int64)]
+        )
+
+    def __len__(self) -> int:
+        return int(self._doc_starts[-1])
+
+    def document(self, index: int) -> np.ndarray:
+        """Token ids of one document, including its trailing EOS"""
+        shard = int(np.searchsorted(self._doc_starts, index, side="right")) - 1
+        local = index - int(self._doc_starts[shard])
+        offsets = self._offsets[shard]
+        start = int(offsets[local - 1]) if local > 0 else 0
+        return self._tokens[shard][start:int(offsets[local])]
+
+    def lengths(self) -> np.ndarray:
+        """Token count of every document"""
+        if not self._offsets:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.diff(offsets, prepend=0) for offsets in self._offsets])
+
+    def token_range(self, start: int, end: int) -> np.ndarray:
+        """Tokens [start, end) of the whole corpus viewed as one EOS-separated stream"""
+        pieces = []
+        shard = int(np.searchsorted(self._token_starts, start, side="right")) - 1
+        while start < end:
+            local = start - int(self._token_starts[shard])
+            take = min(end - start, len(self._tokens[shard]) - local)
+            pieces.append(self._tokens[shard][local:local + take])
+            start += take
+            shard += 1
+        return np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self._token_starts[-1])
+
+
+class PaddedDataset(TorchDataset):
+    """One sample per document, truncated and padded to max_length (the original behaviour)"""
+
+    mode = "pad"
+
+    def __init__(self, shards: TokenShards, max_length: int):
+        self.shards = shards
+        self.max_length = max_length
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        ids = torch.from_numpy(self.shards.document(index)[:self.max_length].astype(np.int64))
+        input_ids = torch.full((self.max_length,), self.shards.pad_token_id, dtype=torch.long)
+        input_ids[:len(ids)] = ids
+        attention_mask = torch.zeros(self.max_length, dtype=torch.long)
+        attention_mask[:len(ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def stats(self, batch_size: int = 1) -> Dict[str, Any]:
+        lengths = self.shards.lengths()
+        kept = int(np.minimum(lengths, self.max_length).sum())
+        return _stats(self.mode, len(self), kept, len(self) * self.max_length, int(lengths.sum()) - kept)
+
+
+class PackedDataset(TorchDataset):
+    """Every document concatenated with EOS separators and sliced into full max_length blocks.
+
+    No padding is needed except in the final block, and no tokens are dropped.
+    """
+
+    mode = "pack"
+
+    def __init__(self, shards: TokenShards, max_length: int):
+        self.shards = shards
+        self.max_length = max_length
+        self.num_tokens = shards.num_tokens
+
+    def __len__(self) -> int:
+        return -(-self.num_tokens // self.max_length)
+
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        start = index * self.max_length
+        end = min(start + self.max_length, self.num_tokens)
+        input_ids = torch.from_numpy(self.shards.token_range(start, end).astype(np.int64))
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    def stats(self, batch_size: int = 1) -> Dict[str, Any]:
+        return _stats(self.mode, len(self), self.num_tokens, len(self) * self.max_length, 0)
+
+
+class BucketedDataset(TorchDataset):
+    """Documents split into max_length windows and left unpadded.
+
+    The trainer groups windows of similar length into the same batch (see
+    `lengths`) and the collator pads each batch only to its longest sample.
+    """
+
+    mode = "bucket"
+
+    def __init__(self, shards: TokenShards, max_length: int):
+        self.shards = shards
+        self.max_length = max_length
+        doc_lengths = shards.lengths()
+        windows = -(-doc_lengths // max_length)
+        first_window = np.cumsum(windows) - windows
+        self.doc_ids = np.repeat(np.arange(len(doc_lengths)), windows)
+        self.starts = (np.arange(int(windows.sum())) - np.repeat(first_window, windows)) * max_length
+        self.lengths = np.minimum(np.repeat(doc_lengths, windows) - self.starts, max_length)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __getitem__(self, index: int) -> Dict[str, torch.Tensor]:
+        start = int(self.starts[index])
+        document = self.shards.document(int(self.doc_ids[index]))
+        input_ids = torch.from_numpy(document[start:start + self.max_length].astype(np.int64))
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    def stats(self, batch_size: int = 1) -> Dict[str, Any]:
+        # Estimate batch padding as if samples of similar length were batched together
+        lengths = np.sort(self.lengths)
+        slots = sum(int(lengths[i:i + batch_size].max()) * len(lengths[i:i + batch_size])
+                    for i in range(0, len(lengths), batch_size))
+        return _stats(self.mode, len(self), int(lengths.sum()), slots, 0)
+
+
+PACKING_MODES = {
+    PaddedDataset.mode: PaddedDataset,
+    PackedDataset.mode: PackedDataset,
+    BucketedDataset.mode: BucketedDataset,
+}
+
+
+def _stats(mode: str, samples: int, real_tokens: int, token_slots: int, dropped_tokens: int) -> Dict[str, Any]:
+    return {
+        "mode": mode,
+        "samples": samples,
+        "real_tokens": real_tokens,
+        "padded_tokens": token_slots - real_tokens,
+        "dropped_tokens": dropped_tokens,
+        "padding_efficiency": round(real_tokens / token_slots, 4) if token_slots else 1.0
+    }
+
+
+class CausalLMCollator:
+    """Pad a batch to its longest sample and mask padding out of the labels"""
+
+    def __init__(self, pad_token_id: int):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, features) -> Dict[str, torch.Tensor]:
+        max_len = max(len(f["input_ids"]) for f in features)
+        input_ids = torch.full((len(features), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), max_len), dtype=torch.long)
+        for i, feature in enumerate(features):
+            length = len(feature["input_ids"])
+            input_ids[i, :length] = torch.as_tensor(feature["input_ids"])
+            attention_mask[i, :length] = torch.as_tensor(feature["attention_mask"])
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
@@ -1,17 +1,39 @@
 import asyncio
+import itertools
 import json
+import multiprocessing
+import os
+import tempfile
 import time
-from pathlib import Path
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Literal, Optional, Set, Tuple
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 
+import training_worker
 from data_utils import DataProcessor
-from model_utils import ModelManager, TrainingCallback
+from job_queue import JobQueue, QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsRegistry, add_system_metrics, sample_periodically
+from model_utils import ModelManager
 
-app = FastAPI(title="LLM Training API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Jobs that were running when the API last stopped go back in the queue
+    requeued = job_queue.requeue_interrupted()
+    if requeued:
+        print(f"Re-queued {requeued} interrupted training job(s)")
+    dispatcher = asyncio.create_task(dispatch_jobs())
+    warmup = asyncio.create_task(warm_up())
+    sampler = asyncio.create_task(sample_periodically(model_manager.sample_system_info, RESOURCE_SAMPLE_SECONDS))
+    yield
+    sampler.cancel()
+    warmup.cancel()
+    dispatcher.cancel()
+
+app = FastAPI(title="LLM Training API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,9 +46,49 @@ app.add_middleware(
 # Global instances
 data_processor = DataProcessor()
 model_manager = ModelManager()
+job_queue = JobQueue(model_manager.workspace_dir / "jobs.db")
 training_status = {"is_training": False, "project": None, "progress": {}}
-current_trainer = None
-training_callback = None
+training_subscribers: Set[WebSocket] = set()
+cancel_deadlines: Dict[int, float] = {}
+
+# Readiness, as opposed to liveness: file parsers are imported and the device has been probed
+startup_state: Dict[str, Any] = {"ready": False}
+
+# How often the dispatcher checks the queue and the running job's progress
+JOB_POLL_SECONDS = 0.5
+# How long a running job may take to honour a cancel before its worker is killed
+CANCEL_GRACE_SECONDS = 30
+# CPU, memory and GPU usage are sampled this often in the background, never inside a request
+RESOURCE_SAMPLE_SECONDS = float(os.environ.get("LLM_RESOURCE_SAMPLE_SECONDS", "5"))
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+uploads = metrics.counter("llm_uploads_total", "Training data uploads received", ["project"])
+upload_errors = metrics.counter("llm_upload_errors_total", "Training data uploads that failed", ["project", "status"])
+uploaded_texts = metrics.counter("llm_uploaded_texts_total", "Documents added to project corpora", ["project"])
+uploaded_duplicates = metrics.counter(
+    "llm_upload_duplicates_total", "Uploaded documents dropped as duplicates", ["project", "kind"]
+)
+upload_estimated_tokens_saved = metrics.counter(
+    "llm_upload_estimated_tokens_saved_total", "Tokens kept out of project corpora by deduplication, estimated as characters / 4", ["project"]
+)
+training_jobs = metrics.gauge("llm_training_jobs", "Training jobs by status", ["status"])
+training_active = metrics.gauge("llm_training_active", "Whether a training job is running", ["project"])
+training_samples_per_second = metrics.gauge(
+    "llm_training_samples_per_second", "Training throughput of the current job", ["project"]
+)
+training_tokens_per_second = metrics.gauge(
+    "llm_training_tokens_per_second", "Real (non-padding) tokens trained on per second", ["project"]
+)
+training_step = metrics.gauge("llm_training_step", "Optimizer steps completed by the current job", ["project"])
+training_loss = metrics.gauge("llm_training_loss", "Most recently logged training loss", ["project"])
+training_rank_samples_per_second = metrics.gauge(
+    "llm_training_rank_samples_per_second", "Training throughput of each data-parallel worker", ["project", "rank"]
+)
+add_system_metrics(metrics, model_manager.get_system_info)
+
+# Training processes per job unless the request says otherwise (more than one only helps on the CPU)
+DEFAULT_TRAIN_WORKERS = int(os.environ.get("LLM_TRAIN_WORKERS", "1"))
 
 class TrainingConfig(BaseModel):
     project_slug: str
@@ -35,11 +97,43 @@ class TrainingConfig(BaseModel):
     learning_rate: float = 5e-5
     use_case: str = "general"
     temperature: float = 0.7
+    packing: Literal["pack", "bucket", "pad"] = "pack"
+    # "lora" trains a small adapter on top of the frozen base model instead of every weight
+    training_mode: Literal["full", "lora"] = "full"
+    lora_rank: int = 8
+    # Data-parallel training processes on the CPU; the effective batch size stays the same
+    num_workers: int = DEFAULT_TRAIN_WORKERS
+    # "lean" trades speed for memory: gradient checkpointing, frozen embeddings and a small optimizer state
+    memory_profile: Literal["standard", "lean"] = "standard"
 
 class ContinueTrainingConfig(BaseModel):
     project_slug: str
     additional_epochs: int = 1
 
+def _import_heavy_dependencies():
+    """Import upload parsers and probe the training device (runs in a worker thread)"""
+    import pandas  # noqa: F401
+    import pdfplumber  # noqa: F401
+    
+    model_manager.device
+
+async def warm_up():
+    """Load what the API needs lazily in the background once the server is listening"""
+    start_time = time.time()
+    await asyncio.to_thread(_import_heavy_dependencies)
+    startup_state["ready"] = True
+    print(f"Training API ready in {time.time() - start_time:.1f}s")
+
+@app.get("/health")
+async def health_check():
+    """Liveness: the API is up and answering"""
+    return {"status": "healthy", "ready": startup_state["ready"]}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once background warm-up has finished, 503 before"""
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=startup_state)
+
 @app.get("/system-info")
 async def get_system_info():
     """Get current system resource usage"""
@@ -50,96 +144,222 @@ async def get_projects():
     """Get list of existing projects"""
     return {"projects": data_processor.get_project_list()}
 
+# Uploads are copied to disk in pieces of this size rather than read into memory whole
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+SUPPORTED_FILE_TYPES = ['txt', 'jsonl', 'csv', 'pdf']
+
+# Progress of the upload being ingested for each project, for /upload-progress
+upload_progress: Dict[str, Dict[str, Any]] = {}
+
+# Keep each project's retrieval index (for /chat's rag_top_k) in step with its corpus
+RAG_INDEX_ON_UPLOAD = os.environ.get("LLM_RAG_INDEX_ON_UPLOAD", "1") == "1"
+# Drop exact and near-duplicate documents (and repeated PDF headers/footers) before they are stored
+DEDUP_ON_UPLOAD = os.environ.get("LLM_DEDUP", "1") == "1"
+
+def upload_file_type(file: UploadFile) -> str:
+    file_type = file.filename.split('.')[-1].lower()
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
+    return file_type
+
+async def save_upload(file: UploadFile, file_type: str) -> str:
+    """Stream an upload to a temporary file and return its path"""
+    with tempfile.NamedTemporaryFile(suffix=f".{file_type}", delete=False) as buffer:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            buffer.write(chunk)
+        return buffer.name
+
+def ingest_files(project_slug: str, files: List[Tuple[str, str]]) -> Tuple[List[Dict[str, int]], Dict[str, int]]:
+    """Parse uploaded files and append their documents to the project's corpus (runs in a worker thread)
+    
+    Duplicates of documents already in the corpus or earlier in the upload are
+    dropped, and the new documents are added to the project's retrieval index.
+    Returns the number of texts and characters added and duplicates dropped
+    for each file, and the deduplication totals.
+    """
+    # Uploads to the same project run one at a time; the stores they append to are not thread-safe
+    with data_processor.project_lock(project_slug):
+        counts = [{"texts_count": 0, "total_chars": 0, "duplicates_removed": 0} for _ in files]
+        progress = {
+            "stage": "extracting", "files": len(files), "texts_count": 0, "duplicates_removed": 0,
+            "pages_done": 0, "pages_total": 0, "started_at": time.time()
+        }
+        upload_progress[project_slug] = progress
+        dedup = data_processor.deduplicator(project_slug) if DEDUP_ON_UPLOAD else None
+        
+        def on_pages(done: int, total: int):
+            progress.update(pages_done=done, pages_total=total)
+        
+        def texts():
+            for index, text in data_processor.iter_uploads(files, on_progress=on_pages):
+                if dedup is not None:
+                    text = dedup.process(text, strip_edges=files[index][1] == "pdf")
+                    if text is None:
+                        counts[index]["duplicates_removed"] += 1
+                        progress["duplicates_removed"] += 1
+                        continue
+                counts[index]["texts_count"] += 1
+                counts[index]["total_chars"] += len(text)
+                progress["texts_count"] += 1
+                yield text
+        
+        try:
+            # Process the files lazily, one document at a time
+            documents = texts()
+            first_text = next(documents, None)
+            if first_text is None and not progress["duplicates_removed"]:
+                raise HTTPException(status_code=400, detail="No text content found in file")
+        
+            # Append to the project's corpus
+            if first_text is not None:
+                data_processor.save_corpus(project_slug, itertools.chain([first_text], documents))
+            if dedup is not None:
+                dedup.commit()
+        
+            if RAG_INDEX_ON_UPLOAD and first_text is not None:
+                progress["stage"] = "indexing"
+                data_processor.update_rag_index(project_slug)
+            return counts, dedup.stats if dedup is not None else {}
+        except Exception:
+            if dedup is not None:
+                dedup.discard()
+            raise
+        finally:
+            upload_progress.pop(project_slug, None)
+
+def _record_upload(project_slug: str, texts_count: int, dedup_stats: Dict[str, int]):
+    uploaded_texts.inc(texts_count, project=project_slug)
+    for kind in ("exact_duplicates", "near_duplicates"):
+        uploaded_duplicates.inc(dedup_stats.get(kind, 0), project=project_slug, kind=kind)
+    upload_estimated_tokens_saved.inc(dedup_stats.get("estimated_tokens_saved", 0), project=project_slug)
+
 @app.post("/upload-data")
 async def upload_data(project_slug: str, file: UploadFile = File(...)):
     """Upload and process training data"""
+    uploads.inc(project=project_slug)
+    temp_path = None
     try:
-        # Save uploaded file temporarily
-        temp_path = f"/tmp/{file.filename}"
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Determine file type
-        file_type = file.filename.split('.')[-1].lower()
-        if file_type not in ['txt', 'jsonl', 'csv', 'pdf']:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
+        file_type = upload_file_type(file)
+        temp_path = await save_upload(file, file_type)
         
-        # Process the file
-        texts = data_processor.process_upload(temp_path, file_type)
+        # Parsing (PDF pages in a process pool) happens off the event loop
+        counts, dedup_stats = await asyncio.to_thread(ingest_files, project_slug, [(temp_path, file_type)])
+        _record_upload(project_slug, counts[0]["texts_count"], dedup_stats)
         
-        if not texts:
-            raise HTTPException(status_code=400, detail="No text content found in file")
+        return {
+            "success": True,
+            **counts[0],
+            "dedup": dedup_stats,
+            "corpus_texts": len(data_processor.load_corpus(project_slug))
+        }
+    
+    except HTTPException as e:
+        upload_errors.inc(project=project_slug, status=str(e.status_code))
+        raise
+    except Exception as e:
+        upload_errors.inc(project=project_slug, status="500")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@app.post("/upload-data-batch")
+async def upload_data_batch(project_slug: str, files: List[UploadFile] = File(...)):
+    """Upload several training files at once; PDF pages from all of them are extracted in parallel"""
+    uploads.inc(project=project_slug)
+    temp_paths = []
+    try:
+        file_types = [upload_file_type(file) for file in files]
+        for file, file_type in zip(files, file_types):
+            temp_paths.append(await save_upload(file, file_type))
         
-        # Save corpus
-        data_processor.save_corpus(project_slug, texts)
+        counts, dedup_stats = await asyncio.to_thread(ingest_files, project_slug, list(zip(temp_paths, file_types)))
+        texts_count = sum(c["texts_count"] for c in counts)
+        _record_upload(project_slug, texts_count, dedup_stats)
         
         return {
             "success": True,
-            "texts_count": len(texts),
-            "total_chars": sum(len(text) for text in texts)
+            "files": [{"filename": file.filename, **c} for file, c in zip(files, counts)],
+            "texts_count": texts_count,
+            "total_chars": sum(c["total_chars"] for c in counts),
+            "dedup": dedup_stats,
+            "corpus_texts": len(data_processor.load_corpus(project_slug))
         }
     
+    except HTTPException as e:
+        upload_errors.inc(project=project_slug, status=str(e.status_code))
+        raise
     except Exception as e:
+        upload_errors.inc(project=project_slug, status="500")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+@app.get("/upload-progress/{project_slug}")
+async def get_upload_progress(project_slug: str):
+    """Progress of the upload currently being processed for a project"""
+    if project_slug not in upload_progress:
+        raise HTTPException(status_code=404, detail="No upload in progress")
+    return upload_progress[project_slug]
+
+def model_config_from(config: TrainingConfig) -> Dict[str, Any]:
+    return {
+        "model_size": config.model_size,
+        "epochs": config.epochs,
+        "learning_rate": config.learning_rate,
+        "use_case": config.use_case,
+        "temperature": config.temperature,
+        "packing": config.packing,
+        "training_mode": config.training_mode,
+        "lora_rank": config.lora_rank,
+        "num_workers": config.num_workers,
+        "memory_profile": config.memory_profile,
+        "created_at": time.time()
+    }
+
+def enqueue_training(config: TrainingConfig) -> Dict[str, Any]:
+    """Queue a training job once the project is known to have data"""
+    if not len(data_processor.load_corpus(config.project_slug)):
+        raise HTTPException(status_code=400, detail="No training data found")
+    if config.num_workers < 1:
+        raise HTTPException(status_code=400, detail="num_workers must be at least 1")
+    
+    job = job_queue.enqueue(config.project_slug, config.dict())
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "queue_position": job_queue.queue_position(job["id"]),
+        "message": "Training queued"
+    }
 
 @app.post("/start-training")
 async def start_training(config: TrainingConfig):
-    """Start model training"""
-    global training_status, current_trainer, training_callback
-    
-    if training_status["is_training"]:
-        raise HTTPException(status_code=400, detail="Training already in progress")
-    
+    """Queue model training"""
     try:
-        # Load corpus
-        texts = data_processor.load_corpus(config.project_slug)
-        if not texts:
-            raise HTTPException(status_code=400, detail="No training data found")
-        
-        # Initialize training status
-        training_status = {
-            "is_training": True,
-            "project": config.project_slug,
-            "progress": {
-                "current_epoch": 0,
-                "total_epochs": config.epochs,
-                "current_step": 0,
-                "total_steps": 0,
-                "loss": 0.0,
-                "eta_minutes": 0,
-                "start_time": time.time()
-            }
-        }
+        result = enqueue_training(config)
         
-        # Save model config
-        model_config = {
-            "model_size": config.model_size,
-            "epochs": config.epochs,
-            "learning_rate": config.learning_rate,
-            "use_case": config.use_case,
-            "temperature": config.temperature,
-            "created_at": time.time()
-        }
+        # Save model config; the batch size tuned by an earlier run is kept for reuse
+        model_config = model_config_from(config)
+        previous = model_manager.load_model_config(config.project_slug)
+        if "batch_tuning" in previous:
+            model_config["batch_tuning"] = previous["batch_tuning"]
         model_manager.save_model_config(config.project_slug, model_config)
         
-        # Start training in background
-        asyncio.create_task(run_training(config, texts))
-        
-        return {"success": True, "message": "Training started"}
+        return result
     
+    except HTTPException:
+        raise
     except Exception as e:
-        training_status["is_training"] = False
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/continue-training")
 async def continue_training(config: ContinueTrainingConfig):
-    """Continue training with additional data/epochs"""
-    global training_status
-    
-    if training_status["is_training"]:
-        raise HTTPException(status_code=400, detail="Training already in progress")
-    
+    """Queue more training with additional data/epochs"""
     try:
         # Load existing model config
         model_config = model_manager.load_model_config(config.project_slug)
@@ -153,36 +373,19 @@ async def continue_training(config: ContinueTrainingConfig):
             epochs=config.additional_epochs,
             learning_rate=model_config.get("learning_rate", 5e-5),
             use_case=model_config.get("use_case", "general"),
-            temperature=model_config.get("temperature", 0.7)
+            temperature=model_config.get("temperature", 0.7),
+            packing=model_config.get("packing", "pack"),
+            training_mode=model_config.get("training_mode", "full"),
+            lora_rank=model_config.get("lora_rank", 8),
+            num_workers=model_config.get("num_workers", DEFAULT_TRAIN_WORKERS),
+            memory_profile=model_config.get("memory_profile", "standard")
         )
         
-        # Load corpus
-        texts = data_processor.load_corpus(config.project_slug)
-        if not texts:
-            raise HTTPException(status_code=400, detail="No training data found")
-        
-        # Initialize training status
-        training_status = {
-            "is_training": True,
-            "project": config.project_slug,
-            "progress": {
-                "current_epoch": 0,
-                "total_epochs": config.additional_epochs,
-                "current_step": 0,
-                "total_steps": 0,
-                "loss": 0.0,
-                "eta_minutes": 0,
-                "start_time": time.time()
-            }
-        }
-        
-        # Start training in background
-        asyncio.create_task(run_training(training_config, texts))
-        
-        return {"success": True, "message": "Continue training started"}
+        return enqueue_training(training_config)
     
+    except HTTPException:
+        raise
     except Exception as e:
-        training_status["is_training"] = False
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/training-status")
@@ -190,67 +393,174 @@ async def get_training_status():
     """Get current training status and progress"""
     return training_status
 
-async def run_training(config: TrainingConfig, texts):
-    """Background training task"""
-    global training_status, current_trainer, training_callback
+@app.get("/jobs")
+async def list_jobs():
+    """List training jobs, most recent first"""
+    return {"jobs": job_queue.list()}
+
+def get_job_or_404(job_id: int) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    """Get a single training job"""
+    return get_job_or_404(job_id)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    """Cancel a queued, paused or running job"""
+    job = get_job_or_404(job_id)
+    if job["status"] in (QUEUED, PAUSED):
+        job_queue.set_status(job_id, CANCELLED)
+    elif job["status"] == RUNNING:
+        # The worker stops at the next step; it is killed if it does not respond in time
+        job_queue.request_control(job_id, "cancel")
+        cancel_deadlines[job_id] = time.time() + CANCEL_GRACE_SECONDS
+    else:
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    return get_job_or_404(job_id)
+
+@app.post("/jobs/{job_id}/pause")
+async def pause_job(job_id: int):
+    """Pause a running job after checkpointing its current step"""
+    job = get_job_or_404(job_id)
+    if job["status"] != RUNNING:
+        raise HTTPException(status_code=409, detail=f"Only running jobs can be paused (job is {job['status']})")
+    job_queue.request_control(job_id, "pause")
+    return get_job_or_404(job_id)
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: int):
+    """Put a paused job back in the queue; it continues from its checkpoint"""
+    job = get_job_or_404(job_id)
+    if job["status"] != PAUSED:
+        raise HTTPException(status_code=409, detail=f"Only paused jobs can be resumed (job is {job['status']})")
+    job_queue.set_status(job_id, QUEUED)
+    return get_job_or_404(job_id)
+
+def start_worker(job: Dict[str, Any]):
+    """Run a job in its own process so training never blocks the API"""
+    worker = multiprocessing.get_context("spawn").Process(
+        target=training_worker.run_job,
+        args=(job["id"], str(job_queue.db_path), str(model_manager.workspace_dir)),
+        daemon=True
+    )
+    worker.start()
+    print(f"Started training job {job['id']} for {job['project_slug']} (pid {worker.pid})")
+    return worker
+
+def status_from_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "is_training": job["status"] == RUNNING,
+        "project": job["project_slug"],
+        "job_id": job["id"],
+        "status": job["status"],
+        "error": job["error"],
+        "queued_jobs": job_queue.count(QUEUED),
+        "progress": job["progress"]
+    }
+
+async def dispatch_jobs():
+    """Run queued jobs one at a time in a worker process and mirror their progress"""
+    global training_status
+    worker = None
+    job_id = None
     
-    try:
-        # Load model and tokenizer
-        model, tokenizer = model_manager.load_model_and_tokenizer(
-            config.model_size, config.project_slug
-        )
-        
-        # Prepare training data
-        train_dataset = data_processor.prepare_training_data(
-            texts, model_manager.MODEL_CONFIGS[config.model_size]["model_name"]
-        )
-        
-        # Create trainer
-        trainer = model_manager.create_trainer(
-            model, tokenizer, train_dataset, config.project_slug,
-            config.epochs, config.learning_rate
-        )
-        
-        current_trainer = trainer
-        training_callback = TrainingCallback()
-        
-        # Calculate total steps
-        total_steps = len(train_dataset) // trainer.args.per_device_train_batch_size
-        total_steps = total_steps // trainer.args.gradient_accumulation_steps
-        total_steps *= config.epochs
-        
-        training_status["progress"]["total_steps"] = total_steps
-        
-        # Custom training loop with progress updates
-        model.train()
-        start_time = time.time()
-        
-        for epoch in range(config.epochs):
-            training_status["progress"]["current_epoch"] = epoch + 1
+    while True:
+        try:
+            if worker is None:
+                job = job_queue.claim_next()
+                if job is not None:
+                    job_id = job["id"]
+                    try:
+                        worker = start_worker(job)
+                    except Exception as e:
+                        # Claiming marked the job running; with no process behind it, nothing else would end it
+                        print(f"Could not start training job {job_id}: {e}")
+                        job_queue.set_status(job_id, FAILED, error=f"Could not start training worker: {e}")
             
-            # Run one epoch
-            trainer.train()
+            if worker is not None and not worker.is_alive():
+                worker.join()
+                cancel_deadlines.pop(job_id, None)
+                if job_queue.get(job_id)["status"] == RUNNING:
+                    # The worker died without recording an outcome (e.g. out of memory)
+                    job_queue.set_status(
+                        job_id, FAILED, error=f"Training worker exited with code {worker.exitcode}"
+                    )
+                worker = None
+            elif worker is not None and time.time() > cancel_deadlines.get(job_id, float("inf")):
+                print(f"Training job {job_id} did not stop in time; terminating worker")
+                worker.terminate()
+                worker.join()
+                worker = None
+                cancel_deadlines.pop(job_id)
+                job_queue.set_status(job_id, CANCELLED)
             
-            # Update progress
-            elapsed_time = time.time() - start_time
-            remaining_epochs = config.epochs - (epoch + 1)
-            if epoch > 0:
-                avg_time_per_epoch = elapsed_time / (epoch + 1)
-                eta_minutes = (avg_time_per_epoch * remaining_epochs) / 60
-                training_status["progress"]["eta_minutes"] = eta_minutes
-        
-        # Save final model
-        trainer.save_model()
-        tokenizer.save_pretrained(str(Path(trainer.args.output_dir)))
+            # Mirror the current (or most recently finished) job into /training-status
+            if job_id is not None:
+                status = status_from_job(job_queue.get(job_id))
+                if status != training_status:
+                    training_status = status
+                    await broadcast_training_status()
         
-        # Update status
-        training_status["is_training"] = False
-        training_status["progress"]["completed"] = True
+        except Exception as e:
+            print(f"Job dispatcher error: {e}")
         
-    except Exception as e:
-        print(f"Training error: {e}")
-        training_status["is_training"] = False
-        training_status["error"] = str(e)
+        await asyncio.sleep(JOB_POLL_SECONDS)
+
+async def broadcast_training_status():
+    """Push the current training status to every connected dashboard"""
+    for websocket in list(training_subscribers):
+        try:
+            await websocket.send_json(training_status)
+        except Exception:
+            training_subscribers.discard(websocket)
+
+@app.websocket("/training-stream")
+async def training_stream(websocket: WebSocket):
+    """Stream training status updates as they happen instead of polling /training-status"""
+    await websocket.accept()
+    training_subscribers.add(websocket)
+    try:
+        await websocket.send_json(training_status)
+        while True:
+            # Nothing is expected from the client; this just notices disconnects
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        training_subscribers.discard(websocket)
+
+@metrics.on_collect
+def _collect_training_state():
+    """Refresh job and throughput gauges at scrape time from the status the dispatcher mirrors"""
+    for status in (QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED):
+        training_jobs.set(job_queue.count(status), status=status)
+    
+    # Only the job the dispatcher is currently mirroring is reported
+    for gauge in (training_active, training_samples_per_second, training_tokens_per_second,
+                  training_step, training_loss, training_rank_samples_per_second):
+        gauge.clear()
+    project = training_status.get("project")
+    if project is None:
+        return
+    progress = training_status.get("progress") or {}
+    training_active.set(1 if training_status["is_training"] else 0, project=project)
+    training_samples_per_second.set(progress.get("samples_per_second", 0), project=project)
+    training_tokens_per_second.set(progress.get("tokens_per_second", 0), project=project)
+    training_step.set(progress.get("current_step", 0), project=project)
+    if "loss" in progress:
+        training_loss.set(progress["loss"], project=project)
+    for rank in progress.get("ranks", []):
+        training_rank_samples_per_second.set(rank["samples_per_second"], project=project, rank=str(rank["rank"]))
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: training jobs and throughput, uploads and resource usage"""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,135 @@
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import torch
+import torch.distributed as dist
+from transformers import Trainer, TrainerCallback
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+from job_queue import JobQueue
+
+
+class LengthBucketingTrainer(Trainer):
+    """Trainer that batches samples of similar length when the dataset exposes their lengths"""
+
+    def _get_train_sampler(self, *args, **kwargs):
+        lengths = getattr(self.train_dataset, "lengths", None)
+        if lengths is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return LengthGroupedSampler(
+            self.args.train_batch_size * self.args.gradient_accumulation_steps,
+            lengths=lengths.tolist()
+        )
+
+
+def _share_from_main_process(value):
+    """`value` as seen by rank 0, on every rank of a data-parallel run"""
+    if not (dist.is_available() and dist.is_initialized()):
+        return value
+    shared = [value]
+    dist.broadcast_object_list(shared, src=0)
+    return shared[0]
+
+
+class TrainingCallback(TrainerCallback):
+    """Trainer callback that mirrors step-level progress into a status dict
+
+    `progress` is updated in place after every optimizer step and log event,
+    and `on_update` (if given) is called with it so listeners can be notified.
+    In a data-parallel run every rank must add this callback: each step the
+    ranks' own throughput is gathered into `progress["ranks"]` and the
+    reported rates are their sum.
+    """
+    def __init__(self, progress: Dict[str, Any], tokens_per_sample: float = 0,
+                 on_update: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.progress = progress
+        self.tokens_per_sample = tokens_per_sample
+        self.on_update = on_update
+        self.logs = []
+        self.start_time = None
+        self.start_step = 0
+
+    def _notify(self):
+        if self.on_update:
+            self.on_update(self.progress)
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start_time = time.time()
+        # Resumed runs start part way through; rates only count this run's steps
+        self.start_step = state.global_step
+        self.progress["total_steps"] = state.max_steps
+        self.progress["total_epochs"] = args.num_train_epochs
+        self._notify()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        elapsed = time.time() - self.start_time
+        steps_done = state.global_step - self.start_step
+        samples_per_step = args.per_device_train_batch_size * args.gradient_accumulation_steps
+        samples_per_second = steps_done * samples_per_step / elapsed if elapsed > 0 else 0.0
+        seconds_per_step = elapsed / steps_done if steps_done else 0.0
+        
+        if args.world_size > 1:
+            rank_stats = {
+                "rank": args.process_index,
+                "threads": torch.get_num_threads(),
+                "samples_per_second": samples_per_second,
+                "tokens_per_second": samples_per_second * self.tokens_per_sample
+            }
+            ranks = [None] * args.world_size
+            dist.all_gather_object(ranks, rank_stats)
+            self.progress["ranks"] = ranks
+            samples_per_second = sum(rank["samples_per_second"] for rank in ranks)
+
+        self.progress.update({
+            "current_step": state.global_step,
+            "current_epoch": state.epoch or 0,
+            "progress_percent": state.global_step / max(state.max_steps, 1) * 100,
+            "samples_per_second": samples_per_second,
+            "tokens_per_second": samples_per_second * self.tokens_per_sample,
+            "eta_minutes": (state.max_steps - state.global_step) * seconds_per_step / 60
+        })
+        self._notify()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if not logs or "loss" not in logs:
+            return
+        self.logs.append({
+            "step": state.global_step,
+            "loss": logs["loss"],
+            "learning_rate": logs.get("learning_rate", 0)
+        })
+        self.progress.update({
+            "loss": logs["loss"],
+            "learning_rate": logs.get("learning_rate", 0),
+            "recent_logs": self.logs[-10:]
+        })
+        self._notify()
+
+    def get_progress(self) -> Dict[str, Any]:
+        return self.progress
+
+
+class JobControlCallback(TrainerCallback):
+    """Stops training when the job is cancelled or paused, and records checkpoints to resume from"""
+
+    def __init__(self, jobs: JobQueue, job_id: int):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.action = None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        action = self.jobs.control(self.job_id) if state.is_world_process_zero else None
+        # Every rank has to stop at the same step, or the others wait forever in the next all-reduce
+        self.action = _share_from_main_process(action)
+        if self.action in ("cancel", "pause"):
+            control.should_training_stop = True
+            # A paused job resumes from a checkpoint taken at this exact step
+            control.should_save = self.action == "pause"
+        return control
+
+    def on_save(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        checkpoint = Path(args.output_dir) / f"checkpoint-{state.global_step}"
+        self.jobs.set_resume_checkpoint(self.job_id, str(checkpoint))
@@ -0,0 +1,246 @@
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import List
+
+from data_utils import DataProcessor
+from job_queue import JobQueue, CANCELLED, DONE, FAILED, PAUSED
+from model_utils import ModelManager
+
+# Seconds the extra ranks of a data-parallel job get to exit once rank 0 is done
+PEER_EXIT_SECONDS = 60
+# Size micro-batches to the memory available instead of using ModelManager.PER_DEVICE_BATCH_SIZE
+TUNE_BATCH_SIZE = os.environ.get("LLM_TUNE_BATCH_SIZE", "1") == "1"
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def threads_per_worker(world_size: int) -> int:
+    """Intra-op threads for each of `world_size` training processes, so together they fill the cores once"""
+    return max(1, available_cpus() // world_size)
+
+
+def _set_rank_environment(rank: int, world_size: int, port: int, env=os.environ):
+    # Read by torch.distributed (env:// initialization) and by accelerate inside the Trainer
+    threads = str(threads_per_worker(world_size))
+    env.update(
+        RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+        MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port),
+        OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads
+    )
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _world_size(requested: int) -> int:
+    """Number of training processes to run; data parallelism is only used on the CPU"""
+    if requested <= 1:
+        return 1
+    world_size = min(requested, available_cpus())
+    # torch is imported after the thread count is fixed, so it only allocates that many threads
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker(world_size))
+    import torch
+
+    if torch.cuda.is_available() or torch.backends.mps.is_available():
+        print("Data-parallel training runs on the CPU only; training in a single process on the accelerator")
+        os.environ.pop("OMP_NUM_THREADS")
+        torch.set_num_threads(available_cpus())
+        return 1
+    return world_size
+
+
+def _launch_peers(job_id: int, db_path: str, workspace_dir: str, world_size: int, port: int) -> List[subprocess.Popen]:
+    """Start ranks 1..world_size-1 of a data-parallel job as separate processes"""
+    peers = []
+    for rank in range(1, world_size):
+        env = dict(os.environ)
+        _set_rank_environment(rank, world_size, port, env)
+        peers.append(subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), str(job_id), db_path, workspace_dir],
+            cwd=str(Path(__file__).parent), env=env
+        ))
+    return peers
+
+
+def _stop_peers(peers: List[subprocess.Popen], terminate: bool):
+    deadline = time.time() + (0 if terminate else PEER_EXIT_SECONDS)
+    for peer in peers:
+        try:
+            peer.wait(timeout=max(deadline - time.time(), 0))
+        except subprocess.TimeoutExpired:
+            peer.kill()
+            peer.wait()
+
+
+def run_job(job_id: int, db_path: str, workspace_dir: str):
+    """Entry point of the training worker process: run one job to completion, pause or cancellation
+
+    A job configured with num_workers > 1 trains data-parallel on the CPU: this
+    process becomes rank 0, which alone records progress and outcome, and
+    starts the other ranks as child processes.
+    """
+    jobs = JobQueue(db_path)
+    peers = []
+    failed = True
+    try:
+        world_size = _world_size(jobs.get(job_id)["config"].get("num_workers", 1))
+        if world_size > 1:
+            port = _free_port()
+            _set_rank_environment(0, world_size, port)
+            # If this process is killed the other ranks fail at their next collective
+            # operation, as gloo sees the connection drop
+            peers = _launch_peers(job_id, db_path, workspace_dir, world_size, port)
+        status = _train(jobs, job_id, workspace_dir, rank=0, world_size=world_size)
+        jobs.set_status(job_id, status)
+        failed = False
+    except Exception as e:
+        print(f"Training error: {e}")
+        jobs.set_status(job_id, FAILED, error=str(e))
+    finally:
+        _leave_process_group()
+        _stop_peers(peers, terminate=failed)
+
+
+def _leave_process_group():
+    if "torch.distributed" in sys.modules:
+        import torch.distributed as dist
+
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+
+def _train(jobs: JobQueue, job_id: int, workspace_dir: str, rank: int = 0, world_size: int = 1) -> str:
+    # Imported here so the API process can reference run_job without loading transformers
+    from trainer_utils import JobControlCallback, TrainingCallback
+
+    is_main = rank == 0
+    if world_size > 1:
+        import torch
+        import torch.distributed as dist
+
+        torch.set_num_threads(threads_per_worker(world_size))
+        dist.init_process_group("gloo", timeout=timedelta(seconds=ModelManager.DDP_TIMEOUT))
+
+    job = jobs.get(job_id)
+    config = job["config"]
+    data_processor = DataProcessor(workspace_dir)
+    model_manager = ModelManager(workspace_dir)
+    resume_checkpoint = job["resume_checkpoint"]
+    if resume_checkpoint and not Path(resume_checkpoint).exists():
+        resume_checkpoint = None
+
+    training_mode = config.get("training_mode", "full")
+    memory_profile = config.get("memory_profile", "standard")
+    output_dir = model_manager.get_output_dir(config["project_slug"], training_mode)
+    if resume_checkpoint is None and is_main:
+        # Intermediate checkpoints of an earlier run would otherwise outrank this run's
+        # in checkpoint rotation
+        for stale in output_dir.glob("checkpoint-*"):
+            shutil.rmtree(stale, ignore_errors=True)
+
+    progress = job["progress"]
+    progress.setdefault("start_time", time.time())
+    progress["total_epochs"] = config["epochs"]
+    progress["world_size"] = world_size
+    progress["memory_profile"] = memory_profile
+    progress["threads_per_worker"] = threads_per_worker(world_size) if world_size > 1 else None
+    if is_main:
+        jobs.update_progress(job_id, progress)
+
+    # Load model and tokenizer
+    model, tokenizer = model_manager.load_model_and_tokenizer(
+        config["model_size"], config["project_slug"],
+        training_mode=training_mode, lora_rank=config.get("lora_rank", 8)
+    )
+    model_manager.apply_memory_profile(model, memory_profile)
+
+    # Prepare training data; rank 0 tokenizes into the cache before the other ranks read it
+    def prepare_data():
+        return data_processor.prepare_training_data(
+            data_processor.load_corpus(config["project_slug"]),
+            model_manager.MODEL_CONFIGS[config["model_size"]]["model_name"],
+            packing=config["packing"]
+        )
+
+    train_dataset = prepare_data() if is_main else None
+    # Rank 0 picks the micro-batch size for every rank
+    batch_tuning = None
+    if TUNE_BATCH_SIZE and is_main:
+        batch_tuning = model_manager.tune_batch_size(model, config, train_dataset.max_length, world_size)
+    if world_size > 1:
+        # Also holds the other ranks back until rank 0 has filled the token cache
+        shared = [batch_tuning]
+        dist.broadcast_object_list(shared, src=0)
+        batch_tuning = shared[0]
+    if train_dataset is None:
+        train_dataset = prepare_data()
+
+    # Create trainer; num_train_epochs covers every epoch in one train() call
+    trainer = model_manager.create_trainer(
+        model, tokenizer, train_dataset, config["project_slug"],
+        config["epochs"], config["learning_rate"], training_mode=training_mode,
+        world_size=world_size, micro_batch_size=batch_tuning["micro_batch_size"] if batch_tuning else None,
+        memory_profile=memory_profile
+    )
+    progress["batch_size"] = trainer.args.per_device_train_batch_size
+    progress["gradient_accumulation_steps"] = trainer.args.gradient_accumulation_steps
+    progress["effective_batch_size"] = (trainer.args.per_device_train_batch_size
+                                        * trainer.args.gradient_accumulation_steps * world_size)
+
+    # Report how much of each batch is real data rather than padding
+    progress["data_stats"] = train_dataset.stats(trainer.args.per_device_train_batch_size)
+    data_stats = progress["data_stats"]
+    trainer.add_callback(TrainingCallback(
+        progress,
+        tokens_per_sample=data_stats["real_tokens"] / max(data_stats["samples"], 1),
+        on_update=(lambda p: jobs.update_progress(job_id, p)) if is_main else None
+    ))
+    job_control = JobControlCallback(jobs, job_id)
+    trainer.add_callback(job_control)
+
+    if resume_checkpoint and is_main:
+        print(f"Resuming job {job_id} from {resume_checkpoint}")
+    trainer.train(resume_from_checkpoint=resume_checkpoint)
+
+    if job_control.action == "cancel":
+        return CANCELLED
+    if job_control.action == "pause":
+        return PAUSED
+
+    # Save final model (only the adapter weights for LoRA runs); the Trainer writes from rank 0 only
+    trainer.save_model()
+    if not is_main:
+        return DONE
+    tokenizer.save_pretrained(str(Path(trainer.args.output_dir)))
+    jobs.set_resume_checkpoint(job_id, None)
+    progress["completed"] = True
+    jobs.update_progress(job_id, progress)
+    return DONE
+
+
+if __name__ == "__main__":
+    # A non-zero rank of a data-parallel job, started by rank 0 with the RANK/WORLD_SIZE environment set
+    parser = argparse.ArgumentParser(description="Run one rank of a data-parallel training job")
+    parser.add_argument("job_id", type=int)
+    parser.add_argument("db_path")
+    parser.add_argument("workspace_dir")
+    args = parser.parse_args()
+    try:
+        _train(JobQueue(args.db_path), args.job_id, args.workspace_dir,
+               rank=int(os.environ["RANK"]), world_size=int(os.environ["WORLD_SIZE"]))
+    finally:
+        _leave_process_group()
@@ -1,5 +1,5 @@
-import React, { useState } from 'react'
-import { useQuery } from 'react-query'
+import React, { useEffect, useState } from 'react'
+import { useQuery, useQueryClient } from 'react-query'
 import { Tabs, TabsContent, TabsList, TabsTrigger } from './components/ui/tabs'
 import DataUpload from './components/DataUpload'
 import TrainingWizard from './components/TrainingWizard'
@@ -12,6 +12,8 @@ function App() {
   const [currentProject, setCurrentProject] = useState('')
   const [activeTab, setActiveTab] = useState('upload')
   const [isTraining, setIsTraining] = useState(false)
+  const [streamConnected, setStreamConnected] = useState(false)
+  const queryClient = useQueryClient()
 
   const { data: systemInfo } = useQuery(
     'system-info',
@@ -19,19 +21,56 @@ function App() {
     { refetchInterval: 5000 }
   )
 
+  const handleTrainingStatus = (data) => {
+    setIsTraining(data.is_training)
+    if (data.is_training === false && data.progress?.completed) {
+      setActiveTab('chat')
+    }
+  }
+
+  // Training progress is pushed over a WebSocket; polling is only a fallback
+  // for when the stream is unavailable
   const { data: trainingStatus } = useQuery(
     'training-status',
     () => fetch('/api/training-status').then(res => res.json()),
     { 
-      refetchInterval: isTraining ? 1000 : 5000,
-      onSuccess: (data) => {
-        setIsTraining(data.is_training)
-        if (data.is_training === false && data.progress?.completed) {
-          setActiveTab('chat')
+      refetchInterval: streamConnected ? false : (isTraining ? 1000 : 5000),
+      onSuccess: handleTrainingStatus
+    }
+  )
+
+  useEffect(() => {
+    let ws
+    let reconnectTimer
+    let closed = false
+
+    const connect = () => {
+      const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+      ws = new WebSocket(`${protocol}//${window.location.hostname}:8000/training-stream`)
+
+      ws.onopen = () => setStreamConnected(true)
+
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data)
+        queryClient.setQueryData('training-status', data)
+        handleTrainingStatus(data)
+      }
+
+      ws.onclose = () => {
+        setStreamConnected(false)
+        if (!closed) {
+          reconnectTimer = setTimeout(connect, 3000)
         }
       }
     }
-  )
+
+    connect()
+    return () => {
+      closed = true
+      clearTimeout(reconnectTimer)
+      ws.close()
+    }
+  }, [])
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100">
@@ -32,7 +32,7 @@ const ProgressDashboard = ({ trainingStatus, onTrainingComplete }) => {
   }
 
   const progressPercent = Math.round(progress.progress_percent || 0)
-  const currentEpoch = progress.current_epoch || 0
+  const currentEpoch = Math.ceil(progress.current_epoch || 0)
   const totalEpochs = progress.total_epochs || 1
   const currentStep = progress.current_step || 0
   const totalSteps = progress.total_steps || 100
@@ -157,6 +157,12 @@ const ProgressDashboard = ({ trainingStatus, onTrainingComplete }) => {
               <div>[INFO] Current epoch: {currentEpoch}/{totalEpochs}</div>
               <div>[INFO] Current step: {currentStep}/{totalSteps}</div>
               <div>[INFO] Progress: {progressPercent}%</div>
+              {progress.tokens_per_second > 0 && (
+                <div>[INFO] Throughput: {Math.round(progress.tokens_per_second)} tokens/sec</div>
+              )}
+              {progress.learning_rate !== undefined && (
+                <div>[INFO] Learning rate: {progress.learning_rate.toExponential(2)}</div>
+              )}
               {progress.eta_minutes && (
                 <div>[INFO] Estimated time remaining: {formatTime(progress.eta_minutes)}</div>
               )}
@@ -36,7 +36,8 @@ const TrainingWizard = ({ currentProject, onTrainingStarted }) => {
     epochs: 1,
     learningRate: 5e-5,
     useCase: 'general',
-    temperature: 0.7
+    temperature: 0.7,
+    trainingMode: 'full'
   })
   const [isStarting, setIsStarting] = useState(false)
 
@@ -60,7 +61,8 @@ const TrainingWizard = ({ currentProject, onTrainingStarted }) => {
           epochs: config.epochs,
           learning_rate: config.learningRate,
           use_case: config.useCase,
-          temperature: config.temperature
+          temperature: config.temperature,
+          training_mode: config.trainingMode
         })
       })
 
@@ -233,6 +235,20 @@ const TrainingWizard = ({ currentProject, onTrainingStarted }) => {
               <option value={1e-4}>1e-4 (Aggressive)</option>
             </select>
           </div>
+          
+          <div>
+            <label className="block text-sm font-medium text-gray-700 mb-1">
+              Training Mode
+            </label>
+            <select
+              value={config.trainingMode}
+              onChange={(e) => setConfig(prev => ({ ...prev, trainingMode: e.target.value }))}
+              className="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+            >
+              <option value="full">Full fine-tune (all weights)</option>
+              <option value="lora">LoRA adapter (a few MB per project)</option>
+            </select>
+          </div>
         </div>
       </div>
 
@@ -0,0 +1,676 @@
+#!/usr/bin/env python3
+"""
+Make Your Own LLM - Benchmark suite
+
+Times the hot paths of both servers on CPU with a small, randomly initialised
+GPT-2 and synthetic data, so it runs offline and results are comparable
+between commits:
+
+    upload     DataProcessor.process_upload for txt, jsonl, csv and pdf files
+    prepare    DataProcessor.prepare_training_data (tokenization and packing)
+    train      Optimizer steps on packed samples (samples/sec, tokens/sec)
+    generate   Single-request greedy generation through the batching scheduler
+    serve      Concurrent /chat requests against the chat server app
+    memory     Peak RSS of Trainer steps under each training memory setting
+
+Every benchmark runs warm-up iterations first, then repeats the measurement
+and reports mean, standard deviation and percentiles. Results are written as
+JSON and compared with a stored baseline (a previous results file) by median.
+The memory benchmark runs only when selected. It trains each setting in a
+fresh process and samples RSS during training, so every peak belongs to that
+setting's training steps alone. By default it uses a random GPT-2-small-sized
+model; --memory-model picks the tiny model or a real model tier instead.
+
+Usage:
+    python scripts/benchmark.py
+    python scripts/benchmark.py --only generate,serve --repeat 20
+    python scripts/benchmark.py --save-baseline
+    python scripts/benchmark.py --fail-on-regression --tolerance 0.1
+    python scripts/benchmark.py --only serve --chat-url http://localhost:8001 --project my-project
+    python scripts/benchmark.py --only memory --memory-model plus --seq-len 512
+"""
+import argparse
+import asyncio
+import csv
+import gc
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "backend"))
+
+BENCHMARKS = ("upload", "prepare", "train", "generate", "serve", "memory")
+# The memory benchmark takes minutes and several GB, so it only runs when asked for
+DEFAULT_BENCHMARKS = ("upload", "prepare", "train", "generate", "serve")
+RESULTS_DIR = ROOT / "data" / "benchmarks"
+BENCH_PROJECT = "benchmark"
+# Settings that change the work being measured; runs that differ in them are not comparable
+WORKLOAD_SETTINGS = ("docs", "seq_len", "batch_size", "prompt", "max_new_tokens", "concurrency", "chat_url", "threads",
+                     "memory_model")
+
+# Architecture of the random model; small enough to run anywhere, big enough to exercise real kernels
+TINY_MODEL = {"n_layer": 4, "n_embd": 128, "n_head": 4, "n_positions": 512}
+TINY_VOCAB = 1000
+# Default model of the memory benchmark: GPT-2 small's shape, so weights, gradients and optimizer
+# state outweigh the fixed cost of the Trainer as they do for the real tiers
+SMALL_MODEL = {"n_layer": 12, "n_embd": 768, "n_head": 12, "n_positions": 512}
+
+# Training memory settings: each technique of the lean profile alone, then all of them together
+MEMORY_SETTINGS = {
+    "standard": {},
+    "checkpointing": {"gradient_checkpointing": True},
+    "frozen_embeddings": {"freeze_embeddings": True},
+    "lean_optimizer": {"lean_optimizer": True},
+    "lean": {"gradient_checkpointing": True, "freeze_embeddings": True, "lean_optimizer": True}
+}
+MEMORY_STEPS = 3
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linear-interpolated percentile of already sorted values, q in [0, 100]"""
+    position = (len(sorted_values) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        "runs": len(values),
+        "mean_ms": round(statistics.mean(values), 3),
+        "stdev_ms": round(statistics.stdev(values), 3) if len(values) > 1 else 0.0,
+        "min_ms": round(values[0], 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p90_ms": round(percentile(values, 90), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3)
+    }
+
+
+def measure(fn: Callable[[], Any], warmup: int, repeat: int) -> Dict[str, Any]:
+    """Call fn warmup + repeat times and summarize the timed calls; returns the last call's result too"""
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": seconds, "result": result}
+
+
+def sample_documents(count: int) -> List[str]:
+    """Deterministic synthetic corpus built from the bundled sample stories"""
+    paragraphs = [p.strip() for p in (ROOT / "sample_stories.txt").read_text(encoding="utf-8").split("\n\n") if p.strip()]
+    return [f"Story {i}. {paragraphs[i % len(paragraphs)]}" for i in range(count)]
+
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    """Minimal PDF with one block of Helvetica text lines per page (no PDF library needed)"""
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", "", "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 9 Tf 11 TL 36 800 Td " + " ".join(f"({escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1", errors="replace")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def make_upload_files(workdir: Path, documents: List[str]) -> Dict[str, Path]:
+    files = {fmt: workdir / f"upload.{fmt}" for fmt in ("txt", "jsonl", "csv", "pdf")}
+    files["txt"].write_text("\n\n".join(documents), encoding="utf-8")
+    with open(files["jsonl"], "w", encoding="utf-8") as f:
+        for document in documents:
+            f.write(json.dumps({"text": document}) + "\n")
+    with open(files["csv"], "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "text"])
+        writer.writerows(enumerate(documents))
+    # Text wrapped into 60 lines of ~90 characters per page
+    words = " ".join(documents).split()
+    lines, line = [], ""
+    for word in words:
+        if len(line) + len(word) > 90:
+            lines.append(line)
+            line = ""
+        line += word + " "
+    lines.append(line)
+    write_pdf(files["pdf"], [lines[i:i + 60] for i in range(0, len(lines), 60)])
+    return files
+
+
+def make_tiny_model(model_dir: Path, documents: List[str], seed: int, architecture: Dict[str, int] = TINY_MODEL):
+    """Train a byte-level BPE tokenizer on the corpus and save a randomly initialised GPT-2 with it"""
+    import torch
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    torch.manual_seed(seed)
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(documents, vocab_size=TINY_VOCAB, special_tokens=["<|endoftext|>"])
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe._tokenizer,
+        eos_token="<|endoftext|>",
+        bos_token="<|endoftext|>",
+        unk_token="<|endoftext|>"
+    )
+    config = GPT2Config(
+        **architecture,
+        vocab_size=len(tokenizer),
+        bos_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+    GPT2LMHeadModel(config).save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+
+
+def load_tiny_model(model_dir: Path):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(model_dir).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+
+def bench_upload(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from data_utils import DataProcessor
+
+    processor = DataProcessor(str(ctx["workdir"] / "workspace"))
+    results = {}
+    for fmt, path in ctx["files"].items():
+        try:
+            run = measure(lambda: processor.process_upload(str(path), fmt), args.warmup, args.repeat)
+        except ImportError as e:
+            results[fmt] = {"skipped": f"missing dependency: {e.name}"}
+            continue
+        texts = run["result"]
+        results[fmt] = {
+            **summarize(run["seconds"]),
+            "file_bytes": path.stat().st_size,
+            "documents": len(texts),
+            "mb_per_second": round(path.stat().st_size / 1024 ** 2 / statistics.median(run["seconds"]), 3)
+        }
+    return results
+
+
+def bench_prepare(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from data_utils import DataProcessor
+
+    processor = DataProcessor(str(ctx["workdir"] / "workspace"))
+    # Ad-hoc texts go through a fresh corpus store each call, so every run tokenizes from scratch
+    run = measure(
+        lambda: processor.prepare_training_data(ctx["documents"], str(ctx["model_dir"]), max_length=args.seq_len),
+        args.warmup, args.repeat
+    )
+    dataset = run["result"]
+    stats = dataset.stats()
+    return {
+        **summarize(run["seconds"]),
+        "documents": len(ctx["documents"]),
+        "samples": stats["samples"],
+        "tokens": stats["real_tokens"],
+        "tokens_per_second": round(stats["real_tokens"] / statistics.median(run["seconds"]), 1)
+    }
+
+
+def bench_train(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    import torch
+    from data_utils import DataProcessor
+    from token_cache import CausalLMCollator
+
+    model, tokenizer = load_tiny_model(ctx["model_dir"])
+    model.train()
+    dataset = DataProcessor(str(ctx["workdir"] / "workspace")).prepare_training_data(
+        ctx["documents"], str(ctx["model_dir"]), max_length=args.seq_len
+    )
+    collator = CausalLMCollator(tokenizer.pad_token_id)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    batches = [
+        collator([dataset[j % len(dataset)] for j in range(i, i + args.batch_size)])
+        for i in range(0, args.batch_size * 4, args.batch_size)
+    ]
+    step = {"index": 0}
+
+    def train_step():
+        batch = batches[step["index"] % len(batches)]
+        step["index"] += 1
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        return int(batch["attention_mask"].sum())
+
+    run = measure(train_step, args.warmup, args.repeat)
+    median = statistics.median(run["seconds"])
+    return {
+        **summarize(run["seconds"]),
+        "batch_size": args.batch_size,
+        "seq_len": args.seq_len,
+        "samples_per_second": round(args.batch_size / median, 2),
+        "tokens_per_second": round(run["result"] / median, 1)
+    }
+
+
+def bench_generate(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from batch_scheduler import BatchScheduler
+
+    model, tokenizer = load_tiny_model(ctx["model_dir"])
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=1)
+    first_token_seconds = []
+
+    def generate():
+        submitted = time.time()
+        request = scheduler.submit(args.prompt, max_new_tokens=args.max_new_tokens, temperature=0)
+        first = None
+        for event in request.events():
+            if first is None and "time" in event:
+                first = event["time"] - submitted
+        first_token_seconds.append(first or 0.0)
+        return len(request.generated)
+
+    try:
+        run = measure(generate, args.warmup, args.repeat)
+    finally:
+        scheduler.stop()
+    ttft = summarize(first_token_seconds[args.warmup:])
+    return {
+        **summarize(run["seconds"]),
+        "time_to_first_token_p50_ms": ttft["p50_ms"],
+        "output_tokens": run["result"],
+        "tokens_per_second": round(run["result"] / statistics.median(run["seconds"]), 1)
+    }
+
+
+async def _serve_load(client, project: str, args) -> Dict[str, Any]:
+    async def one(i: int):
+        start = time.perf_counter()
+        response = await client.post("/chat", json={
+            "message": f"{args.prompt} ({i})",
+            "project_slug": project,
+            "temperature": 0,
+            "max_tokens": args.max_new_tokens,
+            "cache": False
+        })
+        response.raise_for_status()
+        return time.perf_counter() - start, response.json()["output_tokens"]
+
+    async def round_():
+        return await asyncio.gather(*[one(i) for i in range(args.concurrency)])
+
+    for _ in range(args.warmup):
+        await round_()
+    latencies, tokens = [], 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for seconds, output_tokens in await round_():
+            latencies.append(seconds)
+            tokens += output_tokens
+    elapsed = time.perf_counter() - start
+    return {
+        **summarize(latencies),
+        "concurrency": args.concurrency,
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "tokens_per_second": round(tokens / elapsed, 1)
+    }
+
+
+def bench_serve(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    import httpx
+
+    if args.chat_url:
+        async def run_remote():
+            async with httpx.AsyncClient(base_url=args.chat_url, timeout=300) as client:
+                return await _serve_load(client, args.project, args)
+        return {"target": args.chat_url, **asyncio.run(run_remote())}
+
+    # In-process: the chat server app with a workspace holding the tiny model as a trained project
+    import serve
+
+    workspace = ctx["workdir"] / "serve-workspace"
+    shutil.copytree(ctx["model_dir"], workspace / BENCH_PROJECT / "checkpoint")
+    (workspace / BENCH_PROJECT / "config.json").write_text(json.dumps({"model_size": "toy", "training_mode": "full"}))
+    serve.model_manager.workspace_dir = workspace
+
+    async def run_local():
+        transport = httpx.ASGITransport(app=serve.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+            try:
+                return await _serve_load(client, BENCH_PROJECT, args)
+            finally:
+                model_data = serve.model_cache.pop(BENCH_PROJECT)
+                if model_data is not None:
+                    serve._release_model(BENCH_PROJECT, model_data)
+    return {"target": "in-process", **asyncio.run(run_local())}
+
+
+class RssSampler:
+    """Peak resident set size of this process while the block runs, sampled in a background thread
+
+    The OS high-water mark (ru_maxrss) cannot be reset, so it would also take
+    in the peaks of importing, loading the model and tokenizing.
+    """
+
+    def __init__(self, interval: float = 0.002):
+        import psutil
+
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self.start_mb = self.peak_mb = 0.0
+
+    def _rss_mb(self) -> float:
+        return self._process.memory_info().rss / 1024 ** 2
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, self._rss_mb())
+
+    def __enter__(self):
+        gc.collect()
+        self.start_mb = self.peak_mb = self._rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self._rss_mb())
+
+
+def memory_run(args) -> Dict[str, Any]:
+    """Child process of bench_memory: a few Trainer steps under one memory setting"""
+    from data_utils import DataProcessor
+    from model_utils import ModelManager
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    workspace = Path(args.memory_workspace)
+    manager = ModelManager(str(workspace))
+    manager.MEMORY_PROFILES = {
+        **manager.MEMORY_PROFILES,
+        args.memory_setting: {**manager.MEMORY_PROFILES["standard"], **MEMORY_SETTINGS[args.memory_setting]}
+    }
+    dataset = DataProcessor(str(workspace)).prepare_training_data(
+        sample_documents(args.docs), args.memory_model_dir, max_length=args.seq_len
+    )
+    model = AutoModelForCausalLM.from_pretrained(args.memory_model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(args.memory_model_dir)
+    tokenizer.pad_token = tokenizer.eos_token
+    manager.apply_memory_profile(model, args.memory_setting)
+    trainer = manager.create_trainer(
+        model, tokenizer, dataset, BENCH_PROJECT, micro_batch_size=args.batch_size,
+        memory_profile=args.memory_setting
+    )
+    trainer.args.max_steps = MEMORY_STEPS
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        trainer.train()
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds_per_step": elapsed / MEMORY_STEPS,
+        "loaded_rss_mb": round(rss.start_mb, 1),
+        "peak_rss_mb": round(rss.peak_mb, 1),
+        "trainable_parameters": sum(p.numel() for p in model.parameters() if p.requires_grad),
+        "optimizer": type(trainer.optimizer.optimizer).__name__,
+        "micro_batch_size": trainer.args.per_device_train_batch_size,
+        "gradient_accumulation_steps": trainer.args.gradient_accumulation_steps
+    }
+
+
+def bench_memory(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    # Every setting runs in its own process, so freed memory of one cannot be reused by the next
+    from model_utils import ModelManager
+
+    if args.memory_model == "tiny":
+        model_dir = str(ctx["model_dir"])
+    elif args.memory_model == "small":
+        model_dir = str(ctx["workdir"] / "small-model")
+        make_tiny_model(Path(model_dir), ctx["documents"], args.seed, SMALL_MODEL)
+    else:
+        model_dir = ModelManager.MODEL_CONFIGS[args.memory_model]["model_name"]
+    results = {}
+    for setting in MEMORY_SETTINGS:
+        output = ctx["workdir"] / f"memory-{setting}.json"
+        command = [
+            sys.executable, str(Path(__file__).resolve()),
+            "--memory-setting", setting, "--memory-model-dir", model_dir,
+            "--memory-workspace", str(ctx["workdir"] / f"memory-{setting}"), "--output", str(output),
+            "--docs", str(args.docs), "--seq-len", str(args.seq_len), "--batch-size", str(args.batch_size),
+            "--seed", str(args.seed)
+        ]
+        if args.threads:
+            command += ["--threads", str(args.threads)]
+        run = subprocess.run(command, capture_output=True, text=True)
+        if run.returncode != 0:
+            results[setting] = {"failed": (run.stderr.strip().splitlines() or [f"exit status {run.returncode}"])[-1]}
+            continue
+        entry = json.loads(output.read_text())
+        results[setting] = {
+            **summarize([entry.pop("seconds_per_step")]),
+            **entry,
+            "training_rss_mb": round(entry["peak_rss_mb"] - entry["loaded_rss_mb"], 1)
+        }
+    return {"model": args.memory_model, **results}
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, Any]]:
+    """Map "benchmark/case" names to entries that carry timing stats"""
+    flat = {}
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        key = f"{prefix}{name}"
+        if "p50_ms" in value:
+            flat[key] = value
+        else:
+            flat.update(flatten(value, key + "/"))
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Median latency of every benchmark present in both runs; slower than baseline by more than tolerance is a regression"""
+    rows = []
+    base = flatten(baseline.get("benchmarks", {}))
+    for name, entry in flatten(current["benchmarks"]).items():
+        if name not in base:
+            continue
+        ratio = entry["p50_ms"] / max(base[name]["p50_ms"], 1e-9)
+        rows.append({
+            "benchmark": name,
+            "baseline_p50_ms": base[name]["p50_ms"],
+            "p50_ms": entry["p50_ms"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + tolerance
+        })
+    return rows
+
+
+def environment(args) -> Dict[str, Any]:
+    import torch
+    import transformers
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data processing, training and inference on CPU")
+    parser.add_argument("--only", default=",".join(DEFAULT_BENCHMARKS),
+                        help=f"Comma-separated subset of {', '.join(BENCHMARKS)} (default: all but memory)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed iterations before measuring")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed iterations (rounds of requests for serve)")
+    parser.add_argument("--docs", type=int, default=500, help="Synthetic documents in the corpus and upload files")
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--prompt", default="Tell me a story about a clockwork kangaroo")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous /chat requests per serve round")
+    parser.add_argument("--chat-url", help="Benchmark a running chat server instead of the in-process app")
+    parser.add_argument("--project", help="Project to chat with when --chat-url is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument("--output", default=str(RESULTS_DIR / "latest.json"))
+    parser.add_argument("--baseline", default=str(RESULTS_DIR / "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Also store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed median slowdown before flagging (0.15 = 15%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed")
+    parser.add_argument("--memory-model", default="small",
+                        help="Model for the memory benchmark: small or tiny (random, offline), or a model size such as plus")
+    # Internal: one setting of the memory benchmark, run in a child process
+    parser.add_argument("--memory-setting", choices=list(MEMORY_SETTINGS), help=argparse.SUPPRESS)
+    parser.add_argument("--memory-model-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--memory-workspace", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_setting:
+        import torch
+
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        torch.manual_seed(args.seed)
+        Path(args.output).write_text(json.dumps(memory_run(args)))
+        return
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        sys.exit(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+    if args.chat_url and not args.project:
+        sys.exit("--chat-url needs --project")
+
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+
+    print("🔬 Make Your Own LLM - Benchmark")
+    print(f"Benchmarks: {', '.join(selected)}  warmup={args.warmup} repeat={args.repeat}")
+    print(f"Threads: {torch.get_num_threads()}  CPU: {os.cpu_count()} cores")
+    print("")
+
+    runners = {
+        "upload": bench_upload,
+        "prepare": bench_prepare,
+        "train": bench_train,
+        "generate": bench_generate,
+        "serve": bench_serve,
+        "memory": bench_memory
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="llm-benchmark-"))
+    results = {"environment": environment(args), "benchmarks": {}}
+    try:
+        documents = sample_documents(args.docs)
+        ctx = {
+            "workdir": workdir,
+            "documents": documents,
+            "files": make_upload_files(workdir, documents),
+            "model_dir": workdir / "tiny-model"
+        }
+        make_tiny_model(ctx["model_dir"], documents, args.seed)
+        for name in selected:
+            print(f"⏱️  {name}...")
+            results["benchmarks"][name] = runners[name](ctx, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("")
+    print(f"{'Benchmark':<26}{'p50 ms':>12}{'p90 ms':>12}{'p99 ms':>12}{'stdev':>10}")
+    for name, entry in flatten(results["benchmarks"]).items():
+        print(f"{name:<26}{entry['p50_ms']:>12.2f}{entry['p90_ms']:>12.2f}{entry['p99_ms']:>12.2f}{entry['stdev_ms']:>10.2f}")
+    for name, entry in results["benchmarks"].items():
+        for key in ("samples_per_second", "tokens_per_second", "requests_per_second"):
+            if key in entry:
+                print(f"  {name} {key.replace('_', ' ')}: {entry[key]}")
+    if "memory" in results["benchmarks"]:
+        print("")
+        print(f"{'Memory setting':<26}{'peak RSS MB':>14}{'training MB':>14}{'trainable params':>18}  optimizer")
+        for setting, entry in results["benchmarks"]["memory"].items():
+            if not isinstance(entry, dict):
+                continue
+            if "failed" in entry:
+                print(f"{setting:<26}  failed: {entry['failed']}")
+                continue
+            print(f"{setting:<26}{entry['peak_rss_mb']:>14.1f}{entry['training_rss_mb']:>14.1f}"
+                  f"{entry['trainable_parameters']:>18,}  {entry['optimizer']}")
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        rows = compare(results, baseline, args.tolerance)
+        results["comparison"] = {"baseline": str(baseline_path), "tolerance": args.tolerance, "results": rows}
+        regressions = [row for row in rows if row["regression"]]
+        print("")
+        print(f"Compared with {baseline_path}:")
+        baseline_config = baseline.get("environment", {}).get("config", {})
+        differing = [key for key in WORKLOAD_SETTINGS if baseline_config.get(key) != getattr(args, key)]
+        if differing:
+            print(f"  ⚠️  Baseline was run with different {', '.join(differing)}; timings may not be comparable")
+        for row in rows:
+            marker = "❌" if row["regression"] else "✅"
+            print(f"  {marker} {row['benchmark']:<26}{row['baseline_p50_ms']:>10.2f} -> "
+                  f"{row['p50_ms']:>10.2f} ms ({row['ratio']:.2f}x)")
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print("")
+    print(f"Results written to {output}")
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
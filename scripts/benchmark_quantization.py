@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Make Your Own LLM - Quantized inference benchmark
+
+Compares fp32 and dynamic int8 serving of one checkpoint on CPU: load time,
+model memory, generation latency and tokens/sec through the chat server's
+batching scheduler, and the perplexity change on a text file.
+
+Usage:
+    python scripts/benchmark_quantization.py --project my-project
+    python scripts/benchmark_quantization.py --checkpoint path/to/checkpoint --json results.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "backend"))
+
+import psutil
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from batch_scheduler import BatchScheduler
+from model_cache import model_size_bytes
+from quantization import load_or_quantize
+
+
+def load(checkpoint: Path, mode: str):
+    rss_before = psutil.Process().memory_info().rss
+    start = time.time()
+    if mode == "int8":
+        model = load_or_quantize(checkpoint, "int8")
+    else:
+        model = AutoModelForCausalLM.from_pretrained(str(checkpoint)).eval()
+    load_seconds = time.time() - start
+    rss_delta = psutil.Process().memory_info().rss - rss_before
+    return model, load_seconds, rss_delta
+
+
+def generation_speed(model, tokenizer, prompt: str, max_new_tokens: int, runs: int):
+    """Greedy generation through the serving scheduler, one request at a time"""
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=1)
+    try:
+        # Warm up kernels and allocator before timing
+        list(scheduler.submit(prompt, max_new_tokens=4, temperature=0).events())
+        latencies = []
+        tokens = 0
+        for _ in range(runs):
+            start = time.time()
+            request = scheduler.submit(prompt, max_new_tokens=max_new_tokens, temperature=0)
+            list(request.events())
+            latencies.append(time.time() - start)
+            tokens += len(request.generated)
+    finally:
+        scheduler.stop()
+    return sum(latencies) / len(latencies), tokens / sum(latencies)
+
+
+def perplexity(model, tokenizer, text: str, max_tokens: int) -> float:
+    """Perplexity over non-overlapping context-sized windows of the text"""
+    input_ids = tokenizer.encode(text)[:max_tokens]
+    window = getattr(model.config, "n_positions", None) or getattr(model.config, "max_position_embeddings", 1024)
+    total_nll = 0.0
+    total_tokens = 0
+    with torch.no_grad():
+        for start in range(0, len(input_ids), window):
+            chunk = torch.tensor([input_ids[start:start + window]])
+            if chunk.shape[1] < 2:
+                continue
+            loss = model(input_ids=chunk, labels=chunk).loss
+            total_nll += loss.item() * (chunk.shape[1] - 1)
+            total_tokens += chunk.shape[1] - 1
+    return math.exp(total_nll / max(total_tokens, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fp32 vs int8 CPU inference")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--project", help="Project slug under the data directory")
+    source.add_argument("--checkpoint", help="Path to a saved model directory")
+    parser.add_argument("--data-dir", default=str(ROOT / "data"))
+    parser.add_argument("--prompt", default="Tell me a story about a clockwork kangaroo")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--eval-file", default=str(ROOT / "sample_stories.txt"))
+    parser.add_argument("--max-eval-tokens", type=int, default=4096)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    checkpoint = Path(args.checkpoint) if args.checkpoint else Path(args.data_dir) / args.project / "checkpoint"
+    if not (checkpoint / "config.json").exists():
+        sys.exit(f"No checkpoint found at {checkpoint}")
+
+    tokenizer = AutoTokenizer.from_pretrained(str(checkpoint))
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    with open(args.eval_file, "r", encoding="utf-8") as f:
+        eval_text = f.read()
+
+    print("🔬 Quantized inference benchmark")
+    print(f"Checkpoint: {checkpoint}")
+    print(f"Threads: {torch.get_num_threads()}  CPU: {os.cpu_count()} cores")
+    print("")
+
+    results = {}
+    for mode in ("fp32", "int8"):
+        model, load_seconds, rss_delta = load(checkpoint, mode)
+        latency, tokens_per_second = generation_speed(
+            model, tokenizer, args.prompt, args.max_new_tokens, args.runs
+        )
+        results[mode] = {
+            "load_seconds": round(load_seconds, 3),
+            "model_bytes": model_size_bytes(model),
+            "rss_delta_bytes": rss_delta,
+            "latency_ms": round(latency * 1000, 2),
+            "tokens_per_second": round(tokens_per_second, 2),
+            "perplexity": round(perplexity(model, tokenizer, eval_text, args.max_eval_tokens), 4)
+        }
+        del model
+
+    fp32, int8 = results["fp32"], results["int8"]
+    results["comparison"] = {
+        "speedup": round(int8["tokens_per_second"] / max(fp32["tokens_per_second"], 1e-9), 3),
+        "memory_ratio": round(int8["model_bytes"] / max(fp32["model_bytes"], 1), 3),
+        "perplexity_delta": round(int8["perplexity"] - fp32["perplexity"], 4),
+        "perplexity_delta_percent": round((int8["perplexity"] / fp32["perplexity"] - 1) * 100, 2)
+    }
+
+    print(f"{'':<20}{'fp32':>14}{'int8':>14}")
+    for key, label, scale in (
+        ("load_seconds", "Load time (s)", 1),
+        ("model_bytes", "Model size (MB)", 1024 ** 2),
+        ("rss_delta_bytes", "RSS increase (MB)", 1024 ** 2),
+        ("latency_ms", "Latency (ms)", 1),
+        ("tokens_per_second", "Tokens/sec", 1),
+        ("perplexity", "Perplexity", 1),
+    ):
+        print(f"{label:<20}{fp32[key] / scale:>14.2f}{int8[key] / scale:>14.2f}")
+    comparison = results["comparison"]
+    print("")
+    print(f"✅ int8 speedup: {comparison['speedup']:.2f}x, "
+          f"memory: {comparison['memory_ratio'] * 100:.0f}% of fp32, "
+          f"perplexity delta: {comparison['perplexity_delta']:+.4f} ({comparison['perplexity_delta_percent']:+.2f}%)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()